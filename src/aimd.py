@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+""" aimd.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Adaptive (AIMD) control of the number of concurrent FTP transfers per
+    worker, from observed throughput and transient error replies.
+
+    Notes:
+        * Every 'settings.aimdinterval' seconds, the controller compares the
+            bytes/sec received in the last window with the window before. The
+            limit grows by one while throughput improves by at least
+            'settings.aimdgain', is held when throughput is flat, and is
+            halved when the window saw transient errors (ftplib.error_temp,
+            e.g. 421 too many connections or 425 can't open data connection).
+        * The limit stays between 1 and 'settings.dlmaxconn'. Changes to the
+            limit are printed to the worker log, and every decision is kept
+            in 'controller.decisions'.
+        * An FTPPool or AsyncFTPPool given a controller checks out at most
+            'controller.limit' sessions at once, and closes idle sessions
+            above the limit.
+
+    Classes:
+        * AIMDController: Additive-increase, multiplicative-decrease limit on
+            in-flight transfers.
+"""
+
+import os, sys, time, threading
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+class AIMDController:
+    """ AIMDController
+
+        Additive-increase, multiplicative-decrease limit on in-flight
+        transfers. Thread-safe, and usable from coroutines with
+        try_acquire().
+
+        Arguments:
+            * start (int) : Initial limit.
+            * maxconn (int) : Max limit.
+            * interval (float) : Seconds per measurement window.
+            * gain (float) : Min relative throughput gain to grow the limit.
+            * name (str) : Name printed with each change to the limit.
+    """
+    def __init__(self, start=settings.ftpnconn, maxconn=settings.dlmaxconn,
+        interval=settings.aimdinterval, gain=settings.aimdgain, name='aimd'):
+        self.maxconn = max(1, int(maxconn))
+        self.limit = min(self.maxconn, max(1, int(start)))
+        self.interval = interval
+        self.gain = gain
+        self.name = name
+        self.inflight = 0
+        self.nbytes = 0
+        self.errors = {}
+        self.last_rate = None
+        self.window_start = time.time()
+        self.decisions = []
+        self.cond = threading.Condition()
+
+    def try_acquire(self):
+        """ try_acquire
+
+            Take an in-flight slot if fewer than limit are taken.
+
+            Returns:
+                * (bool) : True if a slot was taken.
+        """
+        with self.cond:
+            self._tick()
+            if self.inflight < self.limit:
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """ acquire
+
+            Wait for and take an in-flight slot.
+        """
+        with self.cond:
+            while True:
+                self._tick()
+                if self.inflight < self.limit:
+                    self.inflight += 1
+                    return
+                self.cond.wait(self.interval)
+
+    def release(self):
+        """ release
+
+            Return an in-flight slot.
+        """
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify()
+
+    def record_bytes(self, nbytes):
+        """ record_bytes
+
+            Count bytes received by a transfer.
+        """
+        with self.cond:
+            self.nbytes += nbytes
+            self._tick()
+
+    def record_error(self, resp):
+        """ record_error
+
+            Count a transient error reply, e.g. '421 Too many connections'.
+        """
+        with self.cond:
+            code = str(resp)[:3]
+            self.errors[code] = self.errors.get(code, 0) + 1
+            self._tick()
+
+    def _tick(self):
+        """ _tick
+
+            Close the measurement window if it has run for interval seconds,
+            and update the limit. Called with the lock held.
+        """
+        now = time.time()
+        elapsed = now - self.window_start
+        if elapsed < self.interval:
+            return
+        rate = self.nbytes / elapsed
+        old = self.limit
+        if self.errors:
+            self.limit = max(1, self.limit // 2)
+            action = 'decrease'
+        elif self.last_rate is None or rate > self.last_rate * (1 + self.gain):
+            self.limit = min(self.maxconn, self.limit + 1)
+            action = 'increase'
+        else:
+            action = 'hold'
+        if self.limit != old:
+            print(self.name+': '+action+' limit '+str(old)+' -> '
+                +str(self.limit)+', '+'%.2f' % (rate / 1e6)+' MB/s, '
+                +str(self.inflight)+' in flight, errors '+str(self.errors))
+        self.decisions.append({'time' : now, 'action' : action, 'limit' :
+            self.limit, 'rate' : rate, 'inflight' : self.inflight, 'errors' :
+            dict(self.errors)})
+        # a decrease resets the baseline, so the next window can grow again
+        self.last_rate = None if action == 'decrease' else rate
+        self.nbytes = 0
+        self.errors = {}
+        self.window_start = now
+        if self.limit > old:
+            self.cond.notify_all()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+""" bench_dl.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Download throughput benchmark for dl.py and dl_async.py, run against the
+    local GEO stand-in server in geostandin.py.
+
+    Notes:
+        * Each run serves a synthetic tree of nsamples GSM IDs (with one GSE
+            ID per 20 samples), and downloads all idats (dl_idat) or all GSE
+            soft files (dl_soft) into a fresh temp working directory.
+        * Reports files/sec, MB/sec, and round trips (FTP commands) for each
+            run. Default sizes are 1k, 10k, and 50k samples.
+        * RMDB is not queried (an empty date map is passed), and host-wide
+            rate limits are off unless '--ratelimit' is set.
+        * With '--passes 2', downloads are repeated in the same working
+            directory and only the last pass is reported, e.g. to compare a
+            re-sync under the 'hash' and 'stat' validation policies.
+        * With '--mode fast,legacy', each run is repeated with large blocks
+            and preallocation (settings.dlblocksize, settings.dlpreallocate)
+            and with 8 KiB blocks and none, reporting MB/sec and client cpu
+            seconds per GB.
+        * With '--mirror ftp,http,local', each run is repeated against the 
+            stand-in FTP server, the stand-in HTTP server, and a local mirror
+            dir (see transport.py).
+        * Example: 'python3 bench_dl.py --nsamples 1000 --latency 0.02'.
+
+    Functions:
+        * count_files: Count files resolved in a download dictionary.
+        * run_bench: Run one download benchmark against a new stand-in server.
+        * format_results: Format benchmark results as a table.
+"""
+
+import os, sys, time, shutil, tempfile, asyncio, argparse
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from geostandin import GEOTree, start_standin, start_http_standin
+from dl import dl_idat, dl_soft
+from dl_async import dl_idat_async, dl_soft_async
+
+def count_files(dldict, target='idat'):
+    """ count_files
+
+        Count files resolved in a download dictionary, as either validated
+        (new or identical) or skipped as unchanged.
+
+        Arguments:
+            * dldict (dict) : Download dictionary, as from dl_idat or dl_soft.
+            * target (str) : Either 'idat' or 'soft'.
+
+        Returns:
+            * nfiles (int) : Number of files resolved.
+    """
+    def resolved(record):
+        return isinstance(record, list) and len(record) > 3 and (
+            record[-1] in (True, False) or
+            str(record[-1]).startswith('same_as_local'))
+    if target == 'idat':
+        return sum(1 for records in dldict.values() for record in records
+            if resolved(record))
+    return sum(1 for records in dldict.values() if records[-1] in (True,
+        False) or any(resolved(record) for record in records))
+
+def run_bench(nsamples, target='idat', engine='ftplib',
+    nconn=settings.ftpnconn, latency=0, bandwidth=0, failrate=0,
+    idatsize=16384, mlsd=True, ratelimit=False,
+    validation=settings.dlvalidation, passes=1, aimd=False,
+    rejectrate=0, hedge=False, slowrate=0, slowbandwidth=16384,
+    prefetch=settings.dlprefetch, mode='fast', mirror='ftp'):
+    """ run_bench
+
+        Run one download benchmark against a new stand-in server.
+
+        Arguments:
+            * nsamples (int) : Number of GSM IDs in the synthetic tree.
+            * target (str) : Files to download, either 'idat' or 'soft'.
+            * engine (str) : Download engine, either 'ftplib' or 'asyncio'.
+            * nconn (int) : Number of concurrent FTP sessions.
+            * latency (float) : Seconds added by the server to each reply.
+            * bandwidth (int) : Max bytes/sec per data connection, or 0.
+            * failrate (float) : Probability that a transfer is aborted.
+            * idatsize (int) : Size of each synthetic idat, in bytes.
+            * mlsd (Bool.) : Whether the server supports MLSD listings.
+            * ratelimit (Bool.) : Whether to apply host-wide GEO limits.
+            * validation (str) : Validation policy, 'hash' or 'stat'.
+            * passes (int) : Number of download passes in the same working
+                directory. Only the last pass is measured.
+            * aimd (Bool.) : Whether to adapt concurrency from nconn with an
+                AIMDController.
+            * rejectrate (float) : Probability that the server refuses a
+                command with a 421 reply.
+            * hedge (Bool.) : Whether to hedge slow idat transfers.
+            * slowrate (float) : Probability that a transfer is served at
+                slowbandwidth.
+            * slowbandwidth (int) : Bytes/sec for slow transfers.
+            * prefetch (int) : Number of GSM IDs listed ahead of idat 
+                transfers, with the ftplib engine.
+            * mode (str) : Transfer mode, either 'fast' (settings.dlblocksize 
+                blocks, preallocated files) or 'legacy' (8 KiB blocks, no 
+                preallocation).
+            * mirror (str) : Endpoint serving the tree, either 'ftp' (the 
+                stand-in FTP server), 'http' (the stand-in HTTP server, with
+                latency only), or 'local' (the tree exported to a local 
+                mirror dir, with no round trips).
+
+        Returns:
+            * result (dict) : Run parameters, elapsed seconds, files resolved,
+                bytes, round trips, files/sec, MB/sec, and client cpu seconds
+                per GB (excluding the stand-in server threads).
+    """
+    tree = GEOTree(nsamples=nsamples, idatsize=idatsize)
+    if mirror == 'http':
+        server = start_http_standin(tree=tree, latency=latency)
+    else:
+        server = start_standin(tree=tree, latency=latency, 
+            bandwidth=bandwidth, failrate=failrate, rejectrate=rejectrate, 
+            mlsd=mlsd, slowrate=slowrate, slowbandwidth=slowbandwidth)
+    ftphost, ftpport = settings.ftphost, settings.ftpport
+    geomirror = settings.geomirror
+    limits = (settings.geomaxconn, settings.geocmdrate, settings.geobyterate)
+    transfer = (settings.dlblocksize, settings.dlpreallocate)
+    if mode == 'legacy':
+        settings.dlblocksize, settings.dlpreallocate = 8192, False
+    settings.ftphost, settings.ftpport = server.server_address
+    if not ratelimit:
+        settings.geomaxconn = settings.geocmdrate = settings.geobyterate = 0
+    cwd = os.getcwd(); workdir = tempfile.mkdtemp(prefix='bench_dl.')
+    os.chdir(workdir)
+    try:
+        if mirror == 'http':
+            settings.geomirror = 'http://'+server.server_address[0]+':'+str(
+                server.server_address[1])
+        elif mirror == 'local':
+            mirrorbytes = tree.export(os.path.join(workdir, 'mirror'))
+            settings.geomirror = 'file://'+os.path.join(workdir, 'mirror')
+        if target == 'idat':
+            idlist = server.tree.gsmids(); dlfun = dl_idat
+            dlfun_async = dl_idat_async
+        else:
+            idlist = server.tree.gseids(); dlfun = dl_soft
+            dlfun_async = dl_soft_async
+        kwargs = {'hedge' : hedge} if target == 'idat' else {}
+        print("Benchmarking "+target+" downloads for "+str(len(idlist))
+            +" IDs with "+engine+"...")
+        for npass in range(passes):
+            server.stats.clear()
+            server.stats.update({'commands' : 0, 'bytes' : 0})
+            start = time.time(); cpustart = sum(os.times()[:2])
+            if engine == 'asyncio':
+                dldict = asyncio.run(dlfun_async(idlist, timestamp=str(npass),
+                    nconn=nconn, datemap={}, validation=validation,
+                    aimd=aimd, **kwargs))
+            else:
+                if target == 'idat':
+                    kwargs['prefetch'] = prefetch
+                dldict = dlfun(idlist, timestamp=str(npass), nconn=nconn,
+                    datemap={}, validation=validation, aimd=aimd, **kwargs)
+            elapsed = time.time() - start
+            cpu = sum(os.times()[:2]) - cpustart - server.stats.get('cpu', 0)
+            if mirror == 'local':
+                server.stats.update({'commands' : 0, 
+                    'bytes' : mirrorbytes[target]})
+    finally:
+        os.chdir(cwd); shutil.rmtree(workdir)
+        server.shutdown(); server.server_close()
+        settings.ftphost, settings.ftpport = ftphost, ftpport
+        settings.dlblocksize, settings.dlpreallocate = transfer
+        settings.geomirror = geomirror
+        (settings.geomaxconn, settings.geocmdrate,
+            settings.geobyterate) = limits
+    nfiles = count_files(dldict, target)
+    return {'target' : target, 'engine' : engine, 'nsamples' : nsamples,
+        'mode' : mode, 'mirror' : mirror,
+        'validation' : validation, 'passes' : passes,
+        'nconn' : nconn, 'latency' : latency, 'seconds' : elapsed,
+        'files' : nfiles, 'bytes' : server.stats['bytes'],
+        'round_trips' : server.stats['commands'],
+        'files_per_sec' : nfiles / elapsed,
+        'mb_per_sec' : server.stats['bytes'] / elapsed / 1e6,
+        'cpu_per_gb' : cpu / max(1, server.stats['bytes']) * 1e9}
+
+def format_results(results):
+    """ format_results
+
+        Format benchmark results as a table, one row per run.
+
+        Arguments:
+            * results (list) : Results dicts, as from run_bench().
+
+        Returns:
+            * table (str) : Formatted table.
+    """
+    header = ['target', 'engine', 'mirror', 'mode', 'validation', 'nsamples', 
+        'files', 'seconds', 'files/sec', 'MB/sec', 'cpu s/GB', 'round trips',
+        'trips/file']
+    rows = [header]
+    for r in results:
+        rows.append([r['target'], r['engine'], r['mirror'], r['mode'], 
+            r['validation'],
+            str(r['nsamples']),
+            str(r['files']), '%.2f' % r['seconds'],
+            '%.1f' % r['files_per_sec'], '%.2f' % r['mb_per_sec'],
+            '%.1f' % r['cpu_per_gb'],
+            str(r['round_trips']),
+            '%.2f' % (r['round_trips'] / max(1, r['files']))])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in
+        zip(row, widths)) for row in rows)
+
+if __name__ == "__main__":
+    """ Run download benchmarks against the local GEO stand-in
+    """
+    parser = argparse.ArgumentParser(description='Benchmark GEO downloads')
+    parser.add_argument("--nsamples", type=str, default="1000,10000,50000",
+        help="Comma-separated list of sample counts.")
+    parser.add_argument("--target", type=str, default="idat,soft",
+        help="Comma-separated list of 'idat' and/or 'soft'.")
+    parser.add_argument("--engine", type=str, default=settings.dlengine,
+        help="Comma-separated list of 'ftplib' and/or 'asyncio'.")
+    parser.add_argument("--nconn", type=int, default=settings.ftpnconn)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--failrate", type=float, default=0)
+    parser.add_argument("--idatsize", type=int, default=16384)
+    parser.add_argument("--nomlsd", action="store_true")
+    parser.add_argument("--ratelimit", action="store_true")
+    parser.add_argument("--validation", type=str,
+        default=settings.dlvalidation,
+        help="Comma-separated list of 'hash' and/or 'stat'.")
+    parser.add_argument("--passes", type=int, default=1)
+    parser.add_argument("--aimd", action="store_true")
+    parser.add_argument("--rejectrate", type=float, default=0)
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--slowrate", type=float, default=0)
+    parser.add_argument("--slowbandwidth", type=int, default=16384)
+    parser.add_argument("--prefetch", type=int, default=settings.dlprefetch)
+    parser.add_argument("--mirror", type=str, default="ftp",
+        help="Comma-separated list of 'ftp', 'http', and/or 'local'.")
+    parser.add_argument("--mode", type=str, default="fast",
+        help="Comma-separated list of 'fast' and/or 'legacy'.")
+    args = parser.parse_args()
+    results = []
+    for nsamples in [int(n) for n in args.nsamples.split(',')]:
+        for target in args.target.split(','):
+            for engine in args.engine.split(','):
+                for validation in args.validation.split(','):
+                    for mode in args.mode.split(','):
+                        for mirror in args.mirror.split(','):
+                            results.append(run_bench(nsamples, target, 
+                                engine, args.nconn, args.latency, 
+                                args.bandwidth, args.failrate, args.idatsize,
+                                not args.nomlsd, args.ratelimit, validation,
+                                args.passes, args.aimd, args.rejectrate, 
+                                args.hedge, args.slowrate, args.slowbandwidth,
+                                args.prefetch, mode, mirror))
+    print(format_results(results))
@@ -11,19 +11,85 @@
             existing files in the corresponding destination files directory.
         * Downloads are launched from the job definition for the celery job 
             queue manager. Each queued job is based around a valid GSE id.
+        * With validation='stat' (see settings.dlvalidation), files whose 
+            remote size and date, and stored file stat, match the last 
+            download are skipped without a transfer. The default 'hash' 
+            policy downloads them and compares SHA-256 hashes.
+        * Files are fetched from the GEO FTP server, or from the mirror set
+            by 'settings.geomirror' (HTTPS or a local dir, see transport.py).
+        * New files are staged on the filesystem of their destination dir 
+            and committed with an atomic rename (see staging.py).
+        * Directory listings are cached with a TTL (see listcache.py), so 
+            directories listed recently, or unchanged for a long time, are not
+            re-listed on every run.
+        * With hedge=True (see settings.dlhedge), idat transfers much slower
+            than their peers get a duplicate transfer on a second connection,
+            and the first to finish is kept (see hedge.py).
+        * Idat listings and dates are resolved for up to settings.dlprefetch 
+            GSM IDs ahead of their transfers, on a session of their own, so 
+            transfer sessions do not idle on metadata round trips.
+        * With a claim run key, GSM IDs shared by several GSE tasks are 
+            downloaded once per run, by the first task to claim them (see 
+            gsmclaim.py).
     
     Functions:
         * soft_mongo_date: grab latest update date for a soft file from the 
             Recount Methylation Mongo db (or 'RMDB'). 
         * idat_mongo_date: grab latest update date for an idat file from RMDB.
-        * dl_idat: Download and validate idat files.
-        * dl_soft: Download and validate soft files.
+        * rmdb_dates: Get stored dates for all files of a batch of GSM and GSE
+            IDs, in one query per collection.
+        * validate_idats: Validate new idats against latest stored versions.
+        * parse_mlsd: Parse MLSD reply lines into a directory listing.
+        * ftp_listdir: List names, sizes, and dates for a directory in one 
+            MLSD call, falling back to NLST.
+        * refresh_listing_later: Queue a directory to be re-listed into the 
+            listing cache by a background thread.
+        * cached_listdir: List a directory from the listing cache, listing it
+            with ftp_listdir when the cached entry is missing or expired.
+        * remote_unchanged: Check a remote file against its last download by
+            size and date, for the 'stat' validation policy.
+        * noted_errors: Wrap a block callback to note the errors it raises.
+        * abort_retr: Abort a RETR stopped early, replacing its session.
+        * retr_resume: Download a file, resuming partial transfers with REST.
+        * retr_hedged: Download a file with retr_resume, starting a duplicate
+            transfer if it is much slower than its peers.
+        * log_throughput: Log the bytes written by a download run, for sync 
+            plan estimates.
+        * resolve_idat_gsm: List the idats of a GSM ID, with dates, ahead of 
+            their transfer.
+        * dl_idat_gsm: Download idat files for one GSM ID, with a session from
+            an FTP pool.
+        * dl_idat: Download and validate idat files, concurrently over a pool 
+            of FTP sessions.
+        * validate_soft: Validate new soft files against latest stored 
+            versions.
+        * dl_soft_gse: Download the soft file for one GSE ID, with a session 
+            from an FTP pool.
+        * dl_soft: Download and validate soft files, concurrently over a pool 
+            of FTP sessions.
 """
 
-import ftplib, datetime, os, sys, subprocess, glob, fnmatch, filecmp
-import pymongo, time, tempfile, shutil
+import ftplib, datetime, os, sys, subprocess, glob, fnmatch
+import pymongo, time, tempfile, shutil, hashlib, queue, threading, zlib
+from functools import partial
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 from utilities import gettime_ntp, getlatest_filepath
+from ftppool import FTPPool, pool_map, pipeline_map, ftp_connect
+from ratelimit import try_lease
+from aimd import AIMDController
+from filehash import hashing_writer, file_sha256, cached_connect
+from filehash import get_latest_hash, set_latest_hash, set_remote_stat
+from filehash import stat_unchanged
+from objstore import store_object
+from gzstream import GunzipWriter
+from staging import staging_dir, preallocate, commit_file
+from hedge import HedgeMonitor
+from transport import gsm_suppl_dir, gse_soft_dir, is_remote
+from dljournal import journal_adopt, journal_set, journal_record
+from listcache import get_cached_listing, set_cached_listing
+from throughput import record_throughput
+from gsmclaim import claim_gsms, finish_gsms, release_gsms, poll_gsms
+from gsmclaim import gsm_result, reused_records
 import settings
 settings.init()
 
@@ -34,21 +100,19 @@ def soft_mongo_date(gse, filename, client):
         
         Arguments:
             * gse (str) : Valid GSE ID.
-            * filename (str) : Name of a valid soft file.
+            * filename (str) : FTP address of a valid soft file.
             * client (conn.) : A client connection to RMDB.
         
         Returns:
             * mongo_date_list : list of resultant date(s) from query, or empty 
                 list if no docs detected
     """
-    mongo_date_list = []
     rmdb = client.recount_methylation
     gsec = rmdb.gse
     softc = gsec.soft  
-    mongo_date_list.append(
-        d['date'] for d in softc.find(
-        {'gse' : gse},
-        {'date' : 1}))
+    mongo_date_list = [d['date'] for d in softc.find(
+        {'gseid' : gse, 'ftpaddress' : filename},
+        {'date' : 1})]
     return mongo_date_list
 
 def idat_mongo_date(gsm_id,filename,client):
@@ -58,35 +122,807 @@ def idat_mongo_date(gsm_id,filename,client):
         
         Arguments:
             * gsm_id (str) : A valid sample GSM ID.
-            * filename (str) : Name of valid array idat file, inc. 'grn' or 
-                'red'.
+            * filename (str) : FTP address of valid array idat file, inc. 
+                'grn' or 'red'.
             * client (conn.) : A client connection to RMDB.
         
         Returns:
             * mongo_date_list (list) : list of resultant date(s) from query, or 
                 empty list if no docs detected
     """
-    mongo_date_list = []
     rmdb = client.recount_methylation
     gsmc = rmdb.gsm
     idatc = gsmc.idats  
-    if 'grn' in filename:
-        mongo_date_list.append(
-            d['date'] for d in idatc.grn.find(
-            {'gsm' : gsm_id},
-            {'date' : 1}))
-    else:
-        mongo_date_list.append(
-            d['date'] for d in idatc.red.find(
-            {'gsm' : gsm_id},
-            {'date' : 1}))
+    mongo_date_list = [d['date'] for d in idatc.find(
+        {'gsmid' : gsm_id, 'ftpaddress' : filename},
+        {'date' : 1})]
     return mongo_date_list
 
+def rmdb_dates(gsm_list=[], gse_list=[], client=None):
+    """ rmdb_dates
+        
+        Get stored dates for all idat and soft files of a batch of GSM and 
+        GSE IDs, with one query per RMDB collection.
+        
+        Arguments:
+            * gsm_list (list) : Valid GSM IDs, for idat file dates.
+            * gse_list (list) : Valid GSE IDs, for soft file dates.
+            * client (conn.) : A client connection to RMDB, or None to open 
+                one at settings.rmdbhost.
+        
+        Returns:
+            * datemap (dict) : Set of stored dates for each file, keyed by 
+                file ftp address.
+    """
+    if client is None:
+        client = pymongo.MongoClient(settings.rmdbhost, settings.rmdbport)
+    rmdb = client.recount_methylation
+    datemap = {}
+    queries = [(rmdb.gsm.idats, 'gsmid', gsm_list), 
+        (rmdb.gse.soft, 'gseid', gse_list)]
+    for collection, idkey, idlist in queries:
+        if not idlist:
+            continue
+        for d in collection.find({idkey : {'$in' : list(idlist)}}, 
+            {'ftpaddress' : 1, 'date' : 1}):
+            datemap.setdefault(d['ftpaddress'], set()).add(d['date'])
+    print('found stored dates for '+str(len(datemap))+' files')
+    return datemap
+
+def parse_mlsd(lines, dirpath):
+    """ parse_mlsd
+        
+        Parse MLSD reply lines into a directory listing.
+        
+        Arguments:
+            * lines (list) : Lines of an MLSD reply, as 'facts; name'.
+            * dirpath (str) : FTP address of the listed directory.
+        
+        Returns:
+            * listing (dictionary) : File metadata keyed on file FTP address, 
+                with 'size' (int) and 'modify' (datetime) values.
+    """
+    listing = {}
+    for line in lines:
+        factstr, _, name = line.partition(' ')
+        facts = dict(fact.split('=', 1) for fact in factstr.split(';') 
+            if '=' in fact)
+        if not facts.get('type', 'file').lower() == 'file':
+            continue
+        modify = facts.get('modify')
+        if modify:
+            modify = datetime.datetime.strptime(modify[:14], "%Y%m%d%H%M%S")
+        size = facts.get('size')
+        listing[dirpath.rstrip('/')+'/'+name] = {
+                'size' : int(size) if size else None,
+                'modify' : modify
+            }
+    return listing
+
+def ftp_listdir(ftp, dirpath, usemlsd=settings.ftpmlsd):
+    """ ftp_listdir
+        
+        List files in a directory with one MLSD call, returning names, sizes, 
+        and modification times. Falls back to NLST, with sizes and dates left 
+        as None, when the server does not support MLSD.
+        
+        Arguments:
+            * ftp (ftplib.FTP) : A logged-in FTP session.
+            * dirpath (str) : FTP address of the directory to list.
+            * usemlsd (Bool.) : Whether to try MLSD before NLST.
+        
+        Returns:
+            * listing (dictionary) : File metadata keyed on file FTP address, 
+                with 'size' and 'modify' values (or None where unavailable).
+    """
+    if usemlsd and not getattr(ftp, 'nomlsd', False):
+        lines = []
+        try:
+            ftp.retrlines('MLSD '+dirpath, lines.append)
+            return parse_mlsd(lines, dirpath)
+        except ftplib.error_perm as emlsd:
+            if not str(emlsd)[:3] in ('500', '501', '502', '504'):
+                raise
+            print('MLSD unsupported by server, falling back to NLST...')
+            ftp.nomlsd = True
+    return {file : {'size' : None, 'modify' : None} 
+        for file in ftp.nlst(dirpath)}
+
+_refreshq = queue.Queue()
+_refreshing = set()
+_refreshlock = threading.Lock()
+_refresher = None
+
+def refresh_listing_later(dirpath):
+    """ refresh_listing_later
+        
+        Queue a directory to be re-listed into the listing cache by a 
+        background thread, with its own FTP session. Directories already 
+        queued are skipped.
+        
+        Arguments:
+            * dirpath (str) : FTP address of the directory to list.
+        
+        Returns:
+            * None, updates the listing cache as side effect.
+    """
+    global _refresher
+    with _refreshlock:
+        if dirpath in _refreshing:
+            return
+        _refreshing.add(dirpath)
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_listings, 
+                daemon=True)
+            _refresher.start()
+    _refreshq.put(dirpath)
+
+def _refresh_listings():
+    """ _refresh_listings
+        
+        Re-list queued directories into the listing cache. The FTP session is
+        closed whenever the queue is empty, so it does not hold a GEO
+        connection lease while idle.
+    """
+    ftp = None
+    while True:
+        dirpath = _refreshq.get()
+        try:
+            if ftp is None:
+                ftp = ftp_connect(settings.ftphost, settings.ftpport, 
+                    mirror=settings.geomirror)
+            set_cached_listing(dirpath, ftp_listdir(ftp, dirpath))
+        except ftplib.all_errors as e:
+            print('background listing error for '+dirpath+': '+str(e))
+            if ftp and isinstance(e, (OSError, EOFError)):
+                ftp.close()
+                ftp = None
+        finally:
+            with _refreshlock:
+                _refreshing.discard(dirpath)
+        if ftp and _refreshq.empty():
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+            ftp = None
+
+def cached_listdir(ftp, dirpath, usecache=settings.listcache):
+    """ cached_listdir
+        
+        List files in a directory from the listing cache. Fresh entries are
+        returned without listing, stale entries are returned and re-listed in
+        the background, and missing or expired entries are listed with 
+        ftp_listdir and cached.
+        
+        Arguments:
+            * ftp (ftplib.FTP) : A logged-in FTP session.
+            * dirpath (str) : FTP address of the directory to list.
+            * usecache (Bool.) : Whether to use the listing cache.
+        
+        Returns:
+            * listing (dictionary) : File metadata keyed on file FTP address, 
+                as from ftp_listdir().
+    """
+    if usecache:
+        listing, state = get_cached_listing(dirpath)
+        if state == 'fresh':
+            return listing
+        if state == 'stale':
+            refresh_listing_later(dirpath)
+            return listing
+    listing = ftp_listdir(ftp, dirpath)
+    if usecache:
+        set_cached_listing(dirpath, listing)
+    return listing
+
+def remote_unchanged(ftp, file, size, filedate):
+    """ remote_unchanged
+        
+        Check a remote file against its last download, by its size and date,
+        and the stored file by os.stat, without transferring or reading 
+        either file. The size is requested with SIZE if not known from a 
+        listing.
+        
+        Arguments:
+            * ftp (ftplib.FTP) : A logged-in FTP session.
+            * file (str) : FTP address of the file.
+            * size (int) : Remote file size from a listing, or None.
+            * filedate (datetime) : Remote modification date.
+        
+        Returns:
+            * size (int) : Remote file size, or None if unavailable.
+            * filepath (str) : Path of the unchanged stored file, or None if 
+                the file should be downloaded.
+    """
+    if size is None:
+        ftp.voidcmd('TYPE I')
+        try:
+            size = ftp.size("/"+file)
+        except ftplib.error_perm:
+            return None, None
+    return size, stat_unchanged(cached_connect(), file, size, filedate)
+
+def noted_errors(callback, errors):
+    """ noted_errors
+        
+        Wrap a block callback to append any exception it raises to errors,
+        so it can be told apart from errors on the FTP connection.
+    """
+    def wrapper(block):
+        try:
+            callback(block)
+        except Exception as e:
+            errors.append(e)
+            raise
+    return wrapper
+
+def abort_retr(pool, ftp):
+    """ abort_retr
+        
+        Abort a RETR stopped before its end, and replace its session, as the
+        transfer reply is left unread on the control connection.
+        
+        Arguments:
+            * pool (FTPPool) : Pool of FTP sessions, or None to only close
+                the session.
+            * ftp (ftplib.FTP) : The session of the stopped transfer.
+        
+        Returns:
+            * ftp (ftplib.FTP) : A new session from pool, or the closed 
+                session if pool is None.
+    """
+    try:
+        ftp.abort()
+    except ftplib.all_errors:
+        pass
+    if pool is None:
+        ftp.close()
+        return ftp
+    return pool.reconnect(ftp)
+
+def retr_resume(pool, ftp, file_ftpadd, to_write, retries_files=3, 
+    interval_file=.01, remote_size=None, gunzip=None, transfer=None):
+    """ retr_resume
+        
+        Download a file with RETR, resuming partial downloads with REST. On a 
+        failed transfer, bytes already written to to_write are kept and the 
+        retry asks the server to restart at the current local size. The final 
+        size is checked against the remote SIZE, where available. A SHA-256 
+        hash is computed from the bytes as they are written. With gunzip, 
+        the same bytes are also expanded, and a bad gzip CRC restarts the 
+        download from byte zero. Bytes are read in blocks of 
+        settings.dlblocksize, into disk blocks reserved from the remote size
+        (see staging.preallocate).
+        
+        A transfer stopped by an error in its block callback (e.g. a bad gzip
+        CRC) is aborted, and its session replaced, as the RETR reply is left
+        unread on the control connection.
+        
+        Arguments:
+            * pool (FTPPool) : Pool of FTP sessions, used to replace sessions 
+                that fail at the connection level, or None to only close them
+                (e.g. for a hedge's own session).
+            * ftp (ftplib.FTP) : A logged-in FTP session from pool.
+            * file_ftpadd (str) : FTP address of the file to download.
+            * to_write (str) : Local path to write, or a partial download to 
+                resume.
+            * retries_files (int) : Number of retry attempts allowed.
+            * interval_file (float) : Time (in seconds) to sleep before retrying.
+            * remote_size (int) : Remote file size, if known from a listing. 
+                If None, the size is requested with SIZE.
+            * gunzip (GunzipWriter) : Writer to expand the file while it 
+                downloads, or None. Its sha256 is set on success.
+            * transfer (hedge.Transfer) : Progress of a hedged transfer, or 
+                None. A cancelled transfer returns without retrying.
+        
+        Returns:
+            * ftp (ftplib.FTP) : The session in use after any reconnects.
+            * filedl_estat (str) : Exit status of the final RETR call, or the 
+                last error string if retries are exhausted.
+            * sha256 (str) : Hex digest of the downloaded file, or None if 
+                retries are exhausted.
+    """
+    retries_left_files = retries_files
+    while True:
+        offset = 0
+        cberrors = []
+        if transfer:
+            if transfer.cancelled:
+                return ftp, 'transfer cancelled by hedge', None
+            transfer.ftp = ftp
+        try:
+            if remote_size is None:
+                ftp.voidcmd('TYPE I')
+                try:
+                    remote_size = ftp.size("/"+file_ftpadd)
+                except ftplib.error_perm:
+                    remote_size = False
+            if os.path.exists(to_write):
+                offset = os.path.getsize(to_write)
+            if remote_size and offset > remote_size:
+                offset = 0
+            hashobj = hashlib.sha256()
+            if gunzip:
+                gunzip.reset()
+            if offset:
+                print('resuming download of '+file_ftpadd+' at byte '
+                    +str(offset))
+                file_sha256(to_write, hashobj, nbytes=offset)
+                if gunzip:
+                    gunzip.write_file(to_write, offset)
+            with open(to_write, 'ab' if offset else 'wb') as output_stream:
+                preallocate(output_stream, remote_size)
+                callback = hashing_writer(output_stream.write, hashobj)
+                if gunzip:
+                    callback = gunzip.tee(callback)
+                if transfer:
+                    callback = transfer.counted(callback)
+                callback = noted_errors(callback, cberrors)
+                filedl_estat = ftp.retrbinary("RETR /"+file_ftpadd, callback,
+                    blocksize=settings.dlblocksize, rest=offset or None)
+            if remote_size and not os.path.getsize(to_write) == remote_size:
+                raise ftplib.error_temp('451 size mismatch for '+file_ftpadd
+                    +', expected '+str(remote_size)+' bytes, found '
+                    +str(os.path.getsize(to_write)))
+            if gunzip:
+                gunzip.finish()
+            return ftp, filedl_estat, hashobj.hexdigest()
+        except Exception as efiledl:
+            incallback = any(e is efiledl for e in cberrors)
+            if not (incallback or isinstance(efiledl, ftplib.all_errors 
+                + (zlib.error,))):
+                raise
+            if transfer and transfer.cancelled:
+                if gunzip:
+                    gunzip.discard()
+                return ftp, 'transfer cancelled by hedge', None
+            if incallback:
+                ftp = abort_retr(pool, ftp)
+            if isinstance(efiledl, zlib.error):
+                # corrupt gzip data, so restart from byte zero
+                print('gzip error for '+file_ftpadd+': '+str(efiledl)
+                    +', restarting...')
+                os.remove(to_write)
+            elif isinstance(efiledl, ftplib.error_perm) and offset:
+                # server refused REST, so restart from byte zero
+                print('resume refused for '+file_ftpadd+', restarting...')
+                os.remove(to_write)
+            if retries_left_files:
+                retries_left_files -= 1
+                print('ftp file dl error, retries left = '
+                    +str(retries_left_files))
+                time.sleep(interval_file)
+                if isinstance(efiledl, (OSError, EOFError)) and not incallback:
+                    ftp = pool.reconnect(ftp)
+                continue
+            print('File retries exhausted. Breaking...')
+            if gunzip:
+                gunzip.discard()
+            return ftp, str(efiledl), None
+
+def retr_hedged(pool, ftp, file_ftpadd, to_write, monitor, retries_files=3,
+    interval_file=.01, remote_size=None, gunzip=None):
+    """ retr_hedged
+        
+        Download a file as retr_resume, hedging it if it straggles. Once the 
+        transfer is much slower than its peers (see hedge.py), a duplicate 
+        transfer starts on a second FTP connection, writing beside to_write. 
+        The first to finish is kept at to_write, and the other is aborted and
+        its files removed.
+        
+        Arguments:
+            * pool (FTPPool) : Pool of FTP sessions.
+            * ftp (ftplib.FTP) : A logged-in FTP session from pool.
+            * file_ftpadd (str) : FTP address of the file to download.
+            * to_write (str) : Local path to write.
+            * monitor (hedge.HedgeMonitor) : Peer rates for straggler checks,
+                or None to not hedge.
+            * retries_files (int) : Number of retry attempts allowed.
+            * interval_file (float) : Time (in seconds) to sleep before retrying.
+            * remote_size (int) : Remote file size, or None.
+            * gunzip (GunzipWriter) : Writer to expand the file, or None.
+        
+        Returns:
+            * ftp (ftplib.FTP) : The session in use, reconnected if the
+                transfer lost to its hedge.
+            * filedl_estat (str) : Exit status of the kept transfer.
+            * sha256 (str) : Hex digest of the kept file, or None.
+    """
+    if monitor is None:
+        return retr_resume(pool, ftp, file_ftpadd, to_write, retries_files, 
+            interval_file, remote_size, gunzip)
+    primary = monitor.register()
+    hedge = monitor.register()
+    hedgepath = to_write + '.hedge'
+    hedgedone = threading.Event()
+    lock = threading.Lock()
+    state = {'winner' : None, 'hgunzip' : None}
+    def claim(side):
+        with lock:
+            if state['winner'] is None:
+                state['winner'] = side
+            return state['winner'] == side
+    def remove_hedge():
+        hgunzip = state['hgunzip']
+        for path in (hedgepath, hgunzip.filepath if hgunzip else None):
+            if path and os.path.exists(path):
+                os.remove(path)
+    def run_hedge():
+        print('hedging slow transfer of '+file_ftpadd+', at '
+            +'%.1f' % (primary.rate() / 1e3)+' kB/s')
+        hftp = None
+        try:
+            # never wait on a lease, which may only free up after this task
+            leaseid = try_lease('geoftp', settings.geomaxconn 
+                if is_remote(pool.mirror) else 0)
+            if leaseid is None:
+                print('no free connection to hedge '+file_ftpadd)
+                return
+            hedge.start = time.time()
+            if gunzip:
+                state['hgunzip'] = GunzipWriter(gunzip.filepath + '.hedge')
+            hftp = ftp_connect(host=pool.host, port=pool.port, 
+                retries_connection=0, leaseid=leaseid, mirror=pool.mirror)
+            hftp, estat, sha256 = retr_resume(None, hftp, file_ftpadd, 
+                hedgepath, 0, interval_file, remote_size, state['hgunzip'], 
+                hedge)
+            if sha256 and claim('hedge'):
+                state['estat'], state['sha256'] = estat, sha256
+                primary.cancel()
+        except ftplib.all_errors as ehedge:
+            print('hedge failed for '+file_ftpadd+': '+str(ehedge))
+        finally:
+            if hftp:
+                hftp.close()
+            if state['hgunzip']:
+                state['hgunzip'].close()
+            hedgedone.set()
+    monitor.watch(primary, run_hedge)
+    ftp, filedl_estat, sha256 = retr_resume(pool, ftp, file_ftpadd, to_write,
+        retries_files, interval_file, remote_size, gunzip, primary)
+    if monitor.unwatch(primary):
+        # never hedged, but remove any file left by an earlier attempt
+        remove_hedge()
+        if sha256:
+            monitor.complete(primary)
+        return ftp, filedl_estat, sha256
+    if sha256 and claim('primary'):
+        monitor.complete(primary)
+        hedge.cancel()
+    hedgedone.wait()
+    if state['winner'] == 'hedge':
+        monitor.nwon += 1
+        os.replace(hedgepath, to_write)
+        if gunzip:
+            os.replace(state['hgunzip'].filepath, gunzip.filepath)
+            gunzip.sha256 = state['hgunzip'].sha256
+        if primary.cancelled:
+            ftp = pool.reconnect(ftp)
+        return ftp, state['estat'], state['sha256']
+    remove_hedge()
+    return ftp, filedl_estat, sha256
+
+def log_throughput(kind, files_written, seconds):
+    """ log_throughput
+        
+        Log the files and bytes written by a download run, for sync plan 
+        estimates (see throughput.py).
+        
+        Arguments:
+            * kind (str) : Type of files downloaded, 'idat' or 'soft'.
+            * files_written (list) : Tuples with the path written second, as 
+                from dl_idat_gsm() or dl_soft_gse().
+            * seconds (float) : Duration of the run.
+        
+        Returns:
+            * None, updates the throughput log as side effect.
+    """
+    paths = [written[1] for written in files_written 
+        if os.path.exists(written[1])]
+    record_throughput(kind, len(paths), sum(os.path.getsize(path) 
+        for path in paths), seconds)
+
+def resolve_idat_gsm(gsm_id, pool, retries_files=3, interval_file=.01):
+    """ resolve_idat_gsm
+        
+        List the idats of a GSM ID, with dates, ahead of their transfer. 
+        Dates missing from the listing (e.g. from NLST) are requested with 
+        MDTM.
+        
+        Arguments:
+            * gsm_id (str) : A valid GSM ID.
+            * pool (FTPPool) : Pool of logged-in FTP sessions.
+            * retries_files (int) : Number of retry attempts allowed.
+            * interval_file (float) : Time (in seconds) to sleep before retrying.
+        
+        Returns:
+            * listing (dictionary) : File metadata keyed on file FTP address, 
+                as from cached_listdir(). Raises the last ftplib error if 
+                retries are exhausted.
+    """
+    id_ftpadd = gsm_suppl_dir(gsm_id)
+    retries_left_files = retries_files
+    while True:
+        try:
+            with pool.connection() as ftp:
+                listing = cached_listdir(ftp, id_ftpadd)
+                for file, meta in listing.items():
+                    if not meta['modify']:
+                        meta['modify'] = datetime.datetime.strptime(
+                            ftp.sendcmd("MDTM /" + file)[4:], "%Y%m%d%H%M%S")
+            return listing
+        except ftplib.all_errors:
+            if retries_left_files:
+                retries_left_files -= 1
+                print('ftplib filenames error, retries left = '
+                    +str(retries_left_files))
+                time.sleep(interval_file)
+                continue
+            raise
+
+def dl_idat_gsm(gsm_id, pool, datemap, temp_dir_make, timestamp, 
+    retries_files=3, interval_file=.01, journal=None, expand=False,
+    validation='hash', monitor=None, listing=None):
+    """ dl_idat_gsm
+        
+        Download idats for a single GSM ID, using a session from an FTP pool.
+        
+        Arguments
+            * gsm_id (str) : A valid GSM ID.
+            * pool (FTPPool) : Pool of logged-in FTP sessions.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                rmdb_dates().
+            * temp_dir_make (str) : Temp directory for new downloads.
+            * timestamp (str) : An NTP timestamp for versioning.
+            * retries_files (int) : Number of retry attempts allowed for sample 
+                file downloads.
+            * interval_file (float) : Time (in seconds) to sleep before retrying 
+                a file connection. 
+            * journal (str) : Task key in the download journal, or None to not
+                journal downloads.
+            * expand (Bool.) : Whether to also write the expanded idat, in the
+                same pass as the download.
+            * validation (str) : Validation policy, 'hash' or 'stat'.
+            * monitor (hedge.HedgeMonitor) : Peer rates for hedging slow 
+                transfers, or None to not hedge.
+            * listing (dict) : Listing of the GSM ID, as from 
+                resolve_idat_gsm(), or the error raised resolving it, or None
+                to list it here.
+        
+        Returns 
+            * gsmdl (list) : Records for the GSM ID, in dldict format.
+            * files_written (list) : Tuples of (gsm_id, path written, index of 
+                record in gsmdl, sha256 of file, sha256 of expanded file or 
+                None), for validation.
+    """
+    print('Starting GSM: '+gsm_id)
+    gsmdl = []
+    files_written = []
+    id_ftpadd = gsm_suppl_dir(gsm_id)
+    if isinstance(listing, Exception):
+        print('File retries exhausted. Breaking...')
+        gsmdl.append([gsm_id, id_ftpadd, str(listing)])
+        return gsmdl, files_written
+    ftp = None
+    try:
+        ftp = pool.get()
+        retries_left_files = retries_files
+        while listing is None:
+            try:
+                listing = cached_listdir(ftp, id_ftpadd)
+            except ftplib.all_errors as eid:
+                if retries_left_files:
+                    retries_left_files -= 1
+                    print('ftplib filenames error, retries left = '
+                        +str(retries_left_files))
+                    time.sleep(interval_file)
+                    if isinstance(eid, (OSError, EOFError)):
+                        ftp = pool.reconnect(ftp)
+                    continue
+                else:
+                    print('File retries exhausted. Breaking...')
+                    gsmdl.append([gsm_id, id_ftpadd, str(eid)])
+                    return gsmdl, files_written
+        filenames = list(listing.keys())
+        if not len(filenames)>0:
+            gsmdl.append([gsm_id, "no files at ftp address"])
+            return gsmdl, files_written
+        filestr = '; '.join(str(e) for e in filenames)
+        print("files found: "+filestr)
+        gsmdl.append([gsm_id,
+            id_ftpadd,
+            "connection success, valid num idats found"]
+            )
+        print("Idat filenames detected for "+gsm_id+", continuing...") 
+        for file in filenames:
+            print("Beginning iteration for file: "+file)
+            retries_left_files = retries_files
+            file_tokens = file.split('/')
+            while True:
+                filedate = ""
+                filedate_estat = ""
+                filedl_estat = ""
+                try:
+                    filedate = listing[file]['modify']
+                    if not filedate:
+                        filedate = ftp.sendcmd("MDTM /" + '/'.join(file_tokens))
+                        filedate = datetime.datetime.strptime(filedate[4:],
+                            "%Y%m%d%H%M%S")
+                except ftplib.all_errors as efiledate:
+                    if retries_left_files:
+                        retries_left_files -= 1
+                        print('ftplib file date error, retries left = '
+                        +str(retries_left_files))
+                        time.sleep(interval_file)
+                        if isinstance(efiledate, (OSError, EOFError)):
+                            ftp = pool.reconnect(ftp)
+                        continue
+                    else:
+                        print('File retries exhausted. Breaking...')
+                        filedate_estat = str(efiledate)
+                        filedate = "not_available"
+                        gsmdl.append([gsm_id, file, filedate, filedate_estat])
+                        break
+                if filedate in datemap.get(file, ()):
+                    filedate_estat = "same_as_local_date"
+                    gsmdl.append([gsm_id, file, filedate, filedate_estat])
+                    print('Online date same as local date. Continuing..')
+                    break
+                remote_size = listing[file]['size']
+                if validation == 'stat':
+                    try:
+                        remote_size, stored = remote_unchanged(ftp, file, 
+                            remote_size, filedate)
+                    except ftplib.all_errors as esize:
+                        print('ftplib file size error: '+str(esize))
+                        stored = None
+                    if stored:
+                        gsmdl.append([gsm_id, file, filedate, 
+                            "same_as_local_stat"])
+                        print('Online size and date same as '+stored
+                            +'. Continuing..')
+                        break
+                filedate_estat = "new_date"
+                to_write = os.path.join(
+                        temp_dir_make,
+                        '.'.join([gsm_id, str(timestamp), file_tokens[-1]])
+                    )
+                file_ftpadd = '/'.join(file_tokens[:-1])
+                file_ftpadd = file_ftpadd+'/'+file_tokens[-1:][0]
+                entry = journal_adopt(journal, file_ftpadd) if journal else None
+                if entry:
+                    print('Adopting journaled '+entry['state']+' file: '+file)
+                    gsmdl.append(journal_record(entry))
+                    if entry['state'] == 'committed':
+                        gsmdl[-1].append(bool(entry['isnew']))
+                    else:
+                        files_written.append((gsm_id, entry['temppath'], 
+                            len(gsmdl) - 1, entry['sha256'], None))
+                    break
+                if journal:
+                    journal_set(journal, file_ftpadd, 'transferring', 
+                        id=gsm_id, temppath=to_write, filedate=filedate)
+                gunzip = None
+                if expand and to_write.endswith('.gz'):
+                    gunzip = GunzipWriter(os.path.splitext(to_write)[0])
+                print('Attempting file download, for file: '+file)
+                ftp, filedl_estat, sha256 = retr_hedged(pool, ftp, 
+                    file_ftpadd, to_write, monitor, 
+                    retries_files=retries_left_files, 
+                    interval_file=interval_file, remote_size=remote_size, 
+                    gunzip=gunzip)
+                if journal:
+                    journal_set(journal, file_ftpadd, 'verified' if sha256 
+                        else 'pending', sha256=sha256)
+                gsmdl.append(
+                        [gsm_id,
+                        file_ftpadd,
+                        to_write,
+                        filedl_estat,
+                        filedate,
+                        filedate_estat]
+                    )
+                if filedl_estat.startswith('226'):
+                    files_written.append((gsm_id, to_write, len(gsmdl) - 1, 
+                        sha256, gunzip.sha256 if gunzip else None))
+                    print("File successfully downloaded. Continuing...")
+                break
+        return gsmdl, files_written
+    except ftplib.all_errors as econ:
+        print('ftp connection lost for '+gsm_id+', returning...')
+        gsmdl.append([gsm_id, id_ftpadd, str(econ)])
+        return gsmdl, files_written
+    finally:
+        if ftp:
+            # sessions closed by a failed reconnect are dropped from the pool
+            pool.put(ftp, discard=ftp.sock is None)
+
+def validate_idats(dldict, files_written, idatspath=settings.idatspath,
+    journal=None):
+    """ validate_idats
+        
+        Validate newly downloaded idats against the latest stored versions, by 
+        comparing SHA-256 hashes with the hash index. New files are moved to 
+        idatspath and linked into the object store, and duplicates are 
+        removed. Expanded idats written during download are moved or removed
+        with their compressed files. The remote size and date of each file 
+        are recorded, for the 'stat' validation policy.
+        
+        Arguments
+            * dldict (dictionary) : Download dictionary, as from dl_idat().
+            * files_written (list) : Tuples of (gsm_id, path written, index of 
+                record in dldict[gsm_id], sha256 of file or None, sha256 of 
+                expanded file or None).
+            * idatspath (str) : Destination directory for idats.
+            * journal (str) : Task key in the download journal, or None to not
+                journal validation.
+        
+        Returns
+            * dldict (dictionary) : The download dictionary, with validation 
+                status appended to each written file record.
+    """
+    print("Validating downloaded files...")
+    conn = cached_connect()
+    for gsm_id, file_written, index, sha256, exp_sha256 in files_written:
+        print("file written is "+file_written)
+        exp_written = os.path.splitext(file_written)[0]
+        if not file_written.endswith('.gz') or not os.path.exists(exp_written):
+            exp_written = None
+        filestr = os.path.basename(file_written).split('.')[2::]
+        filestr = str('.'.join(filestr))
+        filekey = os.path.join(settings.idatsdir, filestr)
+        gsmidat_latest, latest_sha256 = get_latest_hash(conn, filekey, 
+            lambda: (getlatest_filepath(idatspath, filestr, 
+                embeddedpattern=True, returntype='returnlist', tslocindex=1
+            ) or [None])[0])
+        print('gsm latest: '+str(gsmidat_latest))
+        if not sha256:
+            sha256 = file_sha256(file_written)
+        record = dldict[gsm_id][index]
+        if gsmidat_latest and latest_sha256 == sha256:
+            print("Downloaded file is same as recent file. Removing...")
+            set_remote_stat(conn, record[1], os.path.getsize(file_written), 
+                record[4], gsmidat_latest)
+            os.remove(file_written)
+            if exp_written:
+                os.remove(exp_written)
+            # If filename is false, we found it was the same
+            dldict[gsm_id][index].append(False)
+            if journal:
+                journal_set(journal, dldict[gsm_id][index][1], 'committed', 
+                    isnew=0)
+        else:
+            print("Downloaded file is new, moving to idatspath...")
+            new_filepath = os.path.join(idatspath, 
+                os.path.basename(file_written))
+            commit_file(file_written, new_filepath)
+            store_object(new_filepath, sha256)
+            set_remote_stat(conn, record[1], os.path.getsize(new_filepath), 
+                record[4], new_filepath)
+            if exp_written:
+                exp_filepath = os.path.splitext(new_filepath)[0]
+                commit_file(exp_written, exp_filepath)
+                store_object(exp_filepath, exp_sha256)
+            set_latest_hash(conn, filekey, new_filepath, sha256)
+            dldict[gsm_id][index].append(True)
+            dldict[gsm_id][index][2] = new_filepath
+            if journal:
+                journal_set(journal, dldict[gsm_id][index][1], 'committed', 
+                    destpath=new_filepath, isnew=1)
+    return dldict
+
 def dl_idat(input_list, retries_connection=3, retries_files=3, interval_con=.1, 
-    interval_file=.01, validate=True, timestamp=gettime_ntp()):
+    interval_file=.01, validate=True, timestamp=None, 
+    nconn=settings.ftpnconn, datemap=None, temp_dir=None, journal=None,
+    expand=settings.dlexpand, validation=settings.dlvalidation,
+    aimd=settings.dlaimd, hedge=settings.dlhedge, claim=None,
+    prefetch=settings.dlprefetch):
     """ dl_idat
         
-        Download idats, reading in either list of GSM IDs or ftp addresses.
+        Download idats, reading in either list of GSM IDs or ftp addresses. 
+        GSM IDs are downloaded concurrently over a bounded pool of FTP 
+        sessions.
         
         Arguments
             * input list (list, required) : A list of valid GSM IDs.
@@ -100,222 +936,338 @@ def dl_idat(input_list, retries_connection=3, retries_files=3, interval_con=.1,
                 a file connection. 
             * validate (Bool.): Validate new files against existing idats?
             * timestamp (str) : An NTP timestamp for versioning.
+            * nconn (int) : Size of the FTP session pool, or the max number of
+                concurrent GSM downloads.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                rmdb_dates(), or None to query RMDB for input_list.
+            * temp_dir (str) : Temp directory for new downloads, kept after
+                validation, or None for a new temp directory.
+            * journal (str) : Task key in the download journal (with temp_dir
+                and timestamp from dljournal.journal_begin()), or None to not 
+                journal downloads.
+            * expand (Bool.) : Whether to expand idats while downloading, so
+                process_idats.expand_idats() need not re-read them.
+            * validation (str) : Validation policy, either 'hash' (download, 
+                then compare SHA-256 with the latest stored file) or 'stat' 
+                (skip files whose remote size and date, and stored file stat,
+                match the last download).
+            * aimd (Bool.) : Whether to adapt the number of concurrent GSM 
+                downloads, starting at nconn and up to settings.dlmaxconn, 
+                from throughput and error replies (see aimd.py).
+            * hedge (Bool.) : Whether to start a duplicate transfer, on a 
+                second connection, for idats downloading much slower than 
+                their peers (see hedge.py).
+            * claim (str) : Run key in the host-wide GSM claim registry (see
+                gsmclaim.py), e.g. the server run timestamp, or None to not 
+                claim GSM IDs. GSM IDs claimed by other tasks in the run are 
+                not downloaded, and get 'same_as_claim' records once the 
+                claiming task is done with them.
+            * prefetch (int) : Number of GSM IDs to list ahead of transfers, 
+                on settings.prefetchconn sessions added to the nconn transfer
+                sessions, or 0 to list each GSM ID on its transfer session.
         
         Returns 
             * dldict (dictionary) : Records, dates, and exit statuses of ftp 
                 calls, OR error string over connection issues. Downloads and 
                 moves new and validated files as side effect. 
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     idatspath = settings.idatspath
     temppath = settings.temppath
     os.makedirs(idatspath, exist_ok=True)
-    os.makedirs(temppath, exist_ok=True)
-    temp_dir_make = tempfile.mkdtemp(dir=temppath)
+    temp_dir_make = temp_dir or tempfile.mkdtemp(dir=staging_dir(idatspath, 
+        temppath))
     item = input_list[0]
     if not item.startswith('GSM'):
         raise RuntimeError("GSM IDs must begin with \"GSM\".")
-    ftptoken_login = 'ftp.ncbi.nlm.nih.gov'
-    retries_left_connection = retries_connection
-    while retries_left_connection:
-        print('trying ftp connection')
-        try:
-            ftp = ftplib.FTP(ftptoken_login)
-            loginstat = ftp.login()
-            print('connection successful, continuing...')
-            break
-        except ftplib.all_errors as e:
-            if retries_left_connection:
-                retries_left_connection -= 1
-                print('continuing with connection retries left = '
-                    +str(retries_left_connection))
-                time.sleep(interval_con)
-                continue
-            else:
-                print('connection retries exhausted, returning...')
-                return str(e)
-    # mongodb connection
-    client = pymongo.MongoClient(settings.rmdbhost, settings.rmdbport) 
+    controller = AIMDController(start=nconn) if aimd else None
+    nlist = settings.prefetchconn if prefetch else 0
+    pool = FTPPool(nconn=nconn+nlist, host=settings.ftphost, 
+        port=settings.ftpport,
+        retries_connection=retries_connection, interval_con=interval_con,
+        controller=controller, mirror=settings.geomirror, nextra=nlist)
+    try:
+        pool.put(pool.get())
+    except ftplib.all_errors as e:
+        return str(e)
+    if datemap is None:
+        datemap = rmdb_dates(gsm_list=input_list)
     dldict = {}
+    monitor = HedgeMonitor() if hedge else None
+    task = journal or 'pid'+str(os.getpid())
+    todo, held = claim_gsms(input_list, claim, task) if claim else (
+        input_list, [])
+    try:
+        while todo or held:
+            if todo:
+                start = time.time()
+                dlfun = partial(dl_idat_gsm, datemap=datemap, 
+                    temp_dir_make=temp_dir_make, timestamp=timestamp, 
+                    retries_files=retries_files, interval_file=interval_file,
+                    journal=journal, expand=expand, validation=validation, 
+                    monitor=monitor)
+                if prefetch and pool.nconn > 1:
+                    gsmresults = pipeline_map(
+                        lambda gsm_id, listing, pool: dlfun(gsm_id, pool, 
+                            listing=listing), 
+                        partial(resolve_idat_gsm, retries_files=retries_files,
+                            interval_file=interval_file), 
+                        todo, pool, depth=prefetch, nresolve=nlist)
+                else:
+                    gsmresults = pool_map(dlfun, todo, pool)
+                files_written = []
+                for gsm_id, (gsmdl, gsm_written) in zip(todo, gsmresults):
+                    dldict[gsm_id] = gsmdl
+                    files_written.extend(gsm_written)
+                log_throughput('idat', files_written, time.time() - start)
+                if validate:
+                    validate_idats(dldict, files_written, idatspath, journal)
+                if claim:
+                    finish_gsms(claim, task, {gsm_id : gsm_result(
+                        dldict[gsm_id]) for gsm_id in todo})
+                todo = []
+            if held:
+                # GSM IDs claimed by other tasks, reused once they are done
+                results, todo, held = poll_gsms(held, claim, task)
+                for gsm_id, (owner, result) in results.items():
+                    dldict[gsm_id] = reused_records(gsm_id, owner, result)
+                if held and not todo:
+                    time.sleep(settings.claimpoll)
+    finally:
+        if claim and todo:
+            release_gsms(claim, task, todo)
+        pool.close()
+        if monitor:
+            monitor.close()
+    if validate and not temp_dir:
+        shutil.rmtree(temp_dir_make)
+    return {gsm_id : dldict[gsm_id] for gsm_id in input_list 
+        if gsm_id in dldict}
+
+def validate_soft(dldict, files_written, gsesoftpath=settings.gsesoftpath,
+    journal=None):
+    """ validate_soft
+        
+        Validate newly downloaded GSE soft files against the latest stored 
+        versions, by comparing SHA-256 hashes with the hash index. New files 
+        are moved to gsesoftpath, and duplicates are removed. The remote size
+        and date of each file are recorded, for the 'stat' validation policy.
+        
+        Arguments:
+            * dldict (dictionary) : Download dictionary, as from dl_soft().
+            * files_written (list) : Tuples of (gse, path written, index of 
+                record in dldict[gse], sha256 of file or None).
+            * gsesoftpath (str) : Destination directory for GSE soft files.
+            * journal (str) : Task key in the download journal, or None to not
+                journal validation.
+        
+        Returns:
+            * dldict (dictionary) : The download dictionary, with validation 
+                status appended for each GSE with a written file.
+    """
+    print('commencing file validation...')
+    conn = cached_connect()
+    for gse, new_filepath, index, sha256 in files_written:
+        filestr = os.path.basename(new_filepath).split('.')[0]
+        softname = '.'.join(os.path.basename(new_filepath).split('.')[2::])
+        filekey = os.path.join(settings.gsesoftdir, softname)
+        gsesoft_latest, latest_sha256 = get_latest_hash(conn, filekey, 
+            lambda: ([fp for fp in (getlatest_filepath(gsesoftpath, filestr,
+                returntype='returnlist') or []) if fp.endswith(softname)
+            ] or [None])[0])
+        if not sha256:
+            sha256 = file_sha256(new_filepath)
+        record = dldict[gse][index]
+        if gsesoft_latest and latest_sha256 == sha256:
+            print('identical file found in dest_dir, removing...')
+            dldict[gse].append(False)
+            set_remote_stat(conn, record[1], os.path.getsize(new_filepath), 
+                record[4], gsesoft_latest)
+            os.remove(new_filepath)
+            if journal:
+                journal_set(journal, dldict[gse][index][1], 'committed', 
+                    isnew=0)
+        else:
+            print('new file detected in temp_dir, moving to dest_dir..')
+            dest_filepath = os.path.join(gsesoftpath, 
+                os.path.basename(new_filepath))
+            commit_file(new_filepath, dest_filepath)
+            set_latest_hash(conn, filekey, dest_filepath, sha256)
+            set_remote_stat(conn, record[1], os.path.getsize(dest_filepath), 
+                record[4], dest_filepath)
+            dldict[gse].append(True)
+            dldict[gse][index][2] = dest_filepath
+            if journal:
+                journal_set(journal, dldict[gse][index][1], 'committed', 
+                    destpath=dest_filepath, isnew=1)
+    return dldict
+
+def dl_soft_gse(gse, pool, datemap, temp_dir_make, timestamp, retries_files=3,
+    interval_file=.01, journal=None, validation='hash'):
+    """ dl_soft_gse
+        
+        Download the family soft file for a single GSE ID, using a session from
+        an FTP pool.
+        
+        Arguments:
+            * gse (str) : A valid GSE ID.
+            * pool (FTPPool) : Pool of logged-in FTP sessions.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                rmdb_dates().
+            * temp_dir_make (str) : Temp directory for new downloads.
+            * timestamp (str) : An NTP timestamp for versioning.
+            * retries_files (int) : Number of retry attempts allowed for soft 
+                file downloads.
+            * interval_file (float) : Time (in seconds) to sleep before retrying 
+                a file connection. 
+            * journal (str) : Task key in the download journal, or None to not
+                journal downloads.
+            * validation (str) : Validation policy, 'hash' or 'stat'.
+        
+        Returns:
+            * gsedl (list) : Records for the GSE ID, in dldict format.
+            * files_written (list) : Tuples of (gse, path written, index of 
+                record in gsedl, sha256 of file), for validation.
+    """
+    print('beginning download for gse: '+gse)
+    gsedl = []
     files_written = []
-    for gsm_id in input_list:
-        print('Starting GSM: '+gsm_id)
-        dldict[gsm_id] = []
-        id_ftptokens = [
-                'ftp.ncbi.nlm.nih.gov', 'geo', 'samples',
-                gsm_id[:-3] + 'nnn', gsm_id, 'suppl'
-            ]
-        id_ftpadd = '/'.join(id_ftptokens[1::])+'/'
-        filenames = []
+    id_ftpadd = gse_soft_dir(gse)
+    ftp = None
+    try:
+        ftp = pool.get()
         retries_left_files = retries_files
-        try:
-            filenames = ftp.nlst(id_ftpadd)
-            if len(filenames)>0:
-                filestr = '; '.join(str(e) for e in filenames)
-                print("files found: "+filestr)
-                dldict[gsm_id].append([gsm_id,
-                    id_ftpadd,
-                    "connection success, valid num idats found"]
-                    )
-                print("Idat filenames detected for "+gsm_id+", continuing...") 
-                for file in filenames:
-                    print("Beginning iteration for file: "+file)
-                    filedate = ""
-                    filedate_estat = ""
-                    filedl_estat = ""
-                    file_tokens = file.split('/')
-                    try:
-                        filedate = ftp.sendcmd("MDTM /" + '/'.join(file_tokens))
-                        filedate = datetime.datetime.strptime(filedate[4:],
-                            "%Y%m%d%H%M%S")
-                        mongo_date = idat_mongo_date(gsm_id,file,client)
-                        if filedate in mongo_date:
-                            filedate_estat = "same_as_local_date"
-                            dldict[gsm_id].append(
-                                [gsm_id,
-                                file,
-                                filedate,
-                                filedate_estat]
-                                )
-                            print('Online date same as local date. Breaking..')
-                            break
-                        else:
-                            filedate_estat = "new_date"
-                            to_write = os.path.join(
-                                    temp_dir_make,
-                                    '.'.join([gsm_id, str(timestamp), 
-                                    file_tokens[-1]])
-                                )
-                            file_ftpadd = '/'.join(file_tokens[:-1])
-                            file_ftpadd = file_ftpadd+'/'+file_tokens[-1:][0]
-                            print('Attempting file download, for file: '
-                                +file)
-                            try:
-                                with open(to_write, 'wb') as output_stream:
-                                    filedl_estat = ftp.retrbinary(
-                                            "RETR /"+file_ftpadd,
-                                            output_stream.write
-                                        )
-                                dldict[gsm_id].append(
-                                        [gsm_id,
-                                        file_ftpadd,
-                                        to_write,
-                                        filedl_estat,
-                                        filedate,
-                                        filedate_estat]
-                                    )
-                                if '226 Transfer complete' in filedl_estat:
-                                    files_written.append(
-                                            (gsm_id, to_write, 
-                                                len(dldict[gsm_id]) - 1)
-                                        )
-                                print("File successfully downloaded. "
-                                    +"Continuing...")
-                                continue
-                            except ftplib.all_errors as efiledl:
-                                if retries_left_files:
-                                    retries_left_files -= 1
-                                    print('ftp file dl error, retries left = '
-                                    +str(retries_left_files))
-                                    time.sleep(interval_file)
-                                    continue
-                                else:
-                                    print('File retries exhausted. Breaking...')
-                                    filedl_estat = str(efiledl)
-                                    dldict[gsm_id].append(
-                                            [gsm_id,
-                                            file_ftpadd,
-                                            to_write,
-                                            filedl_estat,
-                                            filedate,
-                                            filedate_estat]
-                                        )
-                                    break
-                            break
-                        break    
-                    except ftplib.all_errors as efiledate:
-                        if retries_left_files:
-                            retries_left_files -= 1
-                            print('ftplib file date error, retries left = '
-                            +str(retries_left_files))
-                            time.sleep(interval_file)
-                            continue
-                        else:
-                            print('File retries exhausted. Breaking...')
-                            filedate_estat = str(efiledate)
-                            filedate = "not_available"
-                            dldict[gsm_id].append(
-                                    [gsm_id,
-                                    file,
-                                    filedate,
-                                    filedate_estat]
-                                    )
-                            break
-                    continue 
-            else:
-                dldict[gsm_id].append([gsm_id,
-                    "no files at ftp address"]
-                    )
+        while True:
+            try:
+                listing = cached_listdir(ftp, id_ftpadd)
+                filenames = list(listing.keys())
+                # filter for only soft file names
+                file = list(filter(lambda x:'family.soft' in x,filenames))[0]
                 break
-        except ftplib.error_temp as eid:
-            if retries_left_files:
-                retries_left_files -= 1
-                print('ftplib filenames error, retries left = '
-                    +str(retries_left_files))
-                time.sleep(interval_file)
-                continue
-            else:
-                print('File retries exhausted. Breaking...')
-                dldict[gsm_id].append([gsm_id, id_ftpadd, str(eid)])
+            except ftplib.all_errors + (IndexError,) as eid:
+                print('error listing soft files at '+id_ftpadd)
+                if retries_left_files:
+                    retries_left_files -= 1
+                    print('ftplib error encountered, file retries left = '
+                        +str(retries_left_files))
+                    time.sleep(interval_file)
+                    if isinstance(eid, (OSError, EOFError)):
+                        ftp = pool.reconnect(ftp)
+                    continue
+                else:
+                    print('file retries exhausted, breaking..')
+                    gsedl.append([gse, id_ftpadd, str(eid)])
+                    return gsedl, files_written
+        gsedl.append([gse,
+            id_ftpadd,
+            "success"]
+            )
+        filedate = ""
+        filedate_estat = ""
+        filedl_estat = ""
+        file_tokens = file.split('/')
+        while True:
+            try:
+                filedate = listing[file]['modify']
+                if not filedate:
+                    print('getting date from '+'/'.join(file_tokens))
+                    filedate = ftp.sendcmd("MDTM /" + '/'.join(file_tokens))
+                    filedate = datetime.datetime.strptime(filedate[4:],
+                        "%Y%m%d%H%M%S")
                 break
-    if validate:
-        print("Validating downloaded files...")
-        for gsm_id, file_written, index in files_written:
-            print("file written is "+file_written)
-            filestr = os.path.basename(file_written).split('.')[2::]
-            filestr = str('.'.join(filestr))
-            print('filestr written : '+filestr)
-            print('dir to search latest: '+idatspath)
-            gsmidat_latest = getlatest_filepath(idatspath, filestr,
-                    embeddedpattern=True, returntype='returnlist', tslocindex=1
-                )
-            print('gsm latest: '+str(gsmidat_latest))
-            if gsmidat_latest:
-                gsmidat_latest = gsmidat_latest[0]
-                print('cmp result: '
-                        +str(filecmp.cmp(gsmidat_latest, file_written))
-                    )
-                if filecmp.cmp(gsmidat_latest, file_written):
-                    print("Downloaded file is same as recent file. Removing...")
-                    os.remove(file_written)
-                    # If filename is false, we found it was the same
-                    dldict[gsm_id][index].append(False)
+            except ftplib.all_errors as efiledate:
+                print('error getting date from '+'/'.join(file_tokens))
+                if retries_left_files:
+                    retries_left_files -= 1
+                    print('continuing with file retries left = '
+                        +str(retries_left_files))
+                    time.sleep(interval_file)
+                    if isinstance(efiledate, (OSError, EOFError)):
+                        ftp = pool.reconnect(ftp)
+                    continue
                 else:
-                    print("Downloaded file is new, moving to idatspath...")
-                    shutil.move(file_written, os.path.join(
-                            idatspath, os.path.basename(file_written))
-                        )
-                    dldict[gsm_id][index].append(True)
-                    dldict[gsm_id][index][2] = os.path.join(
-                                idatspath, os.path.basename(file_written)
-                            )
+                    print('file retries exhausted, breaking..')
+                    filedate_estat = str(efiledate)
+                    filedate = "not_available"
+                    gsedl.append([gse, file, filedate, filedate_estat])
+                    return gsedl, files_written
+        if filedate in datemap.get(file, ()):
+            print('online  date same as local date,'
+                +'breaking...')
+            filedate_estat = "same_as_local_date"
+            gsedl.append([gse, file, filedate, filedate_estat])
+            return gsedl, files_written
+        remote_size = listing[file]['size']
+        if validation == 'stat':
+            try:
+                remote_size, stored = remote_unchanged(ftp, file, remote_size,
+                    filedate)
+            except ftplib.all_errors as esize:
+                print('error getting size of '+file+': '+str(esize))
+                stored = None
+            if stored:
+                print('online size and date same as '+stored+', breaking...')
+                gsedl.append([gse, file, filedate, "same_as_local_stat"])
+                return gsedl, files_written
+        print('new online date found, continuing...')
+        filedate_estat = "new_date"
+        to_write = os.path.join(
+                temp_dir_make,
+                '.'.join([gse, timestamp, 
+                file_tokens[-1]])
+            )
+        file_ftpadd = '/'.join(file_tokens[:-1])
+        file_ftpadd = file_ftpadd+'/'+file_tokens[-1:][0]
+        entry = journal_adopt(journal, file_ftpadd) if journal else None
+        if entry:
+            print('adopting journaled '+entry['state']+' soft '+file_ftpadd)
+            gsedl.append(journal_record(entry))
+            if entry['state'] == 'committed':
+                gsedl.append(bool(entry['isnew']))
             else:
-                print("Downloaded file is new, moving...")
-                shutil.move(file_written, os.path.join(
-                            idatspath, os.path.basename(file_written))
-                        )
-                dldict[gsm_id][index].append(True)
-                dldict[gsm_id][index][2] = os.path.join(
-                                idatspath, os.path.basename(file_written)
-                            )
-        shutil.rmtree(temp_dir_make)
-    return dldict
+                files_written.append((gse, entry['temppath'], len(gsedl) - 1,
+                    entry['sha256']))
+            return gsedl, files_written
+        if journal:
+            journal_set(journal, file_ftpadd, 'transferring', id=gse, 
+                temppath=to_write, filedate=filedate)
+        print('downloading soft from '+file_ftpadd)
+        ftp, filedl_estat, sha256 = retr_resume(pool, ftp, file_ftpadd, 
+            to_write, retries_files=retries_left_files, 
+            interval_file=interval_file, remote_size=remote_size)
+        if journal:
+            journal_set(journal, file_ftpadd, 'verified' if sha256 else 
+                'pending', sha256=sha256)
+        gsedl.append(
+                [gse,
+                file_ftpadd,
+                to_write,
+                filedl_estat,
+                filedate,
+                filedate_estat]
+            )
+        if filedl_estat.startswith('226'):
+            files_written.append((gse, to_write, len(gsedl) - 1, sha256))
+            print('soft transfer successful for '+to_write)
+        return gsedl, files_written
+    except ftplib.all_errors as econ:
+        print('ftp connection lost for '+gse+', returning...')
+        gsedl.append([gse, id_ftpadd, str(econ)])
+        return gsedl, files_written
+    finally:
+        if ftp:
+            pool.put(ftp, discard=ftp.sock is None)
 
 def dl_soft(gse_list=[], retries_connection=3, retries_files=3, interval_con=.1, 
-    interval_file=.01, validate=True, timestamp=gettime_ntp()):
+    interval_file=.01, validate=True, timestamp=None, 
+    nconn=settings.ftpnconn, datemap=None, temp_dir=None, journal=None,
+    validation=settings.dlvalidation, aimd=settings.dlaimd):
     """ dl_soft
         
         Download GSE soft file(s). Accepts either a list of GSM IDs or ftp 
-        addresses.
+        addresses. GSE IDs are downloaded concurrently over a bounded pool of 
+        FTP sessions.
         
         Arguments:
             * gse_list (list, required) : A list of valid GSE id(s).
@@ -329,198 +1281,65 @@ def dl_soft(gse_list=[], retries_connection=3, retries_files=3, interval_con=.1,
                 a file connection. 
             * validate (Bool.): Validate new files against existing idats?
             * timestamp (str) : An NTP timestamp for versioning.     
+            * nconn (int) : Size of the FTP session pool, or the max number of
+                concurrent GSE downloads.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                rmdb_dates(), or None to query RMDB for gse_list.
+            * temp_dir (str) : Temp directory for new downloads, kept after
+                validation, or None for a new temp directory.
+            * journal (str) : Task key in the download journal (with temp_dir
+                and timestamp from dljournal.journal_begin()), or None to not 
+                journal downloads.
+            * validation (str) : Validation policy, either 'hash' or 'stat', 
+                as for dl_idat().
+            * aimd (Bool.) : Whether to adapt the number of concurrent GSE 
+                downloads, as for dl_idat().
         
         Returns: 
             * Dictionary showing records, dates, and exit statuses of ftp calls
                 OR error string over connection issues
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     gsesoftpath = settings.gsesoftpath
     temppath = settings.temppath
     os.makedirs(gsesoftpath, exist_ok=True)
-    os.makedirs(temppath, exist_ok=True)
-    temp_dir_make = tempfile.mkdtemp(dir=temppath)
+    temp_dir_make = temp_dir or tempfile.mkdtemp(dir=staging_dir(gsesoftpath, 
+        temppath))
     item = gse_list[0]
     if not item.startswith('GSE'):
         raise RuntimeError("GSE IDs must begin with \"GSE\".")
-    ftptoken_login = 'ftp.ncbi.nlm.nih.gov'
-    retries_left_connection = retries_connection
-    while retries_left_connection:
-        print('trying ftp connection')
-        try:
-            ftp = ftplib.FTP(ftptoken_login)
-            loginstat = ftp.login()
-            print('connection successful, continuing...')
-            break
-        except ftplib.all_errors as e:
-            if retries_left_connection:
-                retries_left_connection -= 1
-                print('continuing with connection retries left = '
-                    +str(retries_left_connection))
-                time.sleep(interval_con)
-                continue
-            else:
-                print('connection retries exhausted, returning...')
-                return str(e)
-    # mongodb connection
-    client = pymongo.MongoClient(settings.rmdbhost, settings.rmdbport) 
+    controller = AIMDController(start=nconn, maxconn=min(settings.dlmaxconn,
+        len(gse_list))) if aimd else None
+    pool = FTPPool(nconn=min(nconn, len(gse_list)), host=settings.ftphost, 
+        port=settings.ftpport, retries_connection=retries_connection, 
+        interval_con=interval_con, controller=controller, 
+        mirror=settings.geomirror)
+    try:
+        pool.put(pool.get())
+    except ftplib.all_errors as e:
+        return str(e)
+    if datemap is None:
+        datemap = rmdb_dates(gse_list=gse_list)
     dldict = {}
+    files_written = []
     print('beginning iterations over gse list...')
-    for gse in gse_list:
-        print('beginning download for gse: '+gse)
-        retries_left_files = retries_files 
-        dldict[gse] = []
-        files_written = []
-        filenames = []
-        # tokens for soft file ftp address
-        id_ftptokens = [
-                'ftp.ncbi.nlm.nih.gov', 'geo', 'series',
-                gse[:-3] + 'nnn', gse, 'soft'
-            ]
-        id_ftpadd = '/'.join(id_ftptokens[1::])+'/'
-        while retries_left_files:
-            try:
-                filenames = ftp.nlst(id_ftpadd)
-                # filter for only soft file names
-                file = list(filter(lambda x:'family.soft' in x,filenames))[0]
-                dldict[gse].append([gse,
-                    id_ftpadd,
-                    "success"]
-                    )
-                filedate = ""
-                filedate_estat = ""
-                filedl_estat = ""
-                file_tokens = file.split('/')
-                try:
-                    print('getting date from '+'/'.join(file_tokens))
-                    filedate = ftp.sendcmd("MDTM /" + '/'.join(file_tokens))
-                    filedate = datetime.datetime.strptime(filedate[4:],
-                        "%Y%m%d%H%M%S")
-                    mongo_date = soft_mongo_date(gse,file,client)
-                    if filedate in mongo_date:
-                        print('online  date same as local date,'
-                            +'breaking...')
-                        filedate_estat = "same_as_local_date"
-                        dldict[gse].append(
-                            [gse,
-                            file,
-                            filedate,
-                            filedate_estat]
-                            )
-                        break
-                    else:
-                        print('new online date found, continuing...')
-                        filedate_estat = "new_date"
-                        to_write = os.path.join(
-                                temp_dir_make,
-                                '.'.join([gse, timestamp, 
-                                file_tokens[-1]])
-                            )
-                        file_ftpadd = '/'.join(file_tokens[:-1])
-                        file_ftpadd = file_ftpadd+'/'+file_tokens[-1:][0]
-                        try:
-                            print('downloading soft from '+file_ftpadd)
-                            with open(to_write, 'wb') as output_stream:
-                                filedl_estat = ftp.retrbinary(
-                                        "RETR /"+file_ftpadd,
-                                        output_stream.write
-                                    )
-                            dldict[gse].append(
-                                    [gse,
-                                    file_ftpadd,
-                                    to_write,
-                                    filedl_estat,
-                                    filedate,
-                                    filedate_estat]
-                                )
-                            if '226 Transfer complete' in filedl_estat:
-                                files_written.append(
-                                        (gse, to_write, len(dldict[gse]) - 1)
-                                    )
-                            print('total files written = '
-                                +str(len(files_written)))
-                            print('soft transfer successful for '
-                                    +to_write+', breaking...')
-                            break
-                        except ftplib.all_errors as efiledl:
-                            print('file download error from '+file_ftpadd)
-                            if retries_left_files:
-                                retries_left_files -= 1
-                                print('continuing with file retries left ='
-                                    +str(retries_left_files))
-                                time.sleep(interval_file)
-                                continue
-                            else:
-                                print('file retries exhausted, breaking..')
-                                filedl_estat = str(efiledl)
-                                dldict[gse].append(
-                                        [gse,
-                                        file_ftpadd,
-                                        to_write,
-                                        filedl_estat,
-                                        filedate,
-                                        filedate_estat]
-                                    )
-                                break
-                except ftplib.all_errors as efiledate:
-                    print('error getting date from '+'/'.join(file_tokens))
-                    if retries_left_files:
-                        retries_left_files -= 1
-                        print('continuing with file retries left = '
-                            +str(retries_left_files))
-                        time.sleep(interval_file)
-                        continue
-                    else:
-                        print('file retries exhausted, breaking..')
-                        filedate_estat = str(efiledate)
-                        filedate = "not_available"
-                        dldict[gse].append(
-                                [gse,
-                                file,
-                                filedate,
-                                filedate_estat]
-                                )
-                        break
-            except ftplib.error_temp as eid:
-                print('error making ftp connection to '+id_ftpadd)
-                if retries_left_files:
-                    retries_left_connection -= 1
-                    print('ftplib error encountered, file retries left = '
-                        +str(retries_left_files))
-                    time.sleep(interval_file)
-                    continue
-                else:
-                    print('file retries exhausted, breaking..')
-                    dldict[gse].append([gse, id_ftpadd, str(eid)])
-                    break
+    start = time.time()
+    try:
+        gseresults = pool_map(partial(dl_soft_gse, datemap=datemap, 
+                temp_dir_make=temp_dir_make, timestamp=timestamp, 
+                retries_files=retries_files, interval_file=interval_file,
+                journal=journal, validation=validation), 
+            gse_list, pool)
+    finally:
+        pool.close()
+    for gse, (gsedl, gse_written) in zip(gse_list, gseresults):
+        dldict[gse] = gsedl
+        files_written.extend(gse_written)
+    print('total files written = '+str(len(files_written)))
+    log_throughput('soft', files_written, time.time() - start)
     if validate:
-        print('commencing file validation...')
-        for gse, new_filepath, index in files_written:
-            filestr = os.path.basename(new_filepath).split('.')[0]
-            gsesoft_latest = getlatest_filepath(gsesoftpath,filestr)
-            if gsesoft_latest and not gsesoft_latest == 0:
-                if filecmp.cmp(gsesoft_latest, new_filepath):
-                    print('identical file found in dest_dir, removing...')
-                    dldict[gse].append(False)
-                    os.remove(new_filepath)
-                else:
-                    print('new file detected in temp_dir, moving to '
-                        +'dest_dir...')
-                    dldict[gse].append(True)
-                    dldict[gse][index][2] = os.path.join(
-                                gsesoftpath, os.path.basename(new_filepath)
-                            )
-                    shutil.move(new_filepath, os.path.join(
-                            dest_dir, os.path.basename(new_filepath))
-                        )
-            else:
-                print('new file detected in temp_dir, moving to dest_dir..')
-                dldict[gse].append(True)
-                dldict[gse][index][2] = os.path.join(
-                                gsesoftpath, os.path.basename(new_filepath)
-                            )
-                shutil.move(new_filepath, os.path.join(
-                            gsesoftpath, os.path.basename(new_filepath))
-                        )
-            continue
-        shutil.rmtree(temp_dir_make)
+        validate_soft(dldict, files_written, gsesoftpath, journal)
+        if not temp_dir:
+            shutil.rmtree(temp_dir_make)
     return dldict
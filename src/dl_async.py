@@ -0,0 +1,1111 @@
+#!/usr/bin/env python3
+
+""" dl_async.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Asyncio download engine for idats and experiment soft files from GEO. This
+    is an alternative to dl_idat and dl_soft in dl.py, returning the same
+    download dictionaries.
+
+    Notes:
+        * Directory listings, MDTM date checks, and RETR transfers for all IDs
+            in a call run as coroutines in one event loop, sharing a bounded
+            pool of FTP control connections. No thread is used per connection.
+        * Validation of new files uses validate_idats and validate_soft from
+            dl.py.
+        * Connections, commands, and bytes draw on the same host-wide GEO
+            limits as dl.py, from ratelimit.py.
+        * Calls to SQLite (rate limits, leases, the download journal, the 
+            listing cache, and the hash index) run in the default thread pool
+            with in_thread(), so lock waits do not stall other coroutines.
+        * With aimd=True, the number of sessions checked out at once is set by
+            an AIMDController (aimd.py), as in dl.py.
+        * With hedge=True, idat transfers much slower than their peers get a
+            duplicate transfer, and the slower one is cancelled (hedge.py).
+        * With a claim run key, GSM IDs claimed by other GSE tasks in the run
+            are reused rather than downloaded (gsmclaim.py).
+        * Run from synchronous code with asyncio.run(), e.g.
+            'asyncio.run(dl_idat_async(gsmlist))'.
+
+    Classes and Functions:
+        * in_thread: Run a blocking call in the default thread pool.
+        * release_later: Release a connection lease off the event loop.
+        * AsyncFTP: Minimal asyncio FTP client (passive mode, binary type).
+        * AsyncMirror: Asyncio wrapper for HTTP(S) and local mirror sessions.
+        * AsyncFTPPool: Bounded pool of logged-in AsyncFTP sessions, or of
+            AsyncMirror sessions with a mirror URL (settings.geomirror).
+        * dl_idat_async: Download and validate idat files.
+        * dl_soft_async: Download and validate soft files.
+"""
+
+import asyncio, ftplib, datetime, os, sys, re, tempfile, shutil, hashlib, zlib
+import time
+from contextlib import asynccontextmanager; from functools import partial
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+from utilities import gettime_ntp
+from dl import rmdb_dates, validate_idats, validate_soft
+from dl import parse_mlsd, refresh_listing_later, log_throughput, ftp_listdir
+from filehash import hashing_writer, file_sha256, cached_connect
+from filehash import stat_unchanged
+from gzstream import GunzipWriter
+from staging import staging_dir, preallocate
+from hedge import HedgeMonitor
+from gsmclaim import claim_gsms, finish_gsms, release_gsms, poll_gsms
+from gsmclaim import gsm_result, reused_records
+from ratelimit import reserve, try_lease, release_lease
+from transport import gsm_suppl_dir, gse_soft_dir, is_remote, open_session
+from aimd import AIMDController
+from dljournal import journal_adopt, journal_set, journal_record
+from listcache import get_cached_listing, set_cached_listing
+import settings
+settings.init()
+
+async def in_thread(func, *args, **kwargs):
+    """ in_thread
+
+        Run a blocking call (e.g. a SQLite query) in the default thread pool,
+        and return its result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None,
+        partial(func, *args, **kwargs))
+
+def release_later(leaseid):
+    """ release_later
+
+        Release a connection lease from the default thread pool when called
+        in an event loop, or else at once.
+    """
+    if not leaseid:
+        return
+    try:
+        asyncio.get_running_loop().run_in_executor(None, release_lease, 
+            leaseid)
+    except RuntimeError:
+        release_lease(leaseid)
+
+class AsyncFTP:
+    """ AsyncFTP
+
+        Minimal asyncio FTP client, supporting the commands used for GEO
+        downloads (NLST, MDTM, RETR). Error replies raise the matching ftplib
+        exceptions, so callers can catch ftplib.all_errors. A transfer stopped
+        by an error in its callback leaves its reply unread, and sets broken
+        so the session is not reused.
+
+        Arguments:
+            * host (str) : FTP host address.
+            * port (int) : FTP control port.
+            * timeout (float) : Seconds to wait on any single read.
+    """
+    def __init__(self, host=settings.ftphost, port=settings.ftpport,
+        timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.nomlsd = False
+        self.leaseid = None
+        self.controller = None
+        self.broken = False
+
+    async def getresp(self):
+        """ getresp
+
+            Read a (possibly multi-line) reply, raising on 4xx/5xx codes.
+        """
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise EOFError('connection closed by server')
+        resp = line.decode('latin-1').rstrip('\r\n')
+        if resp[3:4] == '-':
+            code = resp[:3]
+            while True:
+                line = await asyncio.wait_for(self.reader.readline(),
+                    self.timeout)
+                if not line:
+                    raise EOFError('connection closed by server')
+                nextline = line.decode('latin-1').rstrip('\r\n')
+                resp = resp + '\n' + nextline
+                if nextline[:3] == code and nextline[3:4] != '-':
+                    break
+        if resp[:1] == '4':
+            if self.controller:
+                self.controller.record_error(resp)
+            raise ftplib.error_temp(resp)
+        if resp[:1] == '5':
+            raise ftplib.error_perm(resp)
+        return resp
+
+    async def sendcmd(self, cmd):
+        """ sendcmd
+
+            Send a command and return the reply string.
+        """
+        if settings.geocmdrate:
+            await asyncio.sleep(await in_thread(reserve, 'geocmds', 1, 
+                settings.geocmdrate))
+        self.writer.write((cmd + '\r\n').encode('latin-1'))
+        await self.writer.drain()
+        return await self.getresp()
+
+    async def connect(self):
+        """ connect
+
+            Open the control connection, log in anonymously, and set binary
+            transfer type. Waits for a host-wide GEO connection lease.
+        """
+        while self.leaseid is None:
+            self.leaseid = await in_thread(try_lease, 'geoftp', 
+                settings.geomaxconn)
+            if self.leaseid is None:
+                await asyncio.sleep(.5)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            await self.getresp()
+            resp = await self.sendcmd('USER anonymous')
+            if resp[0] == '3':
+                await self.sendcmd('PASS anonymous@')
+            await self.sendcmd('TYPE I')
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    async def opendata(self, limit=65536):
+        """ opendata
+
+            Open a passive mode data connection, trying EPSV then PASV. The 
+            stream reader buffers up to about twice limit bytes. A reply with
+            no address raises ftplib.error_reply, e.g. on a session out of
+            step with its replies.
+        """
+        try:
+            resp = await self.sendcmd('EPSV')
+            match = re.search(r'\(\|\|\|(\d+)\|\)', resp)
+            if not match:
+                raise ftplib.error_reply(resp)
+            port = int(match.group(1))
+            host = self.host
+        except ftplib.error_perm:
+            resp = await self.sendcmd('PASV')
+            match = re.search(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)', resp)
+            if not match:
+                raise ftplib.error_reply(resp)
+            nums = match.groups()
+            host = '.'.join(nums[:4])
+            port = (int(nums[4]) << 8) + int(nums[5])
+        return await asyncio.wait_for(asyncio.open_connection(host, port,
+            limit=limit), self.timeout)
+
+    async def transfer(self, cmd, callback, blocksize=65536, rest=None):
+        """ transfer
+
+            Run a data transfer command, passing each received block to
+            callback. Returns the final reply.
+        """
+        dreader, dwriter = await self.opendata(max(65536, blocksize))
+        try:
+            if rest:
+                await self.sendcmd('REST ' + str(rest))
+            await self.sendcmd(cmd)
+            received = 0
+            while True:
+                block = await asyncio.wait_for(dreader.read(blocksize),
+                    self.timeout)
+                if not block:
+                    break
+                try:
+                    callback(block)
+                except BaseException:
+                    self.broken = True
+                    raise
+                received += len(block)
+                if self.controller:
+                    self.controller.record_bytes(len(block))
+                if settings.geobyterate and received >= 1048576:
+                    await asyncio.sleep(await in_thread(reserve, 'geobytes',
+                        received, settings.geobyterate, 
+                        max(settings.geobyterate, received)))
+                    received = 0
+        finally:
+            dwriter.close()
+        return await self.getresp()
+
+    async def nlst(self, path):
+        """ nlst
+
+            Return a list of file paths in a directory.
+        """
+        chunks = []
+        await self.transfer('NLST ' + path, chunks.append)
+        return [line for line in b''.join(chunks).decode('latin-1').splitlines()
+            if line]
+
+    async def listdir(self, path, usemlsd=settings.ftpmlsd):
+        """ listdir
+
+            List files in a directory with MLSD, as dl.ftp_listdir, falling
+            back to NLST with sizes and dates left as None.
+        """
+        if usemlsd and not self.nomlsd:
+            chunks = []
+            try:
+                await self.transfer('MLSD ' + path, chunks.append)
+                return parse_mlsd(b''.join(chunks).decode('latin-1'
+                    ).splitlines(), path)
+            except ftplib.error_perm as emlsd:
+                if not str(emlsd)[:3] in ('500', '501', '502', '504'):
+                    raise
+                self.nomlsd = True
+        return {file : {'size' : None, 'modify' : None}
+            for file in await self.nlst(path)}
+
+    async def retrbinary(self, cmd, callback, blocksize=65536, rest=None):
+        """ retrbinary
+
+            Retrieve a file in binary mode, as ftplib.FTP.retrbinary.
+        """
+        return await self.transfer(cmd, callback, blocksize, rest)
+
+    def close(self):
+        """ close
+
+            Close the control connection without logging out, and release
+            its connection lease.
+        """
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        release_later(self.leaseid)
+        self.leaseid = None
+
+    async def quit(self):
+        """ quit
+
+            Log out and close the control connection.
+        """
+        try:
+            await self.sendcmd('QUIT')
+        except ftplib.all_errors:
+            pass
+        self.close()
+
+class AsyncMirror:
+    """ AsyncMirror
+
+        Asyncio wrapper for a mirror session (transport.py), with the AsyncFTP
+        methods used here. Blocking session calls run in the default thread
+        pool, and a cancelled transfer is aborted at its next block.
+
+        Arguments:
+            * mirror (str) : URL of the mirror endpoint.
+    """
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.session = None
+        self.leaseid = None
+        self.controller = None
+        self.broken = False
+
+    async def run(self, func, *args):
+        """ run
+
+            Run a blocking call in the default thread pool.
+        """
+        return await in_thread(func, *args)
+
+    async def connect(self):
+        """ connect
+
+            Open the mirror session, holding the lease set by the pool.
+        """
+        try:
+            self.session = await self.run(open_session, self.mirror)
+        except BaseException:
+            self.close()
+            raise
+        self.session.controller = self.controller
+        return self
+
+    async def sendcmd(self, cmd):
+        return await self.run(self.session.sendcmd, cmd)
+
+    async def listdir(self, path, usemlsd=settings.ftpmlsd):
+        return await self.run(ftp_listdir, self.session, path, usemlsd)
+
+    async def retrbinary(self, cmd, callback, blocksize=65536, rest=None):
+        try:
+            return await self.run(self.session.retrbinary, cmd, callback,
+                blocksize, rest)
+        except asyncio.CancelledError:
+            self.session.abort_transfer()
+            raise
+
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+        release_later(self.leaseid)
+        self.leaseid = None
+
+    async def quit(self):
+        self.close()
+
+class AsyncFTPPool:
+    """ AsyncFTPPool
+
+        Bounded pool of logged-in AsyncFTP sessions, opened lazily. Sessions
+        failing at the connection level are replaced on next checkout.
+
+        Arguments:
+            * nconn (int) : Maximum number of open sessions.
+            * host (str) : FTP host address.
+            * port (int) : FTP control port.
+            * retries_connection (int) : Connection retries per new session.
+            * interval_con (float) : Seconds between connection retries.
+            * controller (AIMDController) : Adaptive limit on sessions checked
+                out at once, or None. The pool size is then controller.maxconn.
+            * mirror (str) : URL of a mirror endpoint serving AsyncMirror
+                sessions in place of the FTP server at host, or ''.
+    """
+    def __init__(self, nconn=settings.ftpnconn, host=settings.ftphost,
+        port=settings.ftpport, retries_connection=3, interval_con=.1,
+        controller=None, mirror=settings.geomirror):
+        self.controller = controller
+        if controller:
+            nconn = controller.maxconn
+        self.nconn = max(1, int(nconn))
+        self.mirror = mirror
+        self.host = host
+        self.port = port
+        self.retries_connection = retries_connection
+        self.interval_con = interval_con
+        self.idle = asyncio.LifoQueue()
+        self.nopen = 0
+
+    async def connect(self, leaseid=None):
+        """ connect
+
+            Open a new logged-in session, with retries, holding leaseid or 
+            else a new host-wide connection lease.
+        """
+        retries_left_connection = self.retries_connection
+        while True:
+            ftp = AsyncMirror(self.mirror) if self.mirror else AsyncFTP(
+                self.host, self.port)
+            ftp.leaseid, leaseid = leaseid, None
+            ftp.controller = self.controller
+            try:
+                return await ftp.connect()
+            except ftplib.all_errors as e:
+                if retries_left_connection:
+                    retries_left_connection -= 1
+                    print('continuing with connection retries left = '
+                        +str(retries_left_connection))
+                    await asyncio.sleep(self.interval_con)
+                    continue
+                print('connection retries exhausted, returning...')
+                raise
+
+    async def get(self):
+        """ get
+
+            Check out a session, opening one if fewer than nconn are open and
+            a host-wide connection lease is free. With a controller, first
+            waits for an in-flight slot.
+        """
+        if not self.controller:
+            return await self._get()
+        while not self.controller.try_acquire():
+            await asyncio.sleep(.05)
+        try:
+            return await self._get()
+        except BaseException:
+            self.controller.release()
+            raise
+
+    async def _get(self):
+        """ _get
+
+            Check out a session, as get(), without an in-flight slot.
+        """
+        while True:
+            if not self.idle.empty():
+                return self.idle.get_nowait()
+            if self.nopen < self.nconn:
+                # count the session before waiting on a lease, so other
+                # coroutines do not open more than nconn
+                self.nopen += 1
+                leaseid = await in_thread(try_lease, 'geoftp', 
+                    settings.geomaxconn if is_remote(self.mirror) else 0)
+                if leaseid is not None:
+                    try:
+                        return await self.connect(leaseid)
+                    except BaseException:
+                        self.nopen -= 1
+                        raise
+                self.nopen -= 1
+            try:
+                return await asyncio.wait_for(self.idle.get(), .5)
+            except asyncio.TimeoutError:
+                continue
+
+    def put(self, ftp, discard=False):
+        """ put
+
+            Return a session to the pool, or close it if discard is True, or
+            if more sessions are open than the controller limit.
+        """
+        if self.controller:
+            self.controller.release()
+            discard = discard or self.nopen > self.controller.limit
+        if discard:
+            ftp.close()
+            self.nopen -= 1
+        else:
+            self.idle.put_nowait(ftp)
+
+    @asynccontextmanager
+    async def connection(self):
+        """ connection
+
+            Async context manager to check out a session for one command or
+            transfer. Sessions raising connection-level errors, or broken by
+            a failed transfer callback, are discarded.
+        """
+        ftp = await self.get()
+        try:
+            yield ftp
+        except (OSError, EOFError, asyncio.TimeoutError,
+            asyncio.CancelledError, ftplib.error_reply, ftplib.error_proto):
+            # a cancelled transfer leaves its reply unread, and an unexpected
+            # reply means one was left unread before
+            self.put(ftp, discard=True)
+            raise
+        except BaseException:
+            self.put(ftp, discard=ftp.broken)
+            raise
+        else:
+            self.put(ftp)
+
+    async def close(self):
+        """ close
+
+            Log out and close all idle sessions.
+        """
+        while not self.idle.empty():
+            await self.idle.get_nowait().quit()
+            self.nopen -= 1
+
+async def retry_ftp(pool, func, retries_files, interval_file, errmsg):
+    """ retry_ftp
+
+        Run an FTP coroutine on a pooled session, with retries. Each attempt
+        checks out its own session, so other coroutines share the pool
+        between commands.
+
+        Arguments:
+            * pool (AsyncFTPPool) : Pool of FTP sessions.
+            * func (function) : Called as func(ftp), returning an awaitable.
+            * retries_files (int) : Number of retry attempts allowed.
+            * interval_file (float) : Seconds to sleep before retrying.
+            * errmsg (str) : Message printed on each failed attempt.
+
+        Returns:
+            * Result of func, or raises the last error if retries are exhausted.
+    """
+    retries_left_files = retries_files
+    while True:
+        try:
+            async with pool.connection() as ftp:
+                return await func(ftp)
+        except ftplib.all_errors + (asyncio.TimeoutError,) as e:
+            if retries_left_files:
+                retries_left_files -= 1
+                print(errmsg+', retries left = '+str(retries_left_files))
+                await asyncio.sleep(interval_file)
+                continue
+            raise
+
+async def retr_to_file(pool, file_ftpadd, to_write, retries_files,
+    interval_file, remote_size=None, gunzip=None, transfer=None):
+    """ retr_to_file
+
+        Download a file from a pooled session to a local path, with retries.
+        As for dl.retr_resume, failed transfers keep their partial bytes and
+        resume with REST, and the final size is checked against SIZE. A
+        SHA-256 hash is computed from the bytes as they are written. With
+        gunzip (a GunzipWriter), the same bytes are also expanded, and a bad
+        gzip CRC restarts the download from byte zero. With transfer (a
+        hedge.Transfer), bytes received are counted for straggler checks.
+
+        Returns:
+            * filedl_estat (str) : Final reply of the transfer.
+            * sha256 (str) : Hex digest of the downloaded file.
+    """
+    sizes = [] if remote_size is None else [remote_size]
+    async def retr(ftp):
+        if transfer and not transfer.nbytes:
+            # time from session checkout, not from the wait for one
+            transfer.start = time.time()
+        if not sizes:
+            try:
+                sizes.append(int((await ftp.sendcmd("SIZE /"+file_ftpadd))[4:]))
+            except ftplib.error_perm:
+                sizes.append(False)
+        remote_size = sizes[0]
+        offset = 0
+        if os.path.exists(to_write):
+            offset = os.path.getsize(to_write)
+        if remote_size and offset > remote_size:
+            offset = 0
+        hashobj = hashlib.sha256()
+        try:
+            if gunzip:
+                gunzip.reset()
+            if offset:
+                file_sha256(to_write, hashobj, nbytes=offset)
+                if gunzip:
+                    gunzip.write_file(to_write, offset)
+            with open(to_write, 'ab' if offset else 'wb') as output_stream:
+                preallocate(output_stream, remote_size)
+                callback = hashing_writer(output_stream.write, hashobj)
+                if gunzip:
+                    callback = gunzip.tee(callback)
+                if transfer:
+                    callback = transfer.counted(callback)
+                filedl_estat = await ftp.retrbinary("RETR /"+file_ftpadd,
+                    callback, blocksize=settings.dlblocksize, 
+                    rest=offset or None)
+            if remote_size and not os.path.getsize(to_write) == remote_size:
+                raise ftplib.error_temp('451 size mismatch for '+file_ftpadd)
+            if gunzip:
+                gunzip.finish()
+        except ftplib.error_perm:
+            if offset:
+                # server refused REST, so restart from byte zero
+                os.remove(to_write)
+            raise
+        except zlib.error as egzip:
+            # corrupt gzip data, so restart from byte zero
+            os.remove(to_write)
+            raise ftplib.error_temp('451 gzip error for '+file_ftpadd+': '
+                +str(egzip))
+        return filedl_estat, hashobj.hexdigest()
+    try:
+        return await retry_ftp(pool, retr, retries_files, interval_file,
+            'ftp file dl error')
+    except BaseException:
+        if gunzip:
+            gunzip.discard()
+        raise
+
+async def retr_hedged_async(pool, file_ftpadd, to_write, monitor,
+    retries_files, interval_file, remote_size=None, gunzip=None):
+    """ retr_hedged_async
+
+        Download a file as retr_to_file, hedging it if it straggles, as
+        dl.retr_hedged. The duplicate transfer runs on a second connection
+        outside pool, and the slower transfer is cancelled.
+
+        Returns:
+            * filedl_estat (str) : Final reply of the kept transfer.
+            * sha256 (str) : Hex digest of the kept file.
+    """
+    if monitor is None:
+        return await retr_to_file(pool, file_ftpadd, to_write, retries_files,
+            interval_file, remote_size, gunzip)
+    primary = monitor.register()
+    ptask = asyncio.ensure_future(retr_to_file(pool, file_ftpadd, to_write,
+        retries_files, interval_file, remote_size, gunzip, primary))
+    while not ptask.done():
+        await asyncio.wait({ptask}, timeout=monitor.interval)
+        if not ptask.done() and monitor.is_straggler(primary):
+            break
+    if ptask.done():
+        result = ptask.result()
+        monitor.complete(primary)
+        return result
+    print('hedging slow transfer of '+file_ftpadd+', at '
+        +'%.1f' % (primary.rate() / 1e3)+' kB/s')
+    monitor.nhedged += 1
+    hedgepath = to_write + '.hedge'
+    hgunzip = GunzipWriter(gunzip.filepath + '.hedge') if gunzip else None
+    hpool = AsyncFTPPool(nconn=1, host=pool.host, port=pool.port,
+        retries_connection=0, interval_con=pool.interval_con, 
+        mirror=pool.mirror)
+    htask = asyncio.ensure_future(retr_to_file(hpool, file_ftpadd, hedgepath,
+        0, interval_file, remote_size, hgunzip, monitor.register()))
+    try:
+        winner = None
+        pending = {ptask, htask}
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    break
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if winner is None:
+            return ptask.result()
+        if winner is htask:
+            monitor.nwon += 1
+            os.replace(hedgepath, to_write)
+            if gunzip:
+                os.replace(hgunzip.filepath, gunzip.filepath)
+                gunzip.sha256 = hgunzip.sha256
+        else:
+            monitor.complete(primary)
+        return winner.result()
+    finally:
+        await hpool.close()
+        if hgunzip:
+            hgunzip.close()
+        for path in (hedgepath, hgunzip.filepath if hgunzip else None):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+async def cached_listdir_async(pool, dirpath, retries_files, interval_file,
+    usecache=settings.listcache):
+    """ cached_listdir_async
+
+        List a directory from the listing cache, as dl.cached_listdir, listing
+        it on a pooled session when the cached entry is missing or expired.
+        Stale entries are re-listed by the background thread in dl.py.
+
+        Returns:
+            * listing (dict) : File metadata keyed on file FTP address.
+    """
+    if usecache:
+        listing, state = await in_thread(get_cached_listing, dirpath)
+        if state == 'fresh':
+            return listing
+        if state == 'stale':
+            refresh_listing_later(dirpath)
+            return listing
+    listing = await retry_ftp(pool, lambda ftp: ftp.listdir(dirpath),
+        retries_files, interval_file, 'ftplib filenames error')
+    if usecache:
+        await in_thread(set_cached_listing, dirpath, listing)
+    return listing
+
+async def mdtm_date(pool, file, retries_files, interval_file, listing=None):
+    """ mdtm_date
+
+        Get the modification date of a remote file, as a datetime object. The
+        date is read from listing where available, or else requested by MDTM.
+    """
+    if listing and listing.get(file) and listing[file]['modify']:
+        return listing[file]['modify']
+    filedate = await retry_ftp(pool,
+        lambda ftp: ftp.sendcmd("MDTM /" + file), retries_files,
+        interval_file, 'ftplib file date error')
+    return datetime.datetime.strptime(filedate[4:], "%Y%m%d%H%M%S")
+
+async def remote_unchanged_async(pool, file, size, filedate, retries_files,
+    interval_file):
+    """ remote_unchanged_async
+
+        Check a remote file against its last download by size and date, as
+        dl.remote_unchanged, requesting its size with SIZE on a pooled session
+        if not known from a listing.
+
+        Returns:
+            * size (int) : Remote file size, or None if unavailable.
+            * filepath (str) : Path of the unchanged stored file, or None if
+                the file should be downloaded.
+    """
+    if size is None:
+        try:
+            size = int((await retry_ftp(pool,
+                lambda ftp: ftp.sendcmd("SIZE /"+file), retries_files,
+                interval_file, 'ftplib file size error'))[4:])
+        except ftplib.error_perm:
+            return None, None
+    return size, await in_thread(stored_unchanged, file, size, filedate)
+
+def stored_unchanged(file, size, filedate):
+    """ stored_unchanged
+
+        Check a remote file size and date against the hash index, as
+        filehash.stat_unchanged, on this thread's hash index connection.
+    """
+    return stat_unchanged(cached_connect(), file, size, filedate)
+
+async def dl_idat_gsm_async(gsm_id, pool, datemap, temp_dir_make, timestamp,
+    retries_files=3, interval_file=.01, journal=None, expand=False,
+    validation='hash', monitor=None):
+    """ dl_idat_gsm_async
+
+        Download idats for a single GSM ID. Async counterpart of
+        dl.dl_idat_gsm, returning records in the same format.
+
+        Returns
+            * gsmdl (list) : Records for the GSM ID, in dldict format.
+            * files_written (list) : Tuples of (gsm_id, path written, index of
+                record in gsmdl, sha256 of file, sha256 of expanded file or
+                None), for validation.
+    """
+    print('Starting GSM: '+gsm_id)
+    gsmdl = []
+    files_written = []
+    id_ftpadd = gsm_suppl_dir(gsm_id)
+    try:
+        listing = await cached_listdir_async(pool, id_ftpadd, retries_files,
+            interval_file)
+        filenames = list(listing.keys())
+    except ftplib.all_errors + (asyncio.TimeoutError,) as eid:
+        print('File retries exhausted. Breaking...')
+        gsmdl.append([gsm_id, id_ftpadd, str(eid)])
+        return gsmdl, files_written
+    if not len(filenames)>0:
+        gsmdl.append([gsm_id, "no files at ftp address"])
+        return gsmdl, files_written
+    gsmdl.append([gsm_id, id_ftpadd,
+        "connection success, valid num idats found"])
+    for file in filenames:
+        file_tokens = file.split('/')
+        try:
+            filedate = await mdtm_date(pool, '/'.join(file_tokens),
+                retries_files, interval_file, listing)
+        except ftplib.all_errors + (asyncio.TimeoutError,) as efiledate:
+            print('File retries exhausted. Breaking...')
+            gsmdl.append([gsm_id, file, "not_available", str(efiledate)])
+            continue
+        if filedate in datemap.get(file, ()):
+            gsmdl.append([gsm_id, file, filedate, "same_as_local_date"])
+            print('Online date same as local date. Continuing..')
+            continue
+        remote_size = listing[file]['size']
+        if validation == 'stat':
+            try:
+                remote_size, stored = await remote_unchanged_async(pool, file,
+                    remote_size, filedate, retries_files, interval_file)
+            except ftplib.all_errors + (asyncio.TimeoutError,) as esize:
+                print('ftplib file size error: '+str(esize))
+                stored = None
+            if stored:
+                gsmdl.append([gsm_id, file, filedate, "same_as_local_stat"])
+                print('Online size and date same as '+stored+'. Continuing..')
+                continue
+        filedate_estat = "new_date"
+        to_write = os.path.join(temp_dir_make,
+            '.'.join([gsm_id, str(timestamp), file_tokens[-1]]))
+        file_ftpadd = '/'.join(file_tokens)
+        entry = await in_thread(journal_adopt, journal, file_ftpadd
+        ) if journal else None
+        if entry:
+            print('Adopting journaled '+entry['state']+' file: '+file)
+            gsmdl.append(journal_record(entry))
+            if entry['state'] == 'committed':
+                gsmdl[-1].append(bool(entry['isnew']))
+            else:
+                files_written.append((gsm_id, entry['temppath'],
+                    len(gsmdl) - 1, entry['sha256'], None))
+            continue
+        if journal:
+            await in_thread(journal_set, journal, file_ftpadd, 'transferring',
+                id=gsm_id, temppath=to_write, filedate=filedate)
+        gunzip = None
+        if expand and to_write.endswith('.gz'):
+            gunzip = GunzipWriter(os.path.splitext(to_write)[0])
+        print('Attempting file download, for file: '+file)
+        try:
+            filedl_estat, sha256 = await retr_hedged_async(pool, file_ftpadd,
+                to_write, monitor, retries_files, interval_file, remote_size,
+                gunzip)
+        except ftplib.all_errors + (asyncio.TimeoutError,) as efiledl:
+            print('File retries exhausted. Breaking...')
+            if journal:
+                await in_thread(journal_set, journal, file_ftpadd,
+                    'pending')
+            gsmdl.append([gsm_id, file_ftpadd, to_write, str(efiledl),
+                filedate, filedate_estat])
+            continue
+        if journal:
+            await in_thread(journal_set, journal, file_ftpadd, 'verified',
+                sha256=sha256)
+        gsmdl.append([gsm_id, file_ftpadd, to_write, filedl_estat, filedate,
+            filedate_estat])
+        if filedl_estat.startswith('226'):
+            files_written.append((gsm_id, to_write, len(gsmdl) - 1, sha256,
+                gunzip.sha256 if gunzip else None))
+        print("File successfully downloaded. Continuing...")
+    return gsmdl, files_written
+
+async def dl_idat_async(input_list, retries_connection=3, retries_files=3,
+    interval_con=.1, interval_file=.01, validate=True, timestamp=None,
+    nconn=settings.ftpnconn, datemap=None, temp_dir=None, journal=None,
+    expand=settings.dlexpand, validation=settings.dlvalidation,
+    aimd=settings.dlaimd, hedge=settings.dlhedge, claim=None):
+    """ dl_idat_async
+
+        Download idats for a list of GSM IDs in one event loop. Arguments and
+        return value are as for dl.dl_idat.
+
+        Arguments
+            * input list (list, required) : A list of valid GSM IDs.
+            * retries_connection (int) : Number of ftp connection retries
+                allowed.
+            * retries_files (int) : Number of retry attempts allowed for sample
+                file downloads.
+            * interval_con (float) : Time (in seconds) to sleep before retrying
+                a connection.
+            * interval_file (float) : Time (in seconds) to sleep before retrying
+                a file connection.
+            * validate (Bool.): Validate new files against existing idats?
+            * timestamp (str) : An NTP timestamp for versioning.
+            * nconn (int) : Max number of concurrent FTP sessions.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                dl.rmdb_dates(), or None to query RMDB for input_list.
+            * temp_dir (str) : Temp directory for new downloads, kept after
+                validation, or None for a new temp directory.
+            * journal (str) : Task key in the download journal, or None to not
+                journal downloads.
+            * expand (Bool.) : Whether to expand idats while downloading.
+            * validation (str) : Validation policy, 'hash' or 'stat', as for
+                dl.dl_idat.
+            * aimd (Bool.) : Whether to adapt the number of concurrent
+                sessions, starting at nconn, with an AIMDController.
+            * hedge (Bool.) : Whether to hedge idat transfers much slower than
+                their peers, as for dl.dl_idat.
+            * claim (str) : Run key in the host-wide GSM claim registry, or
+                None to not claim GSM IDs, as for dl.dl_idat.
+
+        Returns
+            * dldict (dictionary) : Records, dates, and exit statuses of ftp
+                calls, OR error string over connection issues.
+    """
+    if not timestamp:
+        timestamp = gettime_ntp()
+    idatspath = settings.idatspath
+    temppath = settings.temppath
+    os.makedirs(idatspath, exist_ok=True)
+    temp_dir_make = temp_dir or tempfile.mkdtemp(dir=staging_dir(idatspath, 
+        temppath))
+    if not input_list[0].startswith('GSM'):
+        raise RuntimeError("GSM IDs must begin with \"GSM\".")
+    controller = AIMDController(start=nconn) if aimd else None
+    pool = AsyncFTPPool(nconn=nconn, host=settings.ftphost,
+        port=settings.ftpport, retries_connection=retries_connection,
+        interval_con=interval_con, controller=controller, 
+        mirror=settings.geomirror)
+    try:
+        pool.put(await pool.get())
+    except ftplib.all_errors as e:
+        return str(e)
+    if datemap is None:
+        datemap = await asyncio.get_running_loop().run_in_executor(None,
+            partial(rmdb_dates, gsm_list=input_list))
+    dldict = {}
+    monitor = HedgeMonitor() if hedge else None
+    task = journal or 'pid'+str(os.getpid())
+    todo, held = claim_gsms(input_list, claim, task) if claim else (
+        input_list, [])
+    try:
+        while todo or held:
+            if todo:
+                start = time.time()
+                gsmresults = await asyncio.gather(*[dl_idat_gsm_async(gsm_id,
+                    pool, datemap, temp_dir_make, timestamp, retries_files,
+                    interval_file, journal, expand, validation, monitor)
+                    for gsm_id in todo])
+                files_written = []
+                for gsm_id, (gsmdl, gsm_written) in zip(todo, gsmresults):
+                    dldict[gsm_id] = gsmdl
+                    files_written.extend(gsm_written)
+                log_throughput('idat', files_written, time.time() - start)
+                if validate:
+                    validate_idats(dldict, files_written, idatspath, journal)
+                if claim:
+                    finish_gsms(claim, task, {gsm_id : gsm_result(
+                        dldict[gsm_id]) for gsm_id in todo})
+                todo = []
+            if held:
+                results, todo, held = poll_gsms(held, claim, task)
+                for gsm_id, (owner, result) in results.items():
+                    dldict[gsm_id] = reused_records(gsm_id, owner, result)
+                if held and not todo:
+                    await asyncio.sleep(settings.claimpoll)
+    finally:
+        if claim and todo:
+            release_gsms(claim, task, todo)
+        await pool.close()
+        if monitor:
+            monitor.close()
+    if validate and not temp_dir:
+        shutil.rmtree(temp_dir_make)
+    return {gsm_id : dldict[gsm_id] for gsm_id in input_list
+        if gsm_id in dldict}
+
+async def dl_soft_gse_async(gse, pool, datemap, temp_dir_make, timestamp,
+    retries_files=3, interval_file=.01, journal=None, validation='hash'):
+    """ dl_soft_gse_async
+
+        Download the family soft file for a single GSE ID.
+
+        Returns
+            * gsedl (list) : Records for the GSE ID, in dldict format.
+            * files_written (list) : Tuples of (gse, path written, index of
+                record in gsedl, sha256 of file), for validation.
+    """
+    print('beginning download for gse: '+gse)
+    gsedl = []
+    files_written = []
+    id_ftpadd = gse_soft_dir(gse)
+    try:
+        listing = await cached_listdir_async(pool, id_ftpadd, retries_files,
+            interval_file)
+        filenames = list(listing.keys())
+        file = list(filter(lambda x:'family.soft' in x, filenames))[0]
+    except ftplib.all_errors + (asyncio.TimeoutError, IndexError) as eid:
+        print('file retries exhausted, breaking..')
+        gsedl.append([gse, id_ftpadd, str(eid)])
+        return gsedl, files_written
+    gsedl.append([gse, id_ftpadd, "success"])
+    file_tokens = file.split('/')
+    try:
+        filedate = await mdtm_date(pool, '/'.join(file_tokens), retries_files,
+            interval_file, listing)
+    except ftplib.all_errors + (asyncio.TimeoutError,) as efiledate:
+        print('file retries exhausted, breaking..')
+        gsedl.append([gse, file, "not_available", str(efiledate)])
+        return gsedl, files_written
+    if filedate in datemap.get(file, ()):
+        print('online  date same as local date, breaking...')
+        gsedl.append([gse, file, filedate, "same_as_local_date"])
+        return gsedl, files_written
+    remote_size = listing[file]['size']
+    if validation == 'stat':
+        try:
+            remote_size, stored = await remote_unchanged_async(pool, file,
+                remote_size, filedate, retries_files, interval_file)
+        except ftplib.all_errors + (asyncio.TimeoutError,) as esize:
+            print('error getting size of '+file+': '+str(esize))
+            stored = None
+        if stored:
+            print('online size and date same as '+stored+', breaking...')
+            gsedl.append([gse, file, filedate, "same_as_local_stat"])
+            return gsedl, files_written
+    filedate_estat = "new_date"
+    to_write = os.path.join(temp_dir_make,
+        '.'.join([gse, timestamp, file_tokens[-1]]))
+    file_ftpadd = '/'.join(file_tokens)
+    entry = await in_thread(journal_adopt, journal, file_ftpadd
+        ) if journal else None
+    if entry:
+        print('adopting journaled '+entry['state']+' soft '+file_ftpadd)
+        gsedl.append(journal_record(entry))
+        if entry['state'] == 'committed':
+            gsedl.append(bool(entry['isnew']))
+        else:
+            files_written.append((gse, entry['temppath'], len(gsedl) - 1,
+                entry['sha256']))
+        return gsedl, files_written
+    if journal:
+        await in_thread(journal_set, journal, file_ftpadd, 'transferring',
+            id=gse, temppath=to_write, filedate=filedate)
+    try:
+        print('downloading soft from '+file_ftpadd)
+        filedl_estat, sha256 = await retr_to_file(pool, file_ftpadd,
+            to_write, retries_files, interval_file, remote_size)
+    except ftplib.all_errors + (asyncio.TimeoutError,) as efiledl:
+        print('file retries exhausted, breaking..')
+        if journal:
+            await in_thread(journal_set, journal, file_ftpadd, 'pending')
+        gsedl.append([gse, file_ftpadd, to_write, str(efiledl), filedate,
+            filedate_estat])
+        return gsedl, files_written
+    if journal:
+        await in_thread(journal_set, journal, file_ftpadd, 'verified',
+            sha256=sha256)
+    gsedl.append([gse, file_ftpadd, to_write, filedl_estat, filedate,
+        filedate_estat])
+    if filedl_estat.startswith('226'):
+        files_written.append((gse, to_write, len(gsedl) - 1, sha256))
+    print('soft transfer successful for '+to_write)
+    return gsedl, files_written
+
+async def dl_soft_async(gse_list=[], retries_connection=3, retries_files=3,
+    interval_con=.1, interval_file=.01, validate=True, timestamp=None,
+    nconn=settings.ftpnconn, datemap=None, temp_dir=None, journal=None,
+    validation=settings.dlvalidation, aimd=settings.dlaimd):
+    """ dl_soft_async
+
+        Download GSE soft files for a list of GSE IDs in one event loop.
+        Arguments and return value are as for dl.dl_soft.
+
+        Arguments:
+            * gse_list (list, required) : A list of valid GSE id(s).
+            * retries_connection (int) : Number of ftp connection retries
+                allowed.
+            * retries_files : Number of retry attempts allowed for soft file
+                downloads.
+            * interval_con (float) : Time (in seconds) to sleep before retrying
+                a connection.
+            * interval_file (float) : Time (in seconds) to sleep before retrying
+                a file connection.
+            * validate (Bool.): Validate new files against existing soft files?
+            * timestamp (str) : An NTP timestamp for versioning.
+            * nconn (int) : Max number of concurrent FTP sessions.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                dl.rmdb_dates(), or None to query RMDB for gse_list.
+            * temp_dir (str) : Temp directory for new downloads, kept after
+                validation, or None for a new temp directory.
+            * journal (str) : Task key in the download journal, or None to not
+                journal downloads.
+            * validation (str) : Validation policy, 'hash' or 'stat', as for
+                dl.dl_idat.
+            * aimd (Bool.) : Whether to adapt the number of concurrent
+                sessions, starting at nconn, with an AIMDController.
+
+        Returns:
+            * Dictionary showing records, dates, and exit statuses of ftp calls
+                OR error string over connection issues
+    """
+    if not timestamp:
+        timestamp = gettime_ntp()
+    gsesoftpath = settings.gsesoftpath
+    temppath = settings.temppath
+    os.makedirs(gsesoftpath, exist_ok=True)
+    temp_dir_make = temp_dir or tempfile.mkdtemp(dir=staging_dir(gsesoftpath, 
+        temppath))
+    if not gse_list[0].startswith('GSE'):
+        raise RuntimeError("GSE IDs must begin with \"GSE\".")
+    controller = AIMDController(start=nconn, maxconn=min(settings.dlmaxconn,
+        len(gse_list))) if aimd else None
+    pool = AsyncFTPPool(nconn=nconn, host=settings.ftphost,
+        port=settings.ftpport, retries_connection=retries_connection,
+        interval_con=interval_con, controller=controller, 
+        mirror=settings.geomirror)
+    try:
+        pool.put(await pool.get())
+    except ftplib.all_errors as e:
+        return str(e)
+    if datemap is None:
+        datemap = await asyncio.get_running_loop().run_in_executor(None,
+            partial(rmdb_dates, gse_list=gse_list))
+    start = time.time()
+    try:
+        gseresults = await asyncio.gather(*[dl_soft_gse_async(gse, pool,
+            datemap, temp_dir_make, timestamp, retries_files, interval_file,
+            journal, validation) for gse in gse_list])
+    finally:
+        await pool.close()
+    dldict = {}
+    files_written = []
+    for gse, (gsedl, gse_written) in zip(gse_list, gseresults):
+        dldict[gse] = gsedl
+        files_written.extend(gse_written)
+    log_throughput('soft', files_written, time.time() - start)
+    if validate:
+        validate_soft(dldict, files_written, gsesoftpath, journal)
+        if not temp_dir:
+            shutil.rmtree(temp_dir_make)
+    return dldict
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+""" dljournal.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Crash-safe journal of file downloads for GSE tasks, so a task interrupted
+    by a worker exit resumes where it stopped instead of starting over.
+
+    Notes:
+        * The journal is a SQLite db in WAL mode at 'settings.journaldbpath'.
+            Each task (e.g. a GSE ID) has a row in 'tasks' with its temp dir
+            and version timestamp, and one row in 'files' per file to fetch,
+            keyed on file ftp address.
+        * File states advance as 'transferring' (RETR started, temp file may
+            be partial), 'verified' (transfer complete, size checked, SHA-256
+            recorded), and 'committed' (validated, and stored or discarded as
+            duplicate). A file whose transfer retries ran out is 'pending'.
+        * A resumed task reuses its temp dir and timestamp, so partial temp
+            files resume with REST, verified temp files are adopted without a
+            transfer, and committed files are reported without touching the
+            network.
+        * A task's rows and temp dir are removed by journal_finish(), after
+            RMDB is updated.
+
+    Functions:
+        * journal_connect: Connect to the download journal.
+        * cached_connect: Get this thread's open connection to the download
+            journal.
+        * journal_begin: Start or resume a task, returning its temp dir and
+            timestamp.
+        * journal_get: Get the journal entry for a file of a task.
+        * journal_adopt: Get the journal entry for a file whose transfer can
+            be skipped.
+        * journal_set: Record the state of a file of a task.
+        * journal_record: Rebuild the download record of a journaled file.
+        * journal_finish: Mark a task complete and remove its temp dir.
+"""
+
+import os, sys, time, datetime, shutil, tempfile, sqlite3, threading
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+_local = threading.local()
+
+def journal_connect(dbpath=settings.journaldbpath):
+    """ journal_connect
+
+        Connect to the download journal, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the journal, in WAL
+                mode and autocommit.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS tasks (task TEXT PRIMARY KEY,"
+        +" tempdir TEXT, timestamp TEXT, state TEXT, updated REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS files (task TEXT, ftpaddress"
+        +" TEXT, id TEXT, temppath TEXT, filedate TEXT, sha256 TEXT,"
+        +" destpath TEXT, isnew INTEGER, state TEXT, updated REAL,"
+        +" PRIMARY KEY (task, ftpaddress))")
+    return conn
+
+def cached_connect(dbpath=settings.journaldbpath):
+    """ cached_connect
+
+        Get this thread's open connection to the download journal, connecting
+        on first use, and again in a forked process.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the journal, in WAL
+                mode and autocommit. Not to be closed by the caller.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        # connections are not to be used across a fork
+        _local.pid = os.getpid()
+        _local.conns = {}
+    # keyed on the absolute path, as dbpath is relative to the working dir
+    key = os.path.abspath(dbpath)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = _local.conns[key] = journal_connect(dbpath)
+    return conn
+
+def journal_begin(task, timestamp, temppath=settings.temppath,
+    dbpath=settings.journaldbpath):
+    """ journal_begin
+
+        Start a task, or resume it if an earlier run did not finish. A resumed
+        task keeps its temp dir and timestamp, so downloads written by the
+        earlier run are found under the same paths.
+
+        Arguments:
+            * task (str) : Task key, e.g. a GSE ID.
+            * timestamp (str) : NTP timestamp for versioning a new task.
+            * temppath (str) : Parent dir for the task temp dir.
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * tempdir (str) : Temp dir for the task downloads.
+            * timestamp (str) : Version timestamp for the task downloads.
+    """
+    conn = cached_connect(dbpath)
+    row = conn.execute("SELECT tempdir, timestamp FROM tasks WHERE task = ?"
+        +" AND state = 'running'", (task,)).fetchone()
+    if row and os.path.isdir(row[0]):
+        nfiles = conn.execute("SELECT COUNT(*) FROM files WHERE task = ?",
+            (task,)).fetchone()[0]
+        print('resuming task '+task+' with '+str(nfiles)
+            +' journaled files...')
+        return row[0], row[1]
+    os.makedirs(temppath, exist_ok=True)
+    tempdir = tempfile.mkdtemp(dir=temppath)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM files WHERE task = ?", (task,))
+        conn.execute("INSERT OR REPLACE INTO tasks (task, tempdir, timestamp,"
+            +" state, updated) VALUES (?, ?, ?, 'running', ?)", (task, tempdir,
+            str(timestamp), time.time()))
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return tempdir, str(timestamp)
+
+def journal_get(task, ftpaddress, dbpath=settings.journaldbpath):
+    """ journal_get
+
+        Get the journal entry for a file of a task.
+
+        Arguments:
+            * task (str) : Task key, e.g. a GSE ID.
+            * ftpaddress (str) : FTP address of the file.
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * entry (dict) : Journal columns for the file, or None if the file
+                is not journaled.
+    """
+    cursor = cached_connect(dbpath).cursor()
+    cursor.row_factory = sqlite3.Row
+    row = cursor.execute("SELECT * FROM files WHERE task = ? AND ftpaddress"
+        +" = ?", (task, ftpaddress)).fetchone()
+    return dict(row) if row else None
+
+def journal_adopt(task, ftpaddress, dbpath=settings.journaldbpath):
+    """ journal_adopt
+
+        Get the journal entry for a file that needs no transfer, because it
+        is committed or its verified temp file still exists.
+
+        Arguments:
+            * task (str) : Task key, e.g. a GSE ID.
+            * ftpaddress (str) : FTP address of the file.
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * entry (dict) : Journal columns for the file, or None if the file
+                must be transferred.
+    """
+    entry = journal_get(task, ftpaddress, dbpath)
+    if entry and (entry['state'] == 'committed' or (entry['state'] ==
+        'verified' and entry['temppath'] and os.path.exists(
+        entry['temppath']))):
+        return entry
+    return None
+
+def journal_set(task, ftpaddress, state, dbpath=settings.journaldbpath,
+    **values):
+    """ journal_set
+
+        Record the state of a file of a task, with any new column values.
+
+        Arguments:
+            * task (str) : Task key, e.g. a GSE ID.
+            * ftpaddress (str) : FTP address of the file.
+            * state (str) : One of 'pending', 'transferring', 'verified', or
+                'committed'.
+            * dbpath (str) : Path to the SQLite journal.
+            * values : Column values to set, among id, temppath, filedate,
+                sha256, destpath, and isnew.
+
+        Returns:
+            * None, updates the journal as side effect.
+    """
+    if isinstance(values.get('filedate'), datetime.datetime):
+        values['filedate'] = values['filedate'].isoformat()
+    columns = ['state', 'updated'] + list(values.keys())
+    params = [state, time.time()] + list(values.values())
+    conn = cached_connect(dbpath)
+    conn.execute("INSERT OR IGNORE INTO files (task, ftpaddress) VALUES"
+        +" (?, ?)", (task, ftpaddress))
+    conn.execute("UPDATE files SET "+', '.join(c+' = ?' for c in columns)
+        +" WHERE task = ? AND ftpaddress = ?", params + [task, ftpaddress])
+
+def journal_record(entry):
+    """ journal_record
+
+        Rebuild the download record of a verified or committed file, in
+        dldict format. The validation status of a committed file is
+        bool(entry['isnew']).
+
+        Arguments:
+            * entry (dict) : Journal entry, as from journal_get().
+
+        Returns:
+            * record (list) : Download record for the file.
+    """
+    filedate = entry['filedate']
+    try:
+        filedate = datetime.datetime.fromisoformat(filedate)
+    except (TypeError, ValueError):
+        pass
+    record = [entry['id'], entry['ftpaddress'], entry['temppath'],
+        '226 Transfer complete (journal)', filedate, 'new_date']
+    if entry['state'] == 'committed':
+        record[2] = entry['destpath'] or entry['temppath']
+    return record
+
+def journal_finish(task, dbpath=settings.journaldbpath):
+    """ journal_finish
+
+        Mark a task complete, remove its journaled files, and remove its temp
+        dir with any failed partial downloads.
+
+        Arguments:
+            * task (str) : Task key, e.g. a GSE ID.
+            * dbpath (str) : Path to the SQLite journal.
+
+        Returns:
+            * None, updates the journal as side effect.
+    """
+    conn = cached_connect(dbpath)
+    row = conn.execute("SELECT tempdir FROM tasks WHERE task = ?",
+        (task,)).fetchone()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM files WHERE task = ?", (task,))
+        conn.execute("UPDATE tasks SET state = 'complete', updated = ? WHERE"
+            +" task = ?", (time.time(), task))
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    if row and row[0] and os.path.isdir(row[0]):
+        shutil.rmtree(row[0])
@@ -15,10 +15,34 @@
         * Filters: The edirect queries (GSE, GSM, and filtered query file) work
             together to form a filter on valid sample and experiment ids whose 
             files are to be downloaded and preprocessed. 
+        * Queries: GSE and GSM docsums are fetched in-process from the NCBI
+            E-utilities (eutils.py), in concurrent pages from the history 
+            server, and written in the format of EDirect's 'xtract -element 
+            Id Accession'.
+        * Incremental queries: With 'settings.equeryincremental', a query
+            fetches only records dated ('settings.equerydatetype') since the
+            last stored query, and merges them into the latest query file.
+            A full query runs if the merged records do not match the query's
+            total count, or 'settings.equeryfullage' seconds after the last
+            full one. Query times are kept at 'settings.equerydbpath', and
+            recorded only for query files stored by validation, so queries
+            run with validate=False are always full.
+        * Rate limit: Each request waits on the host-wide 'eutils' bucket, at 
+            'settings.eutilsrate' requests/sec, shared with other workers.
     
     Functions:
+        * equery_diff: Get added and removed GSE IDs, and added and removed 
+            GSM IDs of each GSE ID, between two queries.
         * gse_query_diffs: Quickly detect and return differences between two 
             edirect query files.
+        * equery_connect: Connect to the db of edirect query times.
+        * get_query_state: Get the times of the last stored and full queries.
+        * set_query_state: Record the time of a stored query.
+        * get_queued_filt: Get the filter file of the last queued run.
+        * set_queued_filt: Record the filter file of a queued run.
+        * merge_docsums: Merge new and updated records into stored query lines.
+        * run_query: Write the results of an edirect query, incrementally 
+            where possible.
         * gsm_query: Get valid HM450k sample (GSM) IDs, based on presence of 
             HM450k platform and availability of raw idat array files in 
             supplement.
@@ -29,16 +53,46 @@
             samples from experiment GSM ID lists.
         * gsequery_filter: Generate a new edirect query filter file, containing
             valid GSE and GSM IDs for HM450k array experiments/samples with
-            idats available in sample supplemental files.
+            idats available in sample supplemental files, and its binary GSE
+            and GSM ID map file (querymap.py).
 """
 
-import subprocess, os, socket, struct, sys, time, tempfile, atexit, shutil
+import os, socket, struct, sys, time, tempfile, atexit, shutil, sqlite3
 import glob, filecmp; from itertools import chain
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 from utilities import gettime_ntp, querydict, getlatest_filepath
+from eutils import eutils_query, esearch, esummary_pages
+from querymap import write_querymap
 import settings
 settings.init()
 
+def equery_diff(qd1, qd2):
+    """ equery_diff
+
+        Compare two GSE query dictionaries, with set operations on their GSE 
+        IDs and on the GSM IDs of each shared GSE ID.
+
+        Arguments:
+            * qd1 (dict) : Earlier query, as from querydict() (keys = GSE IDs,
+                values = GSM ID lists).
+            * qd2 (dict) : Later query, as from querydict().
+
+        Returns:
+            * diff (dict) : Sorted lists of GSE IDs 'added' to and 'removed' 
+                from qd2, and 'changed', a dictionary of GSE IDs in both 
+                queries whose GSM IDs differ, with sorted lists of their 
+                'added' and 'removed' GSM IDs.
+    """
+    gse1, gse2 = set(qd1), set(qd2)
+    changed = {}
+    for gse in gse1 & gse2:
+        gsm1, gsm2 = set(qd1[gse]), set(qd2[gse])
+        if gsm1 != gsm2:
+            changed[gse] = {'added' : sorted(gsm2 - gsm1), 
+                'removed' : sorted(gsm1 - gsm2)}
+    return {'added' : sorted(gse2 - gse1), 'removed' : sorted(gse1 - gse2),
+        'changed' : changed}
+
 def gse_query_diffs(query1, query2, rstat=False):
     """ gse_query_diffs
         
@@ -54,68 +108,224 @@ def gse_query_diffs(query1, query2, rstat=False):
             * boolean (T/F) or query diffs (list of GSE IDs). Boolean is 'True' 
                 if query objects are the same, 'False' otherwise
     """
-    difflist = []
-    qd1 = querydict(query1) # eg. for first value: qd1[list(qd1.keys())[0]]
-    qd2 = querydict(query2)
-    # if gse doesn't exist in qd2
-    for key in qd1:
-        evalkey = ''
-        if key in list(qd2.keys()):
-            if not qd1[key]==qd2[key]:
-                for item in qd1[key]:
-                    if not item in qd2[key]:
-                        evalkey = False
-                for item in qd2[key]:
-                    if not item in qd1[key]:
-                        evalkey = False
-        else:
-            evalkey = None
-        if not evalkey:
-            difflist.append(key)
-    for key in qd2:
-        if not key in list(qd1.keys()):
-            difflist.append(key)
+    diff = equery_diff(querydict(query1), querydict(query2))
+    difflist = diff['added'] + diff['removed'] + sorted(diff['changed'])
     if rstat:
-        if len(difflist)>0:
-            return False
-        else:
-            return True
+        return len(difflist) == 0
     else:
         return difflist
 
-def gsm_query(validate=True, timestamp=gettime_ntp()):
+def equery_connect(dbpath=settings.equerydbpath):
+    """ equery_connect
+
+        Connect to the db of edirect query times, and of filter files whose
+        GSE IDs were queued, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite query times db.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the query times db.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS queries (querystr TEXT PRIMARY"
+        +" KEY, lastquery REAL, lastfull REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS queued (filtpath TEXT, queued"
+        +" REAL)")
+    return conn
+
+def get_query_state(querystr, dbpath=settings.equerydbpath):
+    """ get_query_state
+
+        Get the start times of the last stored query and the last full query
+        of a query file type.
+
+        Arguments:
+            * querystr (str) : Query file name prefix, e.g. 'gsm_edirectquery'.
+            * dbpath (str) : Path to the SQLite query times db.
+
+        Returns:
+            * state (tuple) : Last query and last full query times, in seconds
+                since the epoch, or None if no query was stored.
+    """
+    conn = equery_connect(dbpath)
+    try:
+        return conn.execute("SELECT lastquery, lastfull FROM queries WHERE"
+            +" querystr = ?", (querystr,)).fetchone()
+    finally:
+        conn.close()
+
+def set_query_state(querystr, started, full, dbpath=settings.equerydbpath):
+    """ set_query_state
+
+        Record the start time of a query whose results are now the latest 
+        stored query file.
+
+        Arguments:
+            * querystr (str) : Query file name prefix, e.g. 'gsm_edirectquery'.
+            * started (float) : Query start time, in seconds since the epoch.
+            * full (Bool.) : Whether the query fetched all records.
+            * dbpath (str) : Path to the SQLite query times db.
+
+        Returns:
+            * None, updates the query times db.
+    """
+    conn = equery_connect(dbpath)
+    try:
+        with conn:
+            lastfull = started if full else conn.execute("SELECT lastfull"
+                +" FROM queries WHERE querystr = ?", (querystr,)).fetchone()[0]
+            conn.execute("INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                (querystr, started, lastfull))
+    finally:
+        conn.close()
+
+def get_queued_filt(dbpath=settings.equerydbpath):
+    """ get_queued_filt
+
+        Get the filter file of the last run that queued GSE IDs.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite query times db.
+
+        Returns:
+            * filtpath (str) : Path of the filter file, or None.
+    """
+    conn = equery_connect(dbpath)
+    try:
+        row = conn.execute("SELECT filtpath FROM queued ORDER BY queued DESC"
+            +" LIMIT 1").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def set_queued_filt(filtpath, dbpath=settings.equerydbpath):
+    """ set_queued_filt
+
+        Record the filter file whose GSE IDs were queued, as the baseline for
+        changes in the next scheduled run.
+
+        Arguments:
+            * filtpath (str) : Path of the filter file.
+            * dbpath (str) : Path to the SQLite query times db.
+
+        Returns:
+            * None, updates the query times db.
+    """
+    conn = equery_connect(dbpath)
+    try:
+        with conn:
+            conn.execute("INSERT INTO queued VALUES (?, ?)", (filtpath,
+                time.time()))
+    finally:
+        conn.close()
+
+def merge_docsums(oldlines, newlines):
+    """ merge_docsums
+
+        Merge docsum lines of updated records into the lines of a stored query
+        file. Updated records replace their stored lines, and new records are
+        added first, as the newest results of a search.
+
+        Arguments:
+            * oldlines (list) : Stored query file lines.
+            * newlines (list) : Docsum lines of new and updated records.
+
+        Returns:
+            * merged (list) : Merged query file lines.
+    """
+    updates = {line.split('\t', 1)[0] : line for line in newlines}
+    olduids = set()
+    merged = []
+    for line in oldlines:
+        uid = line.split('\t', 1)[0]
+        olduids.add(uid)
+        merged.append(updates.get(uid, line))
+    added = [line for line in newlines if not line.split('\t', 1)[0] in
+        olduids]
+    return added + merged
+
+def run_query(querystr, term, destpath, 
+    incremental=settings.equeryincremental):
+    """ run_query
+
+        Write the results of an edirect query. With a recent full query 
+        stored, only records dated since the last stored query are fetched
+        and merged into the latest query file. The merged results are checked
+        against the total count of the query, and a full query is run if 
+        they differ (e.g. for removed records).
+
+        Arguments:
+            * querystr (str) : Query file name prefix, e.g. 'gsm_edirectquery'.
+            * term (str) : Entrez query.
+            * destpath (str) : Path of the query file to write.
+            * incremental (Bool.) : Whether to query only records dated since
+                the last stored query.
+
+        Returns:
+            * count (int) : Number of records written.
+            * started (float) : Query start time, to be recorded with 
+                set_query_state() once the file is stored.
+            * full (Bool.) : Whether all records were fetched.
+    """
+    started = time.time()
+    state = get_query_state(querystr, settings.equerydbpath)
+    latest = getlatest_filepath(filepath=settings.equerypath, 
+        filestr=querystr, embeddedpattern=True, tslocindex=1,
+        returntype='returnlist')
+    if (incremental and state and latest 
+        and started - state[1] < settings.equeryfullage):
+        # dates are days, in NCBI's time zone, so overlap by a day
+        mindate = time.strftime('%Y/%m/%d', time.gmtime(state[0] - 86400))
+        maxdate = time.strftime('%Y/%m/%d', time.gmtime(started + 86400))
+        newlines = list(chain.from_iterable(esummary_pages(term, 
+            baseurl=settings.eutilsurl, retmax=settings.eutilsretmax,
+            nconn=settings.eutilsnconn, mindate=mindate, maxdate=maxdate, 
+            datetype=settings.equerydatetype)))
+        oldlines = [line.rstrip('\n') for line in open(latest[0])]
+        merged = merge_docsums(oldlines, newlines)
+        count = esearch(term, baseurl=settings.eutilsurl)[0]
+        if len(merged) == count:
+            with open(destpath, 'w') as destfile:
+                for line in merged:
+                    destfile.write(line+'\n')
+            print("Merged "+str(len(newlines))+" records dated from "+mindate
+                +" into "+str(count)+" records for query "+term)
+            return count, started, False
+        print("Merged query has "+str(len(merged))+" of "+str(count)
+            +" records, running a full query...")
+    count = eutils_query(term, destpath, baseurl=settings.eutilsurl,
+        retmax=settings.eutilsretmax, nconn=settings.eutilsnconn)
+    return count, started, True
+
+def gsm_query(validate=True, timestamp=None):
     """ gsm_query
         Get GSM level query object, from edirect query.
         Arguments:
             * validate (True/False, bool.) : whether to validate the file after 
-                ownload.
-            * timestamp (str) : NTP timestamp or function to retrieve it.
+                ownload, and store it. Unvalidated files are left in a temp
+                dir, and their query time is not recorded, so the next query
+                runs in full.
+            * timestamp (str) : NTP timestamp, or None for the current one.
         Returns: 
             * Error (str) or download object (dictionary). 
     """
-    # timestamp = str(gettime_ntp())
+    if not timestamp:
+        timestamp = gettime_ntp()
     eqdestpath = settings.equerypath
     temppath = settings.temppath
     os.makedirs(eqdestpath, exist_ok=True)
     os.makedirs(temppath, exist_ok=True)
     temp_make = tempfile.mkdtemp(dir=temppath)
-    atexit.register(shutil.rmtree, temp_make)
+    atexit.register(shutil.rmtree, os.path.abspath(temp_make))
     dldict = {}
     dldict['gsmquery'] = []
     dlfilename = ".".join(['gsm_edirectquery',timestamp])
     dldict['gsmquery'].append(dlfilename)
-    subp_strlist1 = ["esearch","-db","gds","-query",
-    "'"+settings.platformid+"[ACCN] AND idat[suppFile] AND gsm[ETYP]'"
-    ]
-    subp_strlist2 = ["efetch","-format","docsum"]
-    subp_strlist3 = ["xtract","-pattern","DocumentSummary",
-        "-element","Id Accession",">",
-        os.path.join(temp_make,dlfilename)
-        ]
-    args = " | ".join([" ".join(subp_strlist1),
-        " ".join(subp_strlist2),
-        " ".join(subp_strlist3)])
-    output=subprocess.check_output(args, shell=True)
+    term = settings.platformid+"[ACCN] AND idat[suppFile] AND gsm[ETYP]"
+    output, started, full = run_query(settings.gsmquerystr, term,
+        os.path.join(temp_make, dlfilename), settings.equeryincremental)
     dldict['gsmquery'].append(output) 
     if validate:
         gsmquery_filewritten = os.path.join(temp_make,dlfilename)
@@ -145,43 +355,43 @@ def gsm_query(validate=True, timestamp=gettime_ntp()):
                 eqdestpath, os.path.basename(gsmquery_filewritten))
                 )
             dldict['gsmquery'].append(True)
+        set_query_state(settings.gsmquerystr, started, full,
+            settings.equerydbpath)
+    elif settings.equeryincremental:
+        print("Query file not stored without validation, the next query will"
+            +" run in full...")
     return dldict
 
-def gse_query(validate=True, timestamp=gettime_ntp()):
+def gse_query(validate=True, timestamp=None):
     """ gse_query
         
         Get GSE level query object from edirect query.
         
         Arguments:
             * validate (True/False, bool) : Whether to validate the file after 
-                download.
-            * timestamp (str) : NTP timestamp or function to retrieve it.
+                download, and store it. Unvalidated files are left in a temp
+                dir, and their query time is not recorded, so the next query
+                runs in full.
+            * timestamp (str) : NTP timestamp, or None for the current one.
         
         Returns: 
             * Error (str) or download object (dictionary).
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     eqdestpath = settings.equerypath
     os.makedirs(eqdestpath, exist_ok=True)
     temppath = settings.temppath
     os.makedirs(temppath, exist_ok=True)
     temp_make = tempfile.mkdtemp(dir=temppath)
-    atexit.register(shutil.rmtree, temp_make)
+    atexit.register(shutil.rmtree, os.path.abspath(temp_make))
     dldict = {}
     dldict['gsequery'] = []
     dlfilename = ".".join(['gse_edirectquery',timestamp])
     dldict['gsequery'].append(dlfilename)
-    subp_strlist1 = ["esearch","-db","gds","-query",
-    "'"+settings.platformid+"[ACCN] AND idat[suppFile] AND gse[ETYP]'"
-    ]
-    subp_strlist2 = ["efetch","-format","docsum"]
-    subp_strlist3 = ["xtract","-pattern","DocumentSummary",
-        "-element","Id Accession",">",
-        os.path.join(temp_make,dlfilename)
-        ]
-    args = " | ".join([" ".join(subp_strlist1),
-        " ".join(subp_strlist2),
-        " ".join(subp_strlist3)])
-    output=subprocess.check_output(args, shell=True)
+    term = settings.platformid+"[ACCN] AND idat[suppFile] AND gse[ETYP]"
+    output, started, full = run_query(settings.gsequerystr, term,
+        os.path.join(temp_make, dlfilename), settings.equeryincremental)
     dldict['gsequery'].append(output)
     if validate:
         gsequery_filewritten = os.path.join(temp_make,dlfilename)
@@ -214,9 +424,14 @@ def gse_query(validate=True, timestamp=gettime_ntp()):
                 eqdestpath, os.path.basename(gsequery_filewritten))
                 )
             dldict['gsequery'].append(True)
+        set_query_state(settings.gsequerystr, started, full,
+            settings.equerydbpath)
+    elif settings.equeryincremental:
+        print("Query file not stored without validation, the next query will"
+            +" run in full...")
     return dldict
 
-def gsequery_filter(splitdelim='\t', timestamp=gettime_ntp()):
+def gsequery_filter(splitdelim='\t', timestamp=None):
     """ gsequery_filter
         
         Prepare an edirect query file. Filter a GSE query file on its GSM 
@@ -224,12 +439,14 @@ def gsequery_filter(splitdelim='\t', timestamp=gettime_ntp()):
         
         Arguments:
             * splitdelim (str) : Delimiter to split ids in querydict() call.
-            * timestamp (str) : NTP timestamp or function to retrieve it.
+            * timestamp (str) : NTP timestamp, or None for the current one.
         
         Returns:
             * gsequeryfiltered (list): Filtered GSE query object (list), writes
                 filtered query file as side effect.
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     eqpath = settings.equerypath
     gsequerystr = settings.gsequerystr
     gsmquerystr = settings.gsmquerystr
@@ -243,8 +460,8 @@ def gsequery_filter(splitdelim='\t', timestamp=gettime_ntp()):
     else:
         print("Error detecting latest gsmquery file! Returning...")
         return
-    gsmlines = [line.rstrip('\n') for line in open(gsmqueryf_latestpath[0])]
-    gsmlist = [line.split('\t')[1::][0] for line in gsmlines] 
+    with open(gsmqueryf_latestpath[0]) as gsmqueryf:
+        gsmset = set(line.rstrip('\n').split('\t')[1] for line in gsmqueryf)
     # get GSE dictionary object
     gsequeryf_latestpath = getlatest_filepath(filepath=eqpath, filestr=gsequerystr,
             embeddedpattern=True, tslocindex=1, returntype='returnlist'
@@ -255,13 +472,14 @@ def gsequery_filter(splitdelim='\t', timestamp=gettime_ntp()):
         print("Error detecting latest gsequery file! Returning...")
         return
     gsed_obj = querydict(querypath=gsequeryf_latestpath[0], splitdelim='\t')
+    gsefiltd = {}
     gsefiltl = []
-    for gsekey in list(gsed_obj.keys()):
-        samplelist_original = gsed_obj[gsekey]
+    for gsekey, samplelist_original in gsed_obj.items():
         samplelist_filt = [sample for sample in samplelist_original
-            if sample in gsmlist
+            if sample in gsmset
         ]
-        if samplelist_filt and len(samplelist_filt)>0:
+        if samplelist_filt:
+            gsefiltd[gsekey] = samplelist_filt
             gsefiltl.append(' '.join([gsekey,' '.join(samplelist_filt)]))      
     print('writing filt file...')
     if eqpath:
@@ -269,6 +487,8 @@ def gsequery_filter(splitdelim='\t', timestamp=gettime_ntp()):
         with open(os.path.join(eqpath, filtfn), 'w') as filtfile:
             for item in gsefiltl:
                 filtfile.write("%s\n" % item)
+        write_querymap(gsefiltd, os.path.join(eqpath, 
+            ".".join([settings.gsemapstr, timestamp])))
     return gsefiltl
 
 if __name__ == "__main__":
@@ -279,4 +499,6 @@ if __name__ == "__main__":
     """
     print("Beginning EDirect query...")
     equery_dest = settings.equerypath; temppath = settings.temppath
-    gse_query(); gsm_query(); gsequery_filter()
\ No newline at end of file
+    timestamp = gettime_ntp()
+    gse_query(timestamp=timestamp); gsm_query(timestamp=timestamp)
+    gsequery_filter(timestamp=timestamp)
\ No newline at end of file
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+""" eutils.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Client for the NCBI E-utilities (esearch and esummary), used by
+    edirect_query.py to get GSE and GSM IDs from the GEO DataSets (gds) db
+    without the EDirect command line tools.
+
+    Notes:
+        * A query is one esearch with 'usehistory=y', storing its result set
+            on the NCBI history server, then esummary requests for pages of
+            'settings.eutilsretmax' docsums by WebEnv and query_key.
+        * Pages are requested concurrently, by up to 'settings.eutilsnconn'
+            threads, and each request waits on the host-wide 'eutils' bucket
+            (ratelimit.py) at 'settings.eutilsrate' requests/sec. NCBI allows
+            3 requests/sec, or 10 with an API key ('settings.eutilsapikey').
+        * Docsum XML is parsed as it streams in, and pages are written in
+            order, so the query file matches the output of 'esearch | efetch
+            -format docsum | xtract -pattern DocumentSummary -element Id
+            Accession': one line per docsum, with its uid and all of its
+            Accession values (e.g. the GSE, then its GSMs), tab-separated.
+        * Searches can be limited to records by date ('mindate', 'maxdate',
+            'datetype'), e.g. for incremental queries in edirect_query.py.
+        * Failed requests, and pages missing docsums, are retried with
+            backoff. The base URL is 'settings.eutilsurl', e.g. to query a
+            local stand-in (geostandin.start_eutils_standin).
+
+    Classes and Functions:
+        * EUtilsError: Error reply or failed request to E-utilities.
+        * eutils_request: Send an E-utilities request, with retries.
+        * esearch: Run a search, storing results on the history server.
+        * iter_docsums: Parse docsums from a streamed esummary reply.
+        * esummary_page: Get a page of docsum lines from the history server.
+        * esummary_pages: Get pages of docsum lines for all results of a 
+            search.
+        * eutils_query: Write docsum lines for all results of a search.
+"""
+
+import os, sys, time, socket, urllib.request, urllib.error
+import xml.etree.ElementTree as ET
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from ratelimit import acquire
+
+class EUtilsError(Exception):
+    """ EUtilsError
+
+        Error reply or failed request to E-utilities.
+    """
+    pass
+
+def eutils_request(tool, params, baseurl=settings.eutilsurl, retries=5,
+    interval=2, timeout=120):
+    """ eutils_request
+
+        Send a request to an E-utility, waiting on the host-wide 'eutils'
+        bucket, and retrying failed requests and error statuses (e.g. 429
+        or 5xx replies) with backoff.
+
+        Arguments:
+            * tool (str) : E-utility name, e.g. 'esearch'.
+            * params (dict) : Request parameters.
+            * baseurl (str) : E-utilities base URL.
+            * retries (int) : Number of attempts.
+            * interval (int) : Seconds to wait after the first failed attempt,
+                doubled after each later one.
+            * timeout (float) : Seconds to wait on any single read.
+
+        Returns:
+            * resp (http.client.HTTPResponse) : Open response, to be read and
+                closed by the caller.
+    """
+    params = dict(params, tool='recountmethylation')
+    if settings.eutilsapikey:
+        params['api_key'] = settings.eutilsapikey
+    url = baseurl.rstrip('/')+'/'+tool+'.fcgi'
+    data = urlencode(params).encode()
+    for attempt in range(retries):
+        acquire('eutils', 1, settings.eutilsrate)
+        try:
+            return urllib.request.urlopen(url, data=data, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            e.close()
+            if e.code < 500 and e.code != 429:
+                raise EUtilsError(tool+' failed: '+str(e))
+            err = e
+        except (urllib.error.URLError, socket.timeout, OSError) as e:
+            err = e
+        print(tool+" request failed, attempt "+str(attempt + 1)+": "
+            +str(err))
+        if attempt < retries - 1:
+            time.sleep(interval * 2 ** attempt)
+    raise EUtilsError(tool+' failed after '+str(retries)+' attempts: '
+        +str(err))
+
+def esearch(term, db='gds', baseurl=settings.eutilsurl, mindate=None,
+    maxdate=None, datetype='pdat', retmax=0):
+    """ esearch
+
+        Run a search, storing its result set on the history server.
+
+        Arguments:
+            * term (str) : Entrez query, e.g. 'GPL13534[ACCN] AND
+                idat[suppFile] AND gsm[ETYP]'.
+            * db (str) : Entrez db to search.
+            * baseurl (str) : E-utilities base URL.
+            * mindate (str) : Earliest record date, e.g. '2019/01/31', or None
+                for no date range.
+            * maxdate (str) : Latest record date, required with mindate.
+            * datetype (str) : Record date for the range, e.g. 'pdat' 
+                (published) or 'mdat' (modified).
+            * retmax (int) : Number of uids to return in the reply.
+
+        Returns:
+            * count (int) : Number of results.
+            * webenv (str) : History server WebEnv of the results.
+            * query_key (str) : History server query_key of the results.
+    """
+    params = {'db' : db, 'term' : term, 'usehistory' : 'y', 'retmax' : retmax}
+    if mindate:
+        params.update({'mindate' : mindate, 'maxdate' : maxdate,
+            'datetype' : datetype})
+    resp = eutils_request('esearch', params, baseurl)
+    with resp:
+        root = ET.parse(resp).getroot()
+    error = root.findtext('ERROR')
+    if error or root.find('Count') is None:
+        raise EUtilsError('esearch failed for '+term+': '+str(error))
+    return int(root.findtext('Count')), root.findtext('WebEnv'), \
+        root.findtext('QueryKey')
+
+def iter_docsums(stream):
+    """ iter_docsums
+
+        Parse docsums from an esummary reply as it is read, freeing each
+        one after it is parsed.
+
+        Arguments:
+            * stream (file) : esummary XML reply (version 2.0).
+
+        Returns:
+            * docsums (generator) : Lists of the uid and Accession values of
+                each docsum, in document order.
+    """
+    for event, elem in ET.iterparse(stream, events=('end',)):
+        if elem.tag == 'ERROR':
+            raise EUtilsError('esummary failed: '+str(elem.text))
+        if elem.tag != 'DocumentSummary':
+            continue
+        uid = elem.get('uid') or elem.findtext('Id')
+        yield [uid] + [acc.text for acc in elem.iter('Accession')
+            if acc.text]
+        elem.clear()
+
+def esummary_page(webenv, query_key, retstart, retmax, db='gds',
+    baseurl=settings.eutilsurl, retries=5, interval=2):
+    """ esummary_page
+
+        Get a page of docsums for a search on the history server, retrying
+        pages cut short (NCBI may return fewer docsums than requested).
+
+        Arguments:
+            * webenv (str) : History server WebEnv of the search.
+            * query_key (str) : History server query_key of the search.
+            * retstart (int) : Index of the first result in the page.
+            * retmax (int) : Number of results expected in the page.
+            * db (str) : Entrez db searched.
+            * baseurl (str) : E-utilities base URL.
+            * retries (int) : Number of attempts.
+            * interval (int) : Seconds to wait after the first failed attempt,
+                doubled after each later one.
+
+        Returns:
+            * lines (list) : Tab-separated uid and Accession values of each
+                docsum in the page.
+    """
+    params = {'db' : db, 'WebEnv' : webenv, 'query_key' : query_key,
+        'retstart' : retstart, 'retmax' : retmax, 'version' : '2.0'}
+    for attempt in range(retries):
+        resp = eutils_request('esummary', params, baseurl)
+        try:
+            with resp:
+                lines = ['\t'.join(docsum) for docsum in iter_docsums(resp)]
+        except (ET.ParseError, OSError) as e:
+            lines, err = None, e
+        if lines is not None and len(lines) >= retmax:
+            return lines
+        if lines is not None:
+            err = str(len(lines))+' of '+str(retmax)+' docsums returned'
+        print("esummary page at "+str(retstart)+" incomplete, attempt "
+            +str(attempt + 1)+": "+str(err))
+        if attempt < retries - 1:
+            time.sleep(interval * 2 ** attempt)
+    raise EUtilsError('esummary failed at '+str(retstart)+' after '
+        +str(retries)+' attempts: '+str(err))
+
+def esummary_pages(term, db='gds', baseurl=settings.eutilsurl,
+    retmax=settings.eutilsretmax, nconn=settings.eutilsnconn, mindate=None,
+    maxdate=None, datetype='pdat'):
+    """ esummary_pages
+
+        Search an Entrez db and get its docsums, fetching pages concurrently
+        from the history server.
+
+        Arguments:
+            * term (str) : Entrez query.
+            * db (str) : Entrez db to search.
+            * baseurl (str) : E-utilities base URL.
+            * retmax (int) : Docsums per esummary page.
+            * nconn (int) : Max concurrent esummary requests.
+            * mindate, maxdate, datetype (str) : Date range, as in esearch().
+
+        Returns:
+            * pages (generator) : Docsum lines of each page, as from 
+                esummary_page(), in the order of the search results.
+    """
+    count, webenv, query_key = esearch(term, db, baseurl, mindate, maxdate,
+        datetype)
+    with ThreadPoolExecutor(max_workers=max(1, nconn)) as executor:
+        pages = executor.map(lambda retstart: esummary_page(webenv,
+            query_key, retstart, min(retmax, count - retstart), db,
+            baseurl), range(0, count, retmax))
+        for lines in pages:
+            yield lines
+
+def eutils_query(term, destpath, db='gds', baseurl=settings.eutilsurl,
+    retmax=settings.eutilsretmax, nconn=settings.eutilsnconn):
+    """ eutils_query
+
+        Search an Entrez db and write a line for each docsum in the results.
+
+        Arguments:
+            * term (str) : Entrez query.
+            * destpath (str) : Path of the query file to write.
+            * db (str) : Entrez db to search.
+            * baseurl (str) : E-utilities base URL.
+            * retmax (int) : Docsums per esummary page.
+            * nconn (int) : Max concurrent esummary requests.
+
+        Returns:
+            * count (int) : Number of docsums written.
+    """
+    nwritten = 0
+    with open(destpath, 'w') as destfile:
+        for lines in esummary_pages(term, db, baseurl, retmax, nconn):
+            for line in lines:
+                destfile.write(line+'\n')
+            nwritten += len(lines)
+    print("Wrote "+str(nwritten)+" docsums for query "+term)
+    return nwritten
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+""" filehash.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    SHA-256 hashes for downloaded and extracted files, and an index of the
+    hash of the latest stored version of each file.
+
+    Notes:
+        * Hashes are computed from bytes as they are written, so validation
+            of a new file does not re-read it from disk.
+        * The index is a SQLite db at 'settings.hashdbpath', keyed on a file
+            key, e.g. 'idats/GSM1000_5000_R01C01_Grn.idat.gz' for all versions
+            'GSM1000.<timestamp>.GSM1000_5000_R01C01_Grn.idat.gz'.
+        * Latest files stored before the index existed are hashed once, on
+            first lookup, and recorded.
+        * The index also records, by file ftp address, the remote size and 
+            date of the last download and the size and mtime of the stored 
+            file. The 'stat' validation policy ('settings.dlvalidation') 
+            skips a download when all of these are unchanged.
+
+    Functions:
+        * hashing_writer: Wrap a file write function to update a hash object.
+        * file_sha256: Compute the SHA-256 hex digest of a file.
+        * hashdb_connect: Connect to the latest-version hash index.
+        * cached_connect: Get this thread's open connection to the hash index.
+        * get_latest_hash: Get the path and hash of the latest stored version
+            of a file.
+        * set_latest_hash: Record a newly stored latest version of a file.
+        * set_remote_stat: Record the remote size and date of a downloaded
+            file, with the stat of its stored version.
+        * stat_unchanged: Check a remote size and date, and the stored file,
+            against the last download.
+"""
+
+import os, sys, hashlib, sqlite3, threading
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+_local = threading.local()
+
+def hashing_writer(write, hashobj):
+    """ hashing_writer
+
+        Wrap a write function so each block also updates a hash object, e.g.
+        as the callback for ftplib.FTP.retrbinary.
+
+        Arguments:
+            * write (function) : Write function, e.g. output_stream.write.
+            * hashobj (hashlib hash) : Hash object to update.
+
+        Returns:
+            * callback (function) : Function writing and hashing one block.
+    """
+    def callback(block):
+        hashobj.update(block)
+        write(block)
+    return callback
+
+def file_sha256(filepath, hashobj=None, nbytes=None, blocksize=1048576):
+    """ file_sha256
+
+        Compute the SHA-256 hex digest of a file, or update a hash object with
+        the first nbytes of a file.
+
+        Arguments:
+            * filepath (str) : Path of file to hash.
+            * hashobj (hashlib hash) : Hash object to update, or None for a new
+                SHA-256 object.
+            * nbytes (int) : Number of leading bytes to hash, or None for all.
+            * blocksize (int) : Read size in bytes.
+
+        Returns:
+            * digest (str) : Hex digest of the hashed bytes.
+    """
+    hashobj = hashobj or hashlib.sha256()
+    remaining = nbytes
+    with open(filepath, 'rb') as f:
+        while remaining is None or remaining > 0:
+            block = f.read(blocksize if remaining is None else
+                min(blocksize, remaining))
+            if not block:
+                break
+            hashobj.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return hashobj.hexdigest()
+
+def hashdb_connect(dbpath=settings.hashdbpath):
+    """ hashdb_connect
+
+        Connect to the hash index of latest file versions, creating it if
+        needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite hash index.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the hash index.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS latest (filekey TEXT PRIMARY KEY,"
+        +" filepath TEXT, sha256 TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS remote (ftpaddress TEXT PRIMARY"
+        +" KEY, size INTEGER, modify TEXT, filepath TEXT, local_size INTEGER,"
+        +" local_mtime REAL)")
+    return conn
+
+def cached_connect(dbpath=settings.hashdbpath):
+    """ cached_connect
+
+        Get this thread's open connection to the hash index, connecting on
+        first use, and again in a forked process.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite hash index.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the hash index. Not to
+                be closed by the caller.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        # connections are not to be used across a fork
+        _local.pid = os.getpid()
+        _local.conns = {}
+    # keyed on the absolute path, as dbpath is relative to the working dir
+    key = os.path.abspath(dbpath)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = _local.conns[key] = hashdb_connect(dbpath)
+    return conn
+
+def get_latest_hash(conn, filekey, latest_filepath=None):
+    """ get_latest_hash
+
+        Get the path and hash of the latest stored version of a file. If the
+        index has no valid record and latest_filepath is provided, that file
+        is hashed and recorded.
+
+        Arguments:
+            * conn (sqlite3.Connection) : Connection to the hash index.
+            * filekey (str) : Key of the file, shared by all its versions.
+            * latest_filepath (str or function) : Path to the latest stored
+                version, or a function returning it, used when no valid record
+                exists.
+
+        Returns:
+            * filepath (str) : Path of the latest version, or None.
+            * sha256 (str) : Hex digest of the latest version, or None.
+    """
+    row = conn.execute("SELECT filepath, sha256 FROM latest WHERE filekey = ?",
+        (filekey,)).fetchone()
+    if row and os.path.exists(row[0]):
+        return row[0], row[1]
+    if callable(latest_filepath):
+        latest_filepath = latest_filepath()
+    if latest_filepath and os.path.exists(latest_filepath):
+        print('hashing stored file '+latest_filepath+'...')
+        sha256 = file_sha256(latest_filepath)
+        set_latest_hash(conn, filekey, latest_filepath, sha256)
+        return latest_filepath, sha256
+    return None, None
+
+def set_latest_hash(conn, filekey, filepath, sha256):
+    """ set_latest_hash
+
+        Record the path and hash of a newly stored latest version of a file.
+
+        Arguments:
+            * conn (sqlite3.Connection) : Connection to the hash index.
+            * filekey (str) : Key of the file, shared by all its versions.
+            * filepath (str) : Path of the stored file.
+            * sha256 (str) : Hex digest of the stored file.
+
+        Returns:
+            * None, updates the hash index as side effect.
+    """
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO latest (filekey, filepath, sha256)"
+            +" VALUES (?, ?, ?)", (filekey, filepath, sha256))
+
+def set_remote_stat(conn, ftpaddress, size, modify, filepath):
+    """ set_remote_stat
+
+        Record the remote size and date of a downloaded file, and the size and
+        mtime of its stored version.
+
+        Arguments:
+            * conn (sqlite3.Connection) : Connection to the hash index.
+            * ftpaddress (str) : FTP address of the file.
+            * size (int) : Remote file size in bytes.
+            * modify (datetime) : Remote modification date.
+            * filepath (str) : Path of the stored version of the file.
+
+        Returns:
+            * None, updates the hash index as side effect.
+    """
+    fstat = os.stat(filepath)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO remote (ftpaddress, size, modify,"
+            +" filepath, local_size, local_mtime) VALUES (?, ?, ?, ?, ?, ?)",
+            (ftpaddress, size, str(modify), filepath, fstat.st_size,
+            fstat.st_mtime))
+
+def stat_unchanged(conn, ftpaddress, size, modify):
+    """ stat_unchanged
+
+        Check whether a remote file is unchanged since its last download, by
+        its remote size and date, and whether its stored version is unchanged
+        since, by os.stat. Neither file is read.
+
+        Arguments:
+            * conn (sqlite3.Connection) : Connection to the hash index.
+            * ftpaddress (str) : FTP address of the file.
+            * size (int) : Current remote file size in bytes.
+            * modify (datetime) : Current remote modification date.
+
+        Returns:
+            * filepath (str) : Path of the unchanged stored version, or None if
+                the file should be downloaded.
+    """
+    row = conn.execute("SELECT size, modify, filepath, local_size, local_mtime"
+        +" FROM remote WHERE ftpaddress = ?", (ftpaddress,)).fetchone()
+    if not row or not row[0] == size or not row[1] == str(modify):
+        return None
+    try:
+        fstat = os.stat(row[2])
+    except OSError:
+        return None
+    if not (fstat.st_size == row[3] and fstat.st_mtime == row[4]):
+        return None
+    return row[2]
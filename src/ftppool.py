@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+""" ftppool.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Bounded pool of logged-in FTP sessions to GEO, for concurrent downloads.
+
+    Notes:
+        * Sessions are opened lazily, up to the pool size, and are reused
+            across samples. A session that fails at the connection level is
+            discarded and replaced on next checkout.
+        * Pool size is set by the 'nconn' argument, or by 'settings.ftpnconn'.
+        * Sessions are LimitedFTP objects, which draw on the host-wide limits
+            for open connections, commands/sec, and bytes/sec to GEO in
+            ratelimit.py. With a mirror URL (see 'settings.geomirror'), 
+            sessions are HTTP(S) or local mirror sessions from transport.py,
+            with the same interface.
+        * A pool given an AIMDController (aimd.py) checks out at most 
+            'controller.limit' sessions at once, and its sessions report bytes
+            received and transient error replies to the controller. Sessions
+            for prefetch listings ('nextra') are kept open beyond the limit.
+
+    Classes and Functions:
+        * LimitedFTP: ftplib.FTP session drawing on host-wide GEO rate limits.
+        * ftp_connect: Open and log in a new FTP session, with retries.
+        * FTPPool: Bounded pool of reusable FTP sessions.
+        * pool_map: Apply a function to a list of items concurrently, with one
+            worker per pool session.
+        * pipeline_map: Apply a function to a list of items concurrently, 
+            with a bounded look-ahead stage resolving upcoming items.
+"""
+
+import ftplib, os, sys, time, socket, threading, queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from ratelimit import acquire, rate_limited, try_lease, acquire_lease
+from ratelimit import release_lease
+from transport import is_remote, open_session
+
+class LimitedFTP(ftplib.FTP):
+    """ LimitedFTP
+
+        FTP session holding a host-wide connection lease, and waiting on the 
+        shared commands/sec and bytes/sec buckets for GEO. Bytes received and
+        transient error replies are reported to controller, if set. A transfer
+        can be aborted from another thread with abort_transfer(). Transfers 
+        with a blocksize over 64 KiB use retrblocks().
+    """
+    leaseid = None
+    controller = None
+    dataconn = None
+
+    def putcmd(self, line):
+        acquire('geocmds', 1, settings.geocmdrate)
+        super().putcmd(line)
+
+    def getresp(self):
+        try:
+            return super().getresp()
+        except ftplib.error_temp as e:
+            if self.controller:
+                self.controller.record_error(e)
+            raise
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        callback = rate_limited(callback, 'geobytes', settings.geobyterate)
+        if self.controller:
+            callback = counted(callback, self.controller)
+        if blocksize <= 65536:
+            return super().retrbinary(cmd, callback, blocksize, rest)
+        return self.retrblocks(cmd, callback, blocksize, rest)
+
+    def retrblocks(self, cmd, callback, blocksize, rest=None):
+        """ retrblocks
+
+            Retrieve a file in binary mode, as retrbinary, reading into a 
+            reused buffer with recv_into() until it holds blocksize bytes, 
+            so callback is called once per large block rather than once per
+            socket read. Blocks are memoryviews, valid until callback returns.
+        """
+        self.voidcmd('TYPE I')
+        buf = memoryview(bytearray(blocksize))
+        with self.transfercmd(cmd, rest) as conn:
+            nbuf = 0
+            while True:
+                nrecv = conn.recv_into(buf[nbuf:])
+                nbuf += nrecv
+                if nbuf and (nbuf == blocksize or not nrecv):
+                    callback(buf[:nbuf])
+                    nbuf = 0
+                if not nrecv:
+                    break
+        return self.voidresp()
+
+    def transfercmd(self, cmd, rest=None):
+        self.dataconn = super().transfercmd(cmd, rest)
+        return self.dataconn
+
+    def abort_transfer(self):
+        """ abort_transfer
+
+            Shut down the data and control connections, so a transfer blocked
+            in another thread fails at once. The session must then be closed.
+        """
+        for sock in (self.dataconn, self.sock):
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        super().close()
+        release_lease(self.leaseid)
+        self.leaseid = None
+
+def counted(callback, controller):
+    """ counted
+
+        Wrap a block callback to report bytes received to a controller.
+    """
+    def wrapper(block):
+        controller.record_bytes(len(block))
+        callback(block)
+    return wrapper
+
+def ftp_connect(host=settings.ftphost, port=settings.ftpport, 
+    retries_connection=3, interval_con=.1, leaseid=None, 
+    mirror=settings.geomirror):
+    """ ftp_connect
+
+        Open a new FTP session and log in anonymously, or else open a session
+        on a mirror endpoint (see transport.py).
+
+        Arguments:
+            * host (str) : FTP host address.
+            * port (int) : FTP control port.
+            * retries_connection (int) : Number of ftp connection retries
+                allowed.
+            * interval_con (float) : Time (in seconds) to sleep before retrying
+                a connection.
+            * leaseid (int) : A host-wide GEO connection lease already held,
+                or None to wait for one.
+            * mirror (str) : URL of a mirror endpoint, or '' for the FTP 
+                server at host.
+
+        Returns:
+            * ftp (LimitedFTP) : A logged-in FTP session, or a 
+                transport.MirrorSession for a mirror. Raises the last ftplib 
+                error if retries are exhausted.
+    """
+    retries_left_connection = retries_connection
+    if leaseid is None:
+        leaseid = acquire_lease('geoftp', settings.geomaxconn 
+            if is_remote(mirror) else 0)
+    while True:
+        print('trying ftp connection')
+        ftp = None
+        try:
+            if mirror:
+                ftp = open_session(mirror)
+            else:
+                ftp = LimitedFTP()
+                ftp.connect(host, port)
+                ftp.login()
+            ftp.leaseid = leaseid
+            print('connection successful, continuing...')
+            return ftp
+        except ftplib.all_errors as e:
+            if ftp:
+                ftp.close()
+            if retries_left_connection:
+                retries_left_connection -= 1
+                print('continuing with connection retries left = '
+                    +str(retries_left_connection))
+                time.sleep(interval_con)
+                continue
+            else:
+                print('connection retries exhausted, returning...')
+                release_lease(leaseid)
+                raise
+
+class FTPPool:
+    """ FTPPool
+
+        Bounded pool of logged-in FTP sessions. Sessions are checked out with
+        get() or the connection() context manager, and returned with put().
+
+        Arguments:
+            * nconn (int) : Maximum number of open sessions.
+            * host (str) : FTP host address.
+            * port (int) : FTP control port.
+            * retries_connection (int) : Connection retries per new session.
+            * interval_con (float) : Seconds between connection retries.
+            * controller (AIMDController) : Adaptive limit on sessions checked
+                out at once, or None. The pool size is then controller.maxconn
+                plus nextra.
+            * mirror (str) : URL of a mirror endpoint serving sessions in 
+                place of the FTP server at host, or '' (see transport.py).
+            * nextra (int) : Sessions kept open beyond the controller limit,
+                e.g. for prefetch listings (see pipeline_map), and included 
+                in nconn.
+    """
+    def __init__(self, nconn=settings.ftpnconn, host=settings.ftphost,
+        port=settings.ftpport, retries_connection=3, interval_con=.1,
+        controller=None, mirror=settings.geomirror, nextra=0):
+        self.controller = controller
+        self.mirror = mirror
+        self.nextra = max(0, int(nextra))
+        if controller:
+            nconn = controller.maxconn + self.nextra
+        self.nconn = max(1, int(nconn))
+        self.host = host
+        self.port = port
+        self.retries_connection = retries_connection
+        self.interval_con = interval_con
+        self.idle = queue.LifoQueue()
+        self.nopen = 0
+        self.lock = threading.Lock()
+
+    def connect(self, leaseid=None):
+        """ connect
+
+            Open a new logged-in session for this pool's host or mirror.
+        """
+        try:
+            ftp = ftp_connect(host=self.host, port=self.port,
+                retries_connection=self.retries_connection,
+                interval_con=self.interval_con, leaseid=leaseid, 
+                mirror=self.mirror)
+        except ftplib.error_temp as e:
+            if self.controller:
+                self.controller.record_error(e)
+            raise
+        ftp.controller = self.controller
+        return ftp
+
+    def get(self):
+        """ get
+
+            Check out a session, opening a new one if fewer than nconn are
+            open and a host-wide connection lease is free, or else blocking 
+            until one is returned. With a controller, first waits for an 
+            in-flight slot.
+        """
+        if not self.controller:
+            return self._get()
+        self.controller.acquire()
+        try:
+            return self._get()
+        except BaseException:
+            self.controller.release()
+            raise
+
+    def _get(self):
+        """ _get
+
+            Check out a session, as get(), without an in-flight slot.
+        """
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                opennew = self.nopen < self.nconn
+                if opennew:
+                    self.nopen += 1
+            if opennew:
+                leaseid = try_lease('geoftp', settings.geomaxconn 
+                    if is_remote(self.mirror) else 0)
+                if leaseid is not None:
+                    try:
+                        return self.connect(leaseid)
+                    except ftplib.all_errors:
+                        with self.lock:
+                            self.nopen -= 1
+                        raise
+                with self.lock:
+                    self.nopen -= 1
+            try:
+                return self.idle.get(timeout=.5)
+            except queue.Empty:
+                continue
+
+    def put(self, ftp, discard=False):
+        """ put
+
+            Return a session to the pool, or close it if discard is True, or
+            if more sessions are open than the controller limit plus nextra.
+        """
+        if self.controller:
+            self.controller.release()
+        with self.lock:
+            if self.controller and not discard:
+                discard = self.nopen > min(self.controller.limit 
+                    + self.nextra, self.nconn)
+            if discard:
+                self.nopen -= 1
+        if discard:
+            try:
+                ftp.close()
+            except ftplib.all_errors:
+                pass
+        else:
+            self.idle.put(ftp)
+
+    def reconnect(self, ftp):
+        """ reconnect
+
+            Replace a session that failed at the connection level.
+        """
+        try:
+            ftp.close()
+        except ftplib.all_errors:
+            pass
+        return self.connect()
+
+    @contextmanager
+    def connection(self):
+        """ connection
+
+            Context manager to check out a session. Sessions raising
+            connection-level errors (socket or EOF errors) are discarded.
+        """
+        ftp = self.get()
+        try:
+            yield ftp
+        except (OSError, EOFError):
+            self.put(ftp, discard=True)
+            raise
+        except BaseException:
+            self.put(ftp)
+            raise
+        else:
+            self.put(ftp)
+
+    def close(self):
+        """ close
+
+            Log out and close all idle sessions.
+        """
+        while True:
+            try:
+                ftp = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+            with self.lock:
+                self.nopen -= 1
+
+def pool_map(func, items, pool):
+    """ pool_map
+
+        Apply a function to each item concurrently, with one worker thread per
+        pool session.
+
+        Arguments:
+            * func (function) : Called as func(item, pool) for each item.
+            * items (list) : Items to process (e.g. GSM IDs).
+            * pool (FTPPool) : Pool of FTP sessions used by func.
+
+        Returns:
+            * results (list) : Return values of func, in the order of items.
+    """
+    with ThreadPoolExecutor(max_workers=pool.nconn) as executor:
+        futures = [executor.submit(func, item, pool) for item in items]
+        return [future.result() for future in futures]
+
+def pipeline_map(func, resolve, items, pool, depth=settings.dlprefetch,
+    nresolve=settings.prefetchconn):
+    """ pipeline_map
+
+        Apply a function to each item concurrently, as pool_map, with a look-
+        ahead stage. Resolver threads run resolve(item, pool) on upcoming
+        items (e.g. directory listings) while workers run func(item, value, 
+        pool) on resolved items (e.g. transfers). At most depth resolved 
+        items wait between the stages, so memory stays flat. Workers that
+        find no resolved item resolve the next one themselves.
+
+        Arguments:
+            * func (function) : Called as func(item, value, pool), with value
+                the return value of resolve, or the exception it raised.
+            * resolve (function) : Called as resolve(item, pool).
+            * items (list) : Items to process (e.g. GSM IDs).
+            * pool (FTPPool) : Pool of FTP sessions shared by both stages.
+                Workers take nresolve fewer sessions than the pool size, so
+                resolvers always find one.
+            * depth (int) : Max resolved items waiting for a worker.
+            * nresolve (int) : Number of resolver threads.
+
+        Returns:
+            * results (list) : Return values of func, in the order of items.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    ready = queue.Queue(maxsize=max(1, depth))
+    upcoming = iter(enumerate(items))
+    lock = threading.Lock()
+    errors = []
+    def produce():
+        while not errors:
+            with lock:
+                index, item = next(upcoming, (None, None))
+            if index is None:
+                return
+            try:
+                value = resolve(item, pool)
+            except Exception as e:
+                value = e
+            ready.put((index, item, value))
+    def consume():
+        while True:
+            try:
+                task = ready.get_nowait()
+            except queue.Empty:
+                # resolvers are behind, so resolve the next item here
+                with lock:
+                    index, item = next(upcoming, (None, None))
+                if index is None:
+                    task = ready.get()
+                else:
+                    try:
+                        task = (index, item, resolve(item, pool))
+                    except Exception as e:
+                        task = (index, item, e)
+            if task is None:
+                return
+            index, item, value = task
+            if errors:
+                continue
+            try:
+                results[index] = func(item, value, pool)
+            except BaseException as e:
+                # keep draining, so resolvers blocked on put() can finish
+                errors.append(e)
+    nresolve = max(1, nresolve)
+    nwork = max(1, pool.nconn - nresolve)
+    producers = [threading.Thread(target=produce, daemon=True)
+        for i in range(nresolve)]
+    with ThreadPoolExecutor(max_workers=nwork) as executor:
+        workers = [executor.submit(consume) for i in range(nwork)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        for worker in workers:
+            ready.put(None)
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+
+""" geostandin.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Local stand-in for the GEO FTP server, serving a synthetic tree of sample
+    supplementary idats and experiment soft files on localhost. Used to
+    benchmark and exercise the download functions in dl.py without network
+    access to GEO.
+
+    Notes:
+        * Tree layout follows GEO, e.g.
+            'geo/samples/GSM1000nnn/GSM1000001/suppl/<file>_Grn.idat.gz' and
+            'geo/series/GSE100nnn/GSE100001/soft/GSE100001_family.soft.gz'.
+        * Files are generated on request and are never written to disk. Each
+            file is a valid gzip stream, unique to its path.
+        * Latency (seconds added before each control reply), bandwidth (bytes
+            per second per data connection), failure rates (aborted
+            transfers and 421 replies), and the rate of slow (straggling)
+            transfers are configurable.
+        * Supported commands: USER, PASS, SYST, FEAT, OPTS, TYPE, PWD, CWD,
+            NOOP, EPSV, PASV, NLST, MLSD, MDTM, SIZE, REST, RETR, ABOR, QUIT.
+        * Command counts (round trips), bytes sent, and server cpu seconds 
+            are kept in 'server.stats'.
+        * The tree can also be served over HTTP (start_http_standin), or 
+            written to a dir (GEOTree.export), to exercise the HTTP(S) and 
+            local mirror transports in transport.py.
+        * GSE and GSM docsums for the tree are served by a stand-in of the
+            E-utilities (start_eutils_standin), to exercise eutils.py.
+
+    Classes and Functions:
+        * GEOTree: Synthetic GEO directory tree and file contents.
+        * FTPStandinHandler: Control connection handler for the stand-in.
+        * HTTPStandinHandler: HTTP request handler for the stand-in.
+        * EUtilsStandinHandler: E-utilities request handler for the stand-in.
+        * start_standin: Start a stand-in server in a background thread.
+        * start_http_standin: Start a stand-in HTTP server in a background
+            thread.
+        * start_eutils_standin: Start a stand-in E-utilities server in a
+            background thread.
+"""
+
+import os, sys, time, random, socket, socketserver, threading, gzip, zlib
+import datetime, argparse, calendar, email.utils, re, http.server
+from urllib.parse import urlsplit, unquote, parse_qs
+
+class GEOTree:
+    """ GEOTree
+
+        Synthetic GEO tree of nsamples GSM IDs and their parent GSE IDs.
+
+        Arguments:
+            * nsamples (int) : Number of GSM IDs to serve.
+            * gsmstart (int) : Number of the first GSM ID.
+            * gsestart (int) : Number of the first GSE ID.
+            * samples_per_gse (int) : Number of GSM IDs per GSE.
+            * idatsize (int) : Approximate uncompressed size of each idat.
+            * softsize (int) : Approximate uncompressed size of each soft file.
+            * mtime (datetime) : Modification time reported for all files.
+
+        Records can be marked as updated on a later date in 'updated', keyed
+        on GSE or GSM ID, e.g. to exercise incremental edirect queries.
+    """
+    def __init__(self, nsamples=1000, gsmstart=1000000, gsestart=100000,
+        samples_per_gse=20, idatsize=65536, softsize=262144,
+        mtime=datetime.datetime(2019, 1, 1, 12, 0, 0)):
+        self.nsamples = nsamples
+        self.gsmstart = gsmstart
+        self.gsestart = gsestart
+        self.samples_per_gse = samples_per_gse
+        self.mtime = mtime
+        self.overrides = {}
+        self.updated = {}
+        rng = random.Random(0)
+        self.idatbody = gzip.compress(bytes(rng.getrandbits(8) for i in
+            range(idatsize)), mtime=0)
+        self.softbody = gzip.compress((b'!Sample_title = sample\n' *
+            (softsize // 24 + 1))[:softsize], mtime=0)
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def gsmids(self):
+        """ gsmids
+
+            List all GSM IDs in the tree.
+        """
+        return ['GSM'+str(self.gsmstart + i) for i in range(self.nsamples)]
+
+    def gseids(self):
+        """ gseids
+
+            List all GSE IDs in the tree.
+        """
+        ngse = max(1, -(-self.nsamples // self.samples_per_gse))
+        return ['GSE'+str(self.gsestart + i) for i in range(ngse)]
+
+    def gse_gsmids(self, gse):
+        """ gse_gsmids
+
+            List the GSM IDs belonging to a GSE ID.
+        """
+        i = int(gse[3:]) - self.gsestart
+        first = i * self.samples_per_gse
+        return ['GSM'+str(self.gsmstart + j) for j in range(first,
+            min(first + self.samples_per_gse, self.nsamples))]
+
+    def listdir(self, path):
+        """ listdir
+
+            List file names in a directory, or None if it does not exist.
+        """
+        tokens = [t for t in path.strip('/').split('/') if t]
+        if len(tokens) == 5 and tokens[:2] == ['geo', 'samples']:
+            gsm = tokens[3]
+            try:
+                n = int(gsm[3:]) - self.gsmstart
+            except ValueError:
+                return None
+            if (not gsm.startswith('GSM') or not 0 <= n < self.nsamples
+                or tokens[2] != gsm[:-3]+'nnn' or tokens[4] != 'suppl'):
+                return None
+            barcode = str(5000000000 + n * 7919)[:10]
+            return ['_'.join([gsm, barcode, 'R01C01', chan])+'.idat.gz'
+                for chan in ['Grn', 'Red']]
+        if len(tokens) == 5 and tokens[:2] == ['geo', 'series']:
+            gse = tokens[3]
+            if (not gse in self.gseids() or tokens[2] != gse[:-3]+'nnn'
+                or tokens[4] != 'soft'):
+                return None
+            return [gse+'_family.soft.gz']
+        return None
+
+    def content(self, path):
+        """ content
+
+            Return the bytes of a file, or None if it does not exist. Content
+            is a two-member gzip stream whose first member names the file, so
+            every path has unique bytes.
+        """
+        path = path.strip('/')
+        if path in self.overrides:
+            return self.overrides[path]
+        names = self.listdir(os.path.dirname(path))
+        if not names or not os.path.basename(path) in names:
+            return None
+        with self.lock:
+            if not path in self.cache:
+                if len(self.cache) > 256:
+                    self.cache.clear()
+                body = self.softbody if path.endswith('.soft.gz') else \
+                    self.idatbody
+                self.cache[path] = gzip.compress(path.encode(), mtime=0) + body
+            return self.cache[path]
+
+    def uid(self, acc):
+        """ uid
+
+            Return the gds db uid of a GSE or GSM ID, e.g. 200100001 for
+            'GSE100001', as numbered by GEO.
+        """
+        return (200000000 if acc.startswith('GSE') else 300000000) + int(
+            acc[3:])
+
+    def recdate(self, acc):
+        """ recdate
+
+            Return the date a GSE or GSM record was last updated, from 
+            'updated' or else mtime.
+        """
+        return self.updated.get(acc, self.mtime)
+
+    def modtime(self, path):
+        """ modtime
+
+            Return the modification time of a file.
+        """
+        return self.mtime
+
+    def export(self, rootdir):
+        """ export
+
+            Write the tree to a dir, e.g. to serve as a local mirror (see 
+            transport.py), with file mtimes set to modtime() in UTC.
+
+            Returns:
+                * nbytes (dict) : Bytes written for 'idat' and 'soft' files.
+        """
+        nbytes = {'idat' : 0, 'soft' : 0}
+        dirs = [('idat', '/'.join(['geo', 'samples', gsm[:-3]+'nnn', gsm, 
+            'suppl'])) for gsm in self.gsmids()]
+        dirs += [('soft', '/'.join(['geo', 'series', gse[:-3]+'nnn', gse, 
+            'soft'])) for gse in self.gseids()]
+        for kind, dirpath in dirs:
+            os.makedirs(os.path.join(rootdir, dirpath), exist_ok=True)
+            for name in self.listdir(dirpath):
+                path = dirpath+'/'+name
+                filepath = os.path.join(rootdir, path)
+                data = self.content(path)
+                with open(filepath, 'wb') as f:
+                    f.write(data)
+                mtime = calendar.timegm(self.modtime(path).timetuple())
+                os.utime(filepath, (mtime, mtime))
+                nbytes[kind] += len(data)
+        return nbytes
+
+class FTPStandinHandler(socketserver.StreamRequestHandler):
+    """ FTPStandinHandler
+
+        Handles one FTP control connection to the stand-in server.
+    """
+    def reply(self, text):
+        # handler thread cpu time, so benchmarks can separate client cpu
+        cpu = time.thread_time()
+        with self.server.lock:
+            self.server.stats['cpu'] = (self.server.stats.get('cpu', 0) 
+                + cpu - self.cpu)
+        self.cpu = cpu
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write((text + '\r\n').encode('latin-1'))
+        self.wfile.flush()
+
+    def count(self, cmd=None, nbytes=0):
+        with self.server.lock:
+            stats = self.server.stats
+            if cmd:
+                stats['commands'] += 1
+                stats[cmd] = stats.get(cmd, 0) + 1
+            stats['bytes'] += nbytes
+
+    def opendata(self):
+        conn, addr = self.datasock.accept()
+        self.datasock.close()
+        self.datasock = None
+        return conn
+
+    def senddata(self, data, abortable=False):
+        conn = self.opendata()
+        server = self.server
+        abortat = None
+        bandwidth = server.bandwidth
+        if abortable and server.rng.random() < server.failrate:
+            abortat = server.rng.randrange(0, max(1, len(data)))
+        if abortable and server.rng.random() < server.slowrate:
+            bandwidth = server.slowbandwidth
+        sent = 0
+        blocksize = 65536 if not bandwidth else max(1024, min(65536,
+            bandwidth // 10))
+        tstart = time.time()
+        try:
+            while sent < len(data):
+                block = data[sent:sent + blocksize]
+                if abortat is not None and sent + len(block) > abortat:
+                    conn.sendall(block[:abortat - sent])
+                    sent = abortat
+                    break
+                conn.sendall(block)
+                sent += len(block)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.time() - tstart)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except OSError:
+            # client closed the data connection, e.g. an aborted transfer
+            return sent, False
+        finally:
+            conn.close()
+        return sent, abortat is None
+
+    def handle(self):
+        self.cpu = time.thread_time()
+        self.datasock = None
+        self.rest = 0
+        tree = self.server.tree
+        self.reply('220 GEO stand-in ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            line = line.decode('latin-1').rstrip('\r\n')
+            cmd, _, arg = line.partition(' ')
+            cmd = cmd.upper()
+            self.count(cmd)
+            if (self.server.rejectrate and cmd in ('NLST', 'MLSD', 'RETR',
+                'MDTM', 'SIZE') and self.server.rng.random() <
+                self.server.rejectrate):
+                self.reply('421 Too many connections, try again later')
+                continue
+            if cmd == 'USER':
+                self.reply('331 Anonymous login ok, send password')
+            elif cmd == 'PASS':
+                self.reply('230 Anonymous access granted')
+            elif cmd == 'SYST':
+                self.reply('215 UNIX Type: L8')
+            elif cmd == 'FEAT':
+                self.reply('211-Features:\r\n MDTM\r\n MLSD\r\n REST STREAM'
+                    '\r\n SIZE\r\n EPSV\r\n211 End')
+            elif cmd in ('TYPE', 'OPTS', 'NOOP'):
+                self.reply('200 OK')
+            elif cmd == 'PWD':
+                self.reply('257 "/" is the current directory')
+            elif cmd == 'CWD':
+                self.reply('250 OK')
+            elif cmd in ('EPSV', 'PASV'):
+                if self.datasock:
+                    self.datasock.close()
+                self.datasock = socket.socket(socket.AF_INET,
+                    socket.SOCK_STREAM)
+                self.datasock.bind(('127.0.0.1', 0))
+                self.datasock.listen(1)
+                port = self.datasock.getsockname()[1]
+                if cmd == 'EPSV':
+                    self.reply('229 Entering Extended Passive Mode (|||'
+                        +str(port)+'|)')
+                else:
+                    self.reply('227 Entering Passive Mode (127,0,0,1,'
+                        +str(port >> 8)+','+str(port & 255)+')')
+            elif cmd == 'REST':
+                self.rest = int(arg)
+                self.reply('350 Restarting at '+arg)
+            elif cmd == 'MLSD' and not self.server.mlsd:
+                self.reply('502 Command not implemented')
+            elif cmd in ('NLST', 'MLSD'):
+                names = tree.listdir(arg)
+                if names is None or not self.datasock:
+                    self.reply('550 No such file or directory')
+                    continue
+                if cmd == 'NLST':
+                    prefix = arg.rstrip('/').lstrip('/')
+                    listing = '\r\n'.join(prefix+'/'+name for name in names)
+                else:
+                    listing = '\r\n'.join('type=file;size='+str(len(
+                        tree.content(arg.rstrip('/')+'/'+name)))+';modify='
+                        +tree.modtime(name).strftime('%Y%m%d%H%M%S')+'; '
+                        +name for name in names)
+                self.reply('150 Here comes the directory listing')
+                sent, complete = self.senddata((listing + '\r\n').encode(
+                    'latin-1'))
+                self.count(nbytes=sent)
+                self.reply('226 Directory send OK')
+            elif cmd in ('MDTM', 'SIZE'):
+                data = tree.content(arg)
+                if data is None:
+                    self.reply('550 No such file')
+                elif cmd == 'MDTM':
+                    self.reply('213 '+tree.modtime(arg).strftime(
+                        '%Y%m%d%H%M%S'))
+                else:
+                    self.reply('213 '+str(len(data)))
+            elif cmd == 'RETR':
+                data = tree.content(arg)
+                if data is None or not self.datasock:
+                    self.reply('550 No such file')
+                    continue
+                data = data[self.rest:]
+                self.rest = 0
+                self.reply('150 Opening BINARY mode data connection')
+                sent, complete = self.senddata(data, abortable=True)
+                self.count(nbytes=sent)
+                if complete:
+                    self.reply('226 Transfer complete')
+                else:
+                    self.reply('426 Connection closed; transfer aborted')
+            elif cmd == 'ABOR':
+                # transfers end before the next command is read
+                self.reply('225 No transfer to abort')
+            elif cmd == 'QUIT':
+                self.reply('221 Goodbye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+        if self.datasock:
+            self.datasock.close()
+
+class FTPStandinServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class HTTPStandinHandler(http.server.BaseHTTPRequestHandler):
+    """ HTTPStandinHandler
+
+        Serves the stand-in tree over HTTP/1.1 with keep-alive: HTML indexes
+        for dirs, and files with HEAD and 'bytes=N-' Range requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve(False)
+
+    def do_GET(self):
+        self.serve(True)
+
+    def serve(self, body):
+        cpu = time.thread_time()
+        server = self.server
+        tree = server.tree
+        if server.latency:
+            time.sleep(server.latency)
+        path = unquote(urlsplit(self.path).path)
+        headers = {}
+        status = 200
+        if path.endswith('/'):
+            names = tree.listdir(path)
+            data = None if names is None else ('<html><body>\n'
+                +'<a href="../">Parent Directory</a>\n'+''.join('<a href="'
+                +name+'">'+name+'</a>\n' for name in names)
+                +'</body></html>\n').encode()
+            headers['Content-Type'] = 'text/html'
+        else:
+            data = tree.content(path)
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['Last-Modified'] = email.utils.formatdate(calendar.timegm(
+                tree.modtime(path).timetuple()), usegmt=True)
+            rng = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if data is not None and rng and int(rng.group(1)) < len(data):
+                start = int(rng.group(1))
+                headers['Content-Range'] = ('bytes '+str(start)+'-'
+                    +str(len(data) - 1)+'/'+str(len(data)))
+                data = data[start:]
+                status = 206
+        if data is None:
+            status, data, headers = 404, b'Not found\n', {}
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+        with server.lock:
+            server.stats['commands'] += 1
+            server.stats['bytes'] += len(data) if body else 0
+            server.stats['cpu'] = (server.stats.get('cpu', 0) 
+                + time.thread_time() - cpu)
+
+class HTTPStandinServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class EUtilsStandinHandler(http.server.BaseHTTPRequestHandler):
+    """ EUtilsStandinHandler
+
+        Serves esearch and esummary (version 2.0 docsums) from the stand-in
+        tree, for GSE or GSM records by the '[ETYP]' term of the query.
+        Searches are kept by WebEnv for later esummary pages. Ids are sorted
+        by descending uid, as returned by GEO. A 'mindate' and 'maxdate' 
+        limit the search to records by GEOTree.recdate(), for any 'datetype'.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.serve(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.serve(parse_qs(self.rfile.read(length).decode()))
+
+    def serve(self, params):
+        server = self.server
+        tree = server.tree
+        if server.latency:
+            time.sleep(server.latency)
+        params = {key : value[0] for key, value in params.items()}
+        tool = os.path.basename(urlsplit(self.path).path)
+        with server.lock:
+            server.stats['commands'] += 1
+            fail = server.rng.random() < server.failrate
+        if fail:
+            self.reply(503, b'Service unavailable\n')
+        elif tool == 'esearch.fcgi':
+            term = params.get('term', '').lower()
+            ids = tree.gseids() if 'gse[etyp]' in term else (tree.gsmids()
+                if 'gsm[etyp]' in term else [])
+            if params.get('mindate'):
+                mindate, maxdate = [datetime.datetime.strptime(params[key],
+                    '%Y/%m/%d').date() for key in ('mindate', 'maxdate')]
+                ids = [acc for acc in ids if mindate <= tree.recdate(
+                    acc).date() <= maxdate]
+            ids = sorted(ids, key=lambda x: -int(x[3:]))
+            with server.lock:
+                webenv = 'MCID_'+str(len(server.searches) + 1)
+                server.searches[webenv] = ids
+            self.reply(200, ('<?xml version="1.0" ?>\n<eSearchResult>'
+                +'<Count>'+str(len(ids))+'</Count><RetMax>0</RetMax>'
+                +'<RetStart>0</RetStart><QueryKey>1</QueryKey><WebEnv>'
+                +webenv+'</WebEnv><IdList></IdList></eSearchResult>\n'
+                ).encode())
+        elif tool == 'esummary.fcgi':
+            ids = server.searches.get(params.get('WebEnv'))
+            if ids is None:
+                self.reply(200, b'<?xml version="1.0" ?>\n<eSummaryResult>'
+                    +b'<ERROR>Unable to get WebEnv</ERROR></eSummaryResult>\n')
+                return
+            retstart = int(params.get('retstart', 0))
+            retmax = int(params.get('retmax', 20))
+            docsums = []
+            for acc in ids[retstart:retstart + retmax]:
+                uid = tree.uid(acc)
+                samples = ''.join('<Sample><Accession>'+gsm+'</Accession>'
+                    +'<Title>'+gsm+'</Title></Sample>' for gsm in 
+                    (tree.gse_gsmids(acc) if acc.startswith('GSE') else []))
+                docsums.append('<DocumentSummary uid="'+str(uid)+'">'
+                    +'<Accession>'+acc+'</Accession><GPL>13534</GPL>'
+                    +'<entryType>'+acc[:3]+'</entryType><Samples>'+samples
+                    +'</Samples></DocumentSummary>')
+            self.reply(200, ('<?xml version="1.0" ?>\n<eSummaryResult>'
+                +'<DocumentSummarySet status="OK">'+'\n'.join(docsums)
+                +'</DocumentSummarySet></eSummaryResult>\n').encode())
+        else:
+            self.reply(404, b'Not found\n')
+
+    def reply(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.stats['bytes'] += len(data)
+
+def start_standin(tree=None, host='127.0.0.1', port=0, latency=0,
+    bandwidth=0, failrate=0, rejectrate=0, mlsd=True, seed=0, slowrate=0,
+    slowbandwidth=16384):
+    """ start_standin
+
+        Start a stand-in GEO FTP server in a background thread.
+
+        Arguments:
+            * tree (GEOTree) : Synthetic tree to serve (default GEOTree()).
+            * host (str) : Address to bind.
+            * port (int) : Port to bind, or 0 for any free port.
+            * latency (float) : Seconds added before each control reply.
+            * bandwidth (int) : Max bytes per second per data connection, or 0
+                for no limit.
+            * failrate (float) : Probability that a RETR is aborted mid-file.
+            * rejectrate (float) : Probability that a listing, date, size, or
+                RETR command is refused with a 421 reply.
+            * mlsd (Bool.) : Whether to support MLSD listings.
+            * seed (int) : Seed for failure injection.
+            * slowrate (float) : Probability that a RETR is served at
+                slowbandwidth, e.g. to exercise hedged transfers.
+            * slowbandwidth (int) : Bytes per second for slow RETRs.
+
+        Returns:
+            * server (FTPStandinServer) : Running server. Its address is
+                'server.server_address', and 'server.shutdown()' stops it.
+    """
+    server = FTPStandinServer((host, port), FTPStandinHandler)
+    server.tree = tree or GEOTree()
+    server.latency = latency
+    server.bandwidth = bandwidth
+    server.failrate = failrate
+    server.rejectrate = rejectrate
+    server.slowrate = slowrate
+    server.slowbandwidth = slowbandwidth
+    server.mlsd = mlsd
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.stats = {'commands': 0, 'bytes': 0}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def start_http_standin(tree=None, host='127.0.0.1', port=0, latency=0):
+    """ start_http_standin
+
+        Start a stand-in GEO HTTP server in a background thread, e.g. to 
+        exercise transport.HTTPSession with 'settings.geomirror' set to 
+        'http://127.0.0.1:<port>'.
+
+        Arguments:
+            * tree (GEOTree) : Synthetic tree to serve (default GEOTree()).
+            * host (str) : Address to bind.
+            * port (int) : Port to bind, or 0 for any free port.
+            * latency (float) : Seconds added before each response.
+
+        Returns:
+            * server (HTTPStandinServer) : Running server, as from 
+                start_standin().
+    """
+    server = HTTPStandinServer((host, port), HTTPStandinHandler)
+    server.tree = tree or GEOTree()
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.stats = {'commands': 0, 'bytes': 0}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def start_eutils_standin(tree=None, host='127.0.0.1', port=0, latency=0,
+    failrate=0, seed=0):
+    """ start_eutils_standin
+
+        Start a stand-in E-utilities server in a background thread, e.g. to 
+        exercise eutils.py with 'settings.eutilsurl' set to 
+        'http://127.0.0.1:<port>'.
+
+        Arguments:
+            * tree (GEOTree) : Synthetic tree to serve (default GEOTree()).
+            * host (str) : Address to bind.
+            * port (int) : Port to bind, or 0 for any free port.
+            * latency (float) : Seconds added before each response.
+            * failrate (float) : Probability that a request gets a 503 reply.
+            * seed (int) : Seed for failure injection.
+
+        Returns:
+            * server (HTTPStandinServer) : Running server, as from 
+                start_standin().
+    """
+    server = HTTPStandinServer((host, port), EUtilsStandinHandler)
+    server.tree = tree or GEOTree()
+    server.latency = latency
+    server.failrate = failrate
+    server.rng = random.Random(seed)
+    server.searches = {}
+    server.lock = threading.Lock()
+    server.stats = {'commands': 0, 'bytes': 0}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    """ Run a stand-in GEO FTP server in the foreground.
+    """
+    parser = argparse.ArgumentParser(description='Local GEO FTP stand-in')
+    parser.add_argument("--port", type=int, default=2121)
+    parser.add_argument("--nsamples", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--failrate", type=float, default=0)
+    args = parser.parse_args()
+    server = start_standin(tree=GEOTree(nsamples=args.nsamples),
+        port=args.port, latency=args.latency, bandwidth=args.bandwidth,
+        failrate=args.failrate)
+    print("Serving GEO stand-in at ftp://127.0.0.1:"+str(args.port)+"...")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -17,27 +17,36 @@
             and GSE ID, for access from backend db.
 """
 
-import celery, os, sys; from celery import Celery
+import celery, os, sys, asyncio; from celery import Celery
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 from utilities import gettime_ntp, get_queryfilt_dict
-from dl import soft_mongo_date, idat_mongo_date, dl_idat, dl_soft
+from dl import rmdb_dates, dl_idat, dl_soft
+from dl_async import dl_idat_async, dl_soft_async
 from update_rmdb import update_rmdb
+from dljournal import journal_begin, journal_finish
+from staging import staging_dir
 import settings; settings.init()
 
 app = Celery(); app.config_from_object('celeryconfig')
 
 @app.task
 def gse_task(gse_id, gsefiltdict = get_queryfilt_dict(), 
-    timestamp = gettime_ntp()):
+    timestamp = None):
     """ gse_task
 
-        GSE based task for celery job queue.
+        GSE based task for celery job queue. Downloads are journaled, so a 
+        task interrupted by a worker exit resumes where it stopped. GSM IDs 
+        shared with other GSE tasks of the same run are downloaded once, by
+        the first task to claim them.
         
         Arguments
             * gse_id : A single valid GSE id (str).
             * gsefiltdict : GSE filtered query object, as dictionary read
-                using querydict() (dict).
-            * timestamp : NTP timestamp for versioning file downloads (str).
+                using querydict(), with at least gse_id (dict). Callers pass
+                a dict rather than the IdMap of get_queryfilt_dict(), so the
+                argument serializes as a task argument.
+            * timestamp : NTP timestamp for versioning file downloads, or 
+                None for the current one (str).
             
         Returns
             * rl, a list of download dictionaries and rmdb update statuses.
@@ -54,14 +63,34 @@ def gse_task(gse_id, gsefiltdict = get_queryfilt_dict(),
         print('Detected N = '+str(len(gsmlist))+' GSM IDs...')
         if len(gsmlist) > 0:
             rl.append(True)
+            print('Getting stored file dates from rmdb...')
+            datemap = rmdb_dates(gsm_list=gsmlist, gse_list=[gse_id])
+            # GSM IDs shared with other GSE tasks of this run are claimed
+            claim = str(run_timestamp) if settings.dlclaim else None
+            tempdir, run_timestamp = journal_begin(gse_id, run_timestamp, 
+                staging_dir(settings.idatspath))
             print("Beginning soft file download...")
-            ddsoft = dl_soft(gse_list=[gse_id], timestamp=run_timestamp)
+            if settings.dlengine == 'asyncio':
+                ddsoft = asyncio.run(dl_soft_async(gse_list=[gse_id], 
+                    timestamp=run_timestamp, datemap=datemap, 
+                    temp_dir=tempdir, journal=gse_id))
+            else:
+                ddsoft = dl_soft(gse_list=[gse_id], timestamp=run_timestamp,
+                    datemap=datemap, temp_dir=tempdir, journal=gse_id)
             rl.append(True)
             print('Beginning idat download...')
-            ddidat = dl_idat(input_list=gsmlist, timestamp=run_timestamp)
+            if settings.dlengine == 'asyncio':
+                ddidat = asyncio.run(dl_idat_async(input_list=gsmlist, 
+                    timestamp=run_timestamp, datemap=datemap, 
+                    temp_dir=tempdir, journal=gse_id, claim=claim))
+            else:
+                ddidat = dl_idat(input_list=gsmlist, timestamp=run_timestamp,
+                    datemap=datemap, temp_dir=tempdir, journal=gse_id, 
+                    claim=claim)
             rl.append(True)
             print('updating rmdb...')
             updateobj = update_rmdb(ddidat=ddidat, ddsoft=ddsoft)
+            journal_finish(gse_id)
             rl.append(True)
         else:
             print('No valid GSM IDs detected for study GSE ID ', gse_id, 
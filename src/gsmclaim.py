@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+""" gsmclaim.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Host-wide registry of GSM IDs claimed by GSE tasks, so a GSM shared by
+    several GSE IDs is listed and downloaded once per run.
+
+    Notes:
+        * The registry is a SQLite db at 'settings.claimdbpath', with one row
+            per run key (e.g. the server run timestamp) and GSM ID, giving the
+            claiming task and process, its state ('running' or 'done'), and
+            the result of a done GSM.
+        * A task processes the GSM IDs it claims, then waits on GSM IDs
+            claimed by other tasks and reuses their results. Claims held by
+            processes that have exited are taken over.
+        * The result of a GSM is the ftp address, date, and status (True if
+            the file is stored, or unchanged) of each of its files. Tasks
+            reusing a result do not update RMDB for it, as the claiming task
+            does.
+        * Rows older than 'settings.claimttl' seconds are removed.
+
+    Functions:
+        * claim_connect: Connect to the claim registry.
+        * claim_gsms: Claim GSM IDs for a task, returning those claimed.
+        * finish_gsms: Mark claimed GSM IDs done, with their results.
+        * release_gsms: Drop claims of a task on unfinished GSM IDs.
+        * poll_gsms: Get results of GSM IDs claimed by other tasks, taking
+            over claims of exited processes.
+        * gsm_result: Get the result of a GSM ID from its download records.
+        * reused_records: Get download records for a reused GSM result.
+"""
+
+import os, sys, time, datetime, json, sqlite3
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from ratelimit import pid_alive
+
+def claim_connect(dbpath=settings.claimdbpath):
+    """ claim_connect
+
+        Connect to the claim registry, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite claim registry.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the registry, in WAL
+                mode and autocommit.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS claims (run TEXT, gsm TEXT,"
+        +" task TEXT, pid INTEGER, state TEXT, result TEXT, updated REAL,"
+        +" PRIMARY KEY (run, gsm))")
+    return conn
+
+def claim_gsms(gsm_list, run, task, dbpath=settings.claimdbpath):
+    """ claim_gsms
+
+        Claim GSM IDs for a task. GSM IDs already claimed by the task, e.g.
+        before a worker restart, are claimed again, even if done.
+
+        Arguments:
+            * gsm_list (list) : GSM IDs to claim.
+            * run (str) : Run key, e.g. the server run timestamp.
+            * task (str) : Task key, e.g. a GSE ID.
+            * dbpath (str) : Path to the SQLite claim registry.
+
+        Returns:
+            * claimed (list) : GSM IDs claimed by the task, in gsm_list order.
+            * held (list) : GSM IDs claimed by other tasks.
+    """
+    conn = claim_connect(dbpath)
+    now = time.time()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM claims WHERE updated < ?",
+            (now - settings.claimttl,))
+        conn.executemany("INSERT OR IGNORE INTO claims (run, gsm, task, pid,"
+            +" state, updated) VALUES (?, ?, ?, ?, 'running', ?)", [(run, gsm,
+            task, os.getpid(), now) for gsm in set(gsm_list)])
+        # rows of this task are claimed again, done or not, so a resumed
+        # task reports its files from the download journal
+        owners = dict(conn.execute("SELECT gsm, task FROM claims WHERE run = ?"
+            +" AND task = ?", (run, task)).fetchall())
+        conn.execute("UPDATE claims SET pid = ?, state = 'running' WHERE run"
+            +" = ? AND task = ?", (os.getpid(), run, task))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    claimed = [gsm for gsm in gsm_list if gsm in owners]
+    held = [gsm for gsm in gsm_list if not gsm in owners]
+    print('claimed '+str(len(claimed))+' GSM IDs for task '+task+', '
+        +str(len(held))+' held by other tasks or done')
+    return claimed, held
+
+def finish_gsms(run, task, results, dbpath=settings.claimdbpath):
+    """ finish_gsms
+
+        Mark GSM IDs claimed by a task done, with their results.
+
+        Arguments:
+            * run (str) : Run key.
+            * task (str) : Task key.
+            * results (dict) : Results keyed on GSM ID, as from gsm_result().
+            * dbpath (str) : Path to the SQLite claim registry.
+
+        Returns:
+            * None, updates the registry as side effect.
+    """
+    conn = claim_connect(dbpath)
+    try:
+        conn.executemany("UPDATE claims SET state = 'done', result = ?,"
+            +" updated = ? WHERE run = ? AND gsm = ? AND task = ?",
+            [(json.dumps(result), time.time(), run, gsm, task)
+            for gsm, result in results.items()])
+    finally:
+        conn.close()
+
+def release_gsms(run, task, gsm_list, dbpath=settings.claimdbpath):
+    """ release_gsms
+
+        Drop the claims of a task on GSM IDs it did not finish, e.g. after an
+        error, so other tasks can claim them.
+
+        Arguments:
+            * run (str) : Run key.
+            * task (str) : Task key.
+            * gsm_list (list) : GSM IDs to release.
+            * dbpath (str) : Path to the SQLite claim registry.
+
+        Returns:
+            * None, updates the registry as side effect.
+    """
+    conn = claim_connect(dbpath)
+    try:
+        conn.executemany("DELETE FROM claims WHERE run = ? AND gsm = ? AND"
+            +" task = ? AND state = 'running'", [(run, gsm, task)
+            for gsm in gsm_list])
+    finally:
+        conn.close()
+
+def poll_gsms(gsm_list, run, task, dbpath=settings.claimdbpath):
+    """ poll_gsms
+
+        Check GSM IDs claimed by other tasks. Done GSM IDs return their
+        results. GSM IDs whose claim was released, or whose claiming process
+        has exited, are claimed for task.
+
+        Arguments:
+            * gsm_list (list) : GSM IDs held by other tasks.
+            * run (str) : Run key.
+            * task (str) : Task key.
+            * dbpath (str) : Path to the SQLite claim registry.
+
+        Returns:
+            * results (dict) : Results of done GSM IDs, with the claiming
+                task, as tuples of (task, result) keyed on GSM ID.
+            * claimed (list) : GSM IDs now claimed by task.
+            * waiting (list) : GSM IDs still running in other tasks.
+    """
+    results, claimed, waiting = {}, [], []
+    conn = claim_connect(dbpath)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for gsm in gsm_list:
+            row = conn.execute("SELECT task, pid, state, result FROM claims"
+                +" WHERE run = ? AND gsm = ?", (run, gsm)).fetchone()
+            if row and row[2] == 'done':
+                results[gsm] = (row[0], json.loads(row[3]))
+            elif row and pid_alive(row[1]) and row[0] != task:
+                waiting.append(gsm)
+            else:
+                if row:
+                    print('taking over claim on '+gsm+' from task '+row[0])
+                conn.execute("INSERT OR REPLACE INTO claims (run, gsm, task,"
+                    +" pid, state, updated) VALUES (?, ?, ?, ?, 'running', ?)",
+                    (run, gsm, task, os.getpid(), time.time()))
+                claimed.append(gsm)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return results, claimed, waiting
+
+def gsm_result(gsmdl):
+    """ gsm_result
+
+        Get the result of a GSM ID from its download records, for reuse by
+        other tasks.
+
+        Arguments:
+            * gsmdl (list) : Records for the GSM ID, in dldict format, after
+                validation.
+
+        Returns:
+            * result (list) : Lists of [file ftp address, date, status] for
+                each file, with status True if the file is stored or
+                unchanged.
+    """
+    result = []
+    for record in gsmdl:
+        if not isinstance(record, list) or len(record) < 4:
+            continue
+        filedate = record[4] if len(record) >= 6 else record[2]
+        if isinstance(filedate, datetime.datetime):
+            filedate = filedate.isoformat()
+        ok = len(record) == 7 or str(record[-1]).startswith('same_as_local')
+        result.append([record[1], str(filedate), ok])
+    return result
+
+def reused_records(gsm_id, owner, result):
+    """ reused_records
+
+        Get download records for a GSM ID processed by another task, in
+        dldict format. File records are [gsm_id, file ftp address, date,
+        'same_as_claim'], or 'failed_in_claim' for files the claiming task
+        did not store, so they are not added to RMDB again.
+
+        Arguments:
+            * gsm_id (str) : A valid GSM ID.
+            * owner (str) : Task key of the claiming task.
+            * result (list) : Result of the GSM ID, as from gsm_result().
+
+        Returns:
+            * gsmdl (list) : Records for the GSM ID.
+    """
+    gsmdl = [[gsm_id, 'claimed by task '+owner, 'reusing claimed result']]
+    for file, filedate, ok in result:
+        try:
+            filedate = datetime.datetime.fromisoformat(filedate)
+        except ValueError:
+            pass
+        gsmdl.append([gsm_id, file, filedate, 'same_as_claim' if ok else
+            'failed_in_claim'])
+    return gsmdl
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+""" gzstream.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Incremental gunzip of a gzip stream as it is downloaded, so a compressed
+    idat can be expanded in the same pass that writes it.
+
+    Notes:
+        * Blocks are passed to a zlib decompressor as they arrive, and the
+            expanded bytes are written and hashed (SHA-256) as they are
+            produced. The expanded file is never re-read.
+        * zlib checks the CRC-32 and size trailer of each gzip member as it is
+            read, raising zlib.error on a mismatch. A stream ending inside a
+            member raises zlib.error on finish().
+        * Multi-member gzip streams (concatenated members) are supported, and
+            zero padding after the last member is ignored, as for gzip.open().
+
+    Classes:
+        * GunzipWriter: Expand blocks of a gzip stream to a file.
+"""
+
+import os, zlib, hashlib
+
+class GunzipWriter:
+    """ GunzipWriter
+
+        Expand blocks of a gzip stream to a file, hashing the expanded bytes.
+        Use write() as a block callback (e.g. for ftplib retrbinary), then
+        finish() to check the stream is complete.
+
+        Arguments:
+            * filepath (str) : Path of the expanded file to write.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.output_stream = None
+        self.reset()
+
+    def reset(self):
+        """ reset
+
+            Start over from the beginning of the stream, truncating any
+            expanded bytes already written.
+        """
+        self.close()
+        self.output_stream = open(self.filepath, 'wb')
+        self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.member_started = False
+        self.hashobj = hashlib.sha256()
+        self.sha256 = None
+
+    def write(self, block):
+        """ write
+
+            Expand one block of the gzip stream.
+        """
+        while block:
+            if not self.member_started:
+                block = bytes(block).lstrip(b'\x00')
+                if not block:
+                    return
+                self.member_started = True
+            data = self.decomp.decompress(block)
+            if data:
+                self.hashobj.update(data)
+                self.output_stream.write(data)
+            if not self.decomp.eof:
+                return
+            block = self.decomp.unused_data
+            self.decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.member_started = False
+
+    def tee(self, write):
+        """ tee
+
+            Wrap a write function so each block is also expanded, e.g. to
+            write the compressed and expanded files from one callback.
+        """
+        def callback(block):
+            write(block)
+            self.write(block)
+        return callback
+
+    def write_file(self, filepath, nbytes):
+        """ write_file
+
+            Expand the first nbytes of a compressed file, e.g. the partial
+            download being resumed.
+        """
+        with open(filepath, 'rb') as f:
+            while nbytes > 0:
+                block = f.read(min(1048576, nbytes))
+                if not block:
+                    break
+                self.write(block)
+                nbytes -= len(block)
+
+    def finish(self):
+        """ finish
+
+            Check the stream ended on a member boundary, and close the
+            expanded file.
+
+            Returns:
+                * sha256 (str) : Hex digest of the expanded file.
+        """
+        if self.member_started:
+            raise zlib.error('gzip stream ended inside a member')
+        self.close()
+        self.sha256 = self.hashobj.hexdigest()
+        return self.sha256
+
+    def close(self):
+        """ close
+
+            Close the expanded file.
+        """
+        if self.output_stream:
+            self.output_stream.close()
+            self.output_stream = None
+
+    def discard(self):
+        """ discard
+
+            Close and remove the expanded file.
+        """
+        self.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
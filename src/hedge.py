@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+""" hedge.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Hedged idat transfers. A transfer running much slower than its peers gets
+    a duplicate transfer on a second FTP connection, and whichever finishes
+    first is kept, so a few stalled transfers do not hold up a GSE task.
+
+    Notes:
+        * A transfer is a straggler once it has run for 'settings.hedgedelay'
+            seconds at a rate (bytes/sec) below the 'settings.hedgepercentile'
+            percentile of completed transfers, with at least
+            'settings.hedgeminpeers' completed.
+        * Each transfer is hedged at most once. The losing transfer is
+            cancelled, and its partial file removed.
+        * Hedging is used by dl_idat and dl_idat_async, with hedge=True (see
+            'settings.dlhedge').
+
+    Classes:
+        * HedgeCancelled: Raised in a transfer cancelled by its hedge.
+        * Transfer: Progress of one transfer, and its cancellation.
+        * HedgeMonitor: Peer rates and straggler detection for a batch of
+            transfers.
+"""
+
+import os, sys, time, threading
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+class HedgeCancelled(Exception):
+    """ HedgeCancelled
+
+        Raised in a transfer that lost to its duplicate.
+    """
+    pass
+
+class Transfer:
+    """ Transfer
+
+        Bytes received by one transfer since it started, and whether it was
+        cancelled. The session in use is kept in 'transfer.ftp', so a
+        cancelled transfer can be aborted from another thread.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.nbytes = 0
+        self.cancelled = False
+        self.ftp = None
+
+    def add(self, nbytes):
+        """ add
+
+            Count bytes received, raising HedgeCancelled if cancelled.
+        """
+        if self.cancelled:
+            raise HedgeCancelled('transfer cancelled by hedge')
+        self.nbytes += nbytes
+
+    def counted(self, callback):
+        """ counted
+
+            Wrap a block callback to count bytes with add().
+        """
+        def wrapper(block):
+            self.add(len(block))
+            callback(block)
+        return wrapper
+
+    def rate(self):
+        """ rate
+
+            Bytes/sec received since the transfer started.
+        """
+        return self.nbytes / max(time.time() - self.start, 1e-6)
+
+    def cancel(self):
+        """ cancel
+
+            Cancel the transfer, aborting its session if it has one.
+        """
+        self.cancelled = True
+        ftp = self.ftp
+        if ftp is not None and hasattr(ftp, 'abort_transfer'):
+            ftp.abort_transfer()
+
+class HedgeMonitor:
+    """ HedgeMonitor
+
+        Completed transfer rates and straggler detection, for the transfers
+        of one download call. Threaded callers watch() transfers, and a
+        monitor thread calls their hedge function once they straggle.
+
+        Arguments:
+            * percentile (float) : Percentile of peer rates below which a
+                transfer straggles.
+            * delay (float) : Seconds a transfer runs before it can straggle.
+            * minpeers (int) : Completed transfers needed before hedging.
+            * interval (float) : Seconds between straggler checks.
+    """
+    def __init__(self, percentile=settings.hedgepercentile,
+        delay=settings.hedgedelay, minpeers=settings.hedgeminpeers,
+        interval=.25):
+        self.percentile = percentile
+        self.delay = delay
+        self.minpeers = minpeers
+        self.interval = interval
+        self.rates = []
+        self.watched = {}
+        self.nhedged = 0
+        self.nwon = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+
+    def register(self):
+        """ register
+
+            Start tracking a new transfer.
+
+            Returns:
+                * transfer (Transfer) : Progress of the new transfer.
+        """
+        return Transfer()
+
+    def complete(self, transfer):
+        """ complete
+
+            Record the rate of a completed transfer, as a peer rate.
+        """
+        with self.lock:
+            self.rates.append(transfer.rate())
+
+    def threshold(self):
+        """ threshold
+
+            Get the straggler rate threshold, or None if too few transfers
+            have completed.
+        """
+        with self.lock:
+            if len(self.rates) < self.minpeers:
+                return None
+            rates = sorted(self.rates)
+        return rates[min(len(rates) - 1, int(len(rates) * self.percentile
+            / 100))]
+
+    def is_straggler(self, transfer):
+        """ is_straggler
+
+            Check whether a running transfer should be hedged.
+        """
+        if time.time() - transfer.start < self.delay:
+            return False
+        threshold = self.threshold()
+        return threshold is not None and transfer.rate() < threshold
+
+    def watch(self, transfer, hedgefun):
+        """ watch
+
+            Call hedgefun in a new thread if transfer straggles before it is
+            unwatched.
+        """
+        with self.lock:
+            self.watched[transfer] = hedgefun
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def unwatch(self, transfer):
+        """ unwatch
+
+            Stop watching a transfer.
+
+            Returns:
+                * (bool) : True if the transfer was still watched, i.e. not
+                    hedged.
+        """
+        with self.lock:
+            return self.watched.pop(transfer, None) is not None
+
+    def _run(self):
+        """ _run
+
+            Check watched transfers for stragglers until closed.
+        """
+        while not self.closed:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched)
+            for transfer in watched:
+                if not self.is_straggler(transfer):
+                    continue
+                with self.lock:
+                    hedgefun = self.watched.pop(transfer, None)
+                    if hedgefun is None:
+                        continue
+                    self.nhedged += 1
+                threading.Thread(target=hedgefun, daemon=True).start()
+
+    def close(self):
+        """ close
+
+            Stop the monitor thread and print a summary.
+        """
+        self.closed = True
+        if self.nhedged:
+            print('hedged '+str(self.nhedged)+' slow transfers, '
+                +str(self.nwon)+' finished first on the hedge')
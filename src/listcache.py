@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+""" listcache.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Persistent cache of GEO FTP directory listings, so directories that have
+    not changed in a long time are not re-listed on every scheduled run.
+
+    Notes:
+        * The cache is a SQLite db at 'settings.listcachedbpath', keyed on
+            directory ftp address, e.g. 'geo/samples/GSM1000nnn/GSM1000/suppl/'.
+            Each entry stores file names, sizes, and modification times, as
+            returned by dl.ftp_listdir().
+        * Each entry has a TTL, from 'settings.listcachettl' up to
+            'settings.listcachemaxttl', growing with the age of the newest
+            file in the directory ('settings.listcacheagefrac' of that age).
+            A GSM whose idats are years old is re-listed rarely, a new one
+            daily.
+        * An entry within its TTL is fresh and is used without listing. An
+            entry past its TTL, but within twice its TTL, is stale: it is used,
+            and the directory is re-listed in the background. Older entries
+            are expired, and the directory is listed before use.
+
+    Functions:
+        * listcache_connect: Connect to the listing cache.
+        * cached_connect: Get this thread's open connection to the listing
+            cache.
+        * listing_ttl: Get the TTL of a directory listing.
+        * get_cached_listing: Get a cached listing and its freshness.
+        * get_cached_listings: Get cached listings for many directories.
+        * decode_listing: Decode a cached listing row.
+        * set_cached_listing: Store a directory listing.
+"""
+
+import os, sys, time, datetime, json, sqlite3, threading
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+_local = threading.local()
+
+def listcache_connect(dbpath=settings.listcachedbpath):
+    """ listcache_connect
+
+        Connect to the listing cache, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite listing cache.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the listing cache.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS listings (dirpath TEXT PRIMARY"
+        +" KEY, listing TEXT, fetched REAL, ttl REAL)")
+    return conn
+
+def cached_connect(dbpath=settings.listcachedbpath):
+    """ cached_connect
+
+        Get this thread's open connection to the listing cache, connecting on
+        first use, and again in a forked process.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite listing cache.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the listing cache. Not
+                to be closed by the caller.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        # connections are not to be used across a fork
+        _local.pid = os.getpid()
+        _local.conns = {}
+    # keyed on the absolute path, as dbpath is relative to the working dir
+    key = os.path.abspath(dbpath)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = _local.conns[key] = listcache_connect(dbpath)
+    return conn
+
+def listing_ttl(listing, fetched, ttl=settings.listcachettl,
+    maxttl=settings.listcachemaxttl, agefrac=settings.listcacheagefrac):
+    """ listing_ttl
+
+        Get the TTL of a directory listing, growing with the age of its newest
+        file. Listings without file dates get the base TTL.
+
+        Arguments:
+            * listing (dict) : Directory listing, as from dl.ftp_listdir().
+            * fetched (float) : Time the listing was fetched, in seconds since
+                the epoch.
+            * ttl (float) : Base TTL in seconds.
+            * maxttl (float) : Max TTL in seconds.
+            * agefrac (float) : Fraction of the newest file age added to ttl.
+
+        Returns:
+            * ttl (float) : TTL of the listing in seconds.
+    """
+    dates = [meta['modify'] for meta in listing.values()]
+    if not dates or None in dates:
+        return ttl
+    newest = max(dates).replace(tzinfo=datetime.timezone.utc).timestamp()
+    return min(maxttl, max(ttl, agefrac * (fetched - newest)))
+
+def get_cached_listing(dirpath, dbpath=settings.listcachedbpath):
+    """ get_cached_listing
+
+        Get the cached listing of a directory, and whether it is fresh, stale,
+        or expired.
+
+        Arguments:
+            * dirpath (str) : FTP address of the directory.
+            * dbpath (str) : Path to the SQLite listing cache.
+
+        Returns:
+            * listing (dict) : Cached listing, as from dl.ftp_listdir(), or
+                None if not cached.
+            * state (str) : One of 'fresh', 'stale', or 'expired', or None if
+                not cached.
+    """
+    row = cached_connect(dbpath).execute("SELECT listing, fetched, ttl FROM"
+        +" listings WHERE dirpath = ?", (dirpath,)).fetchone()
+    if row is None:
+        return None, None
+    return decode_listing(row, time.time())
+
+def get_cached_listings(dirpaths, dbpath=settings.listcachedbpath, 
+    chunksize=500):
+    """ get_cached_listings
+
+        Get the cached listings of many directories, looking them up by key
+        in chunks of chunksize directories per query.
+
+        Arguments:
+            * dirpaths (set) : FTP addresses of the directories.
+            * dbpath (str) : Path to the SQLite listing cache.
+            * chunksize (int) : Directories per query, below the SQLite limit
+                on query parameters.
+
+        Returns:
+            * listings (dict) : Tuples of (listing, state), as from 
+                get_cached_listing(), keyed on cached directories in dirpaths.
+    """
+    dirpaths = sorted(set(dirpaths))
+    now = time.time()
+    listings = {}
+    conn = cached_connect(dbpath)
+    for i in range(0, len(dirpaths), chunksize):
+        chunk = dirpaths[i:i + chunksize]
+        for row in conn.execute("SELECT dirpath, listing, fetched, ttl FROM"
+            +" listings WHERE dirpath IN ("+', '.join('?' * len(chunk))+")",
+            chunk):
+            listings[row[0]] = decode_listing(row[1:], now)
+    return listings
+
+def decode_listing(row, now):
+    """ decode_listing
+
+        Decode a cache row of (listing, fetched, ttl) into a listing and its
+        freshness at time now.
+    """
+    listing = {}
+    for file, (size, modify) in json.loads(row[0]).items():
+        if modify:
+            modify = datetime.datetime.strptime(modify, "%Y%m%d%H%M%S")
+        listing[file] = {'size' : size, 'modify' : modify}
+    age = now - row[1]
+    state = 'fresh' if age < row[2] else 'stale' if age < 2 * row[2] else \
+        'expired'
+    return listing, state
+
+def set_cached_listing(dirpath, listing, dbpath=settings.listcachedbpath):
+    """ set_cached_listing
+
+        Store the listing of a directory, with its TTL.
+
+        Arguments:
+            * dirpath (str) : FTP address of the directory.
+            * listing (dict) : Directory listing, as from dl.ftp_listdir().
+            * dbpath (str) : Path to the SQLite listing cache.
+
+        Returns:
+            * None, updates the listing cache as side effect.
+    """
+    fetched = time.time()
+    listingstr = json.dumps({file : [meta['size'], meta['modify'].strftime(
+        "%Y%m%d%H%M%S") if meta['modify'] else None] for file, meta in
+        listing.items()})
+    conn = cached_connect(dbpath)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO listings (dirpath, listing,"
+            +" fetched, ttl) VALUES (?, ?, ?, ?)", (dirpath, listingstr,
+            fetched, listing_ttl(listing, fetched)))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+""" objstore.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Content-addressed object store for idat files. Each distinct file content
+    is stored once, under its SHA-256 hash, and versioned filenames in the
+    idats directory are hard links to the stored object.
+
+    Notes:
+        * Objects are stored at 'settings.objectspath', as
+            'objects/<first 2 hash chars>/<hash>'.
+        * Versioned idats (e.g. 'GSM1000.<timestamp>.<name>_Grn.idat.gz') and
+            'hlink' files share the inode of their object, so identical bytes
+            (e.g. re-downloads, or a chip barcode under several GSM IDs) use
+            disk space once.
+        * An object with no remaining links (link count 1) is unreferenced,
+            and is removed by prune_objects().
+        * The store must be on the same filesystem as the idats directory.
+
+    Functions:
+        * object_path: Get the store path for a hash.
+        * has_object: Check whether the store contains a hash.
+        * store_object: Add a file to the store, replacing it with a hard link
+            to the stored object.
+        * link_object: Hard link a stored object to a new filename.
+        * dedupe_dir: Add all matching files in a directory to the store.
+        * prune_objects: Remove stored objects with no remaining links.
+"""
+
+import os, sys, re, tempfile
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+from filehash import file_sha256
+import settings
+settings.init()
+
+def object_path(sha256, objectspath=settings.objectspath):
+    """ object_path
+
+        Get the path of the object for a hash, whether or not it is stored.
+
+        Arguments:
+            * sha256 (str) : Hex digest of file content.
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * objpath (str) : Path of the object in the store.
+    """
+    return os.path.join(objectspath, sha256[:2], sha256)
+
+def has_object(sha256, objectspath=settings.objectspath):
+    """ has_object
+
+        Check whether content with a hash is in the store.
+
+        Arguments:
+            * sha256 (str) : Hex digest of file content.
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * (bool) : True if the object is stored, False otherwise.
+    """
+    return os.path.exists(object_path(sha256, objectspath))
+
+def _replace_with_link(objpath, filepath):
+    """ _replace_with_link
+
+        Atomically replace a file with a hard link to an object.
+    """
+    fd, linkpath = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.',
+        prefix='.objlink.')
+    os.close(fd); os.remove(linkpath)
+    os.link(objpath, linkpath)
+    os.replace(linkpath, filepath)
+
+def store_object(filepath, sha256=None, objectspath=settings.objectspath):
+    """ store_object
+
+        Add a file to the object store. If identical content is already
+        stored, the file is replaced with a hard link to the stored object,
+        otherwise the file itself becomes the stored object.
+
+        Arguments:
+            * filepath (str) : Path of file to store.
+            * sha256 (str) : Hex digest of file, or None to compute it.
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * objpath (str) : Path of stored object, or None if the file
+                could not be linked (e.g. store on another filesystem).
+            * isnew (bool) : True if the content was not previously stored.
+    """
+    sha256 = sha256 or file_sha256(filepath)
+    objpath = object_path(sha256, objectspath)
+    try:
+        os.makedirs(os.path.dirname(objpath), exist_ok=True)
+        try:
+            os.link(filepath, objpath)
+            return objpath, True
+        except FileExistsError:
+            pass
+        if not os.path.samefile(objpath, filepath):
+            _replace_with_link(objpath, filepath)
+        return objpath, False
+    except OSError as e:
+        print("couldn't store object for file "+filepath+": "+str(e))
+        return None, False
+
+def link_object(sha256, filepath, objectspath=settings.objectspath):
+    """ link_object
+
+        Make a new filename for stored content, as a hard link to its object.
+
+        Arguments:
+            * sha256 (str) : Hex digest of stored content.
+            * filepath (str) : New path to link to the object.
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * filepath (str) : The new path, or None if the object isn't
+                stored.
+    """
+    objpath = object_path(sha256, objectspath)
+    if not os.path.exists(objpath):
+        return None
+    if os.path.exists(filepath):
+        _replace_with_link(objpath, filepath)
+    else:
+        os.link(objpath, filepath)
+    return filepath
+
+def dedupe_dir(dirpath=settings.idatspath, pattern='.*idat.*',
+    objectspath=settings.objectspath):
+    """ dedupe_dir
+
+        Add all matching files in a directory to the object store, replacing
+        duplicate files with hard links. Used to migrate an existing idats
+        directory, including 'hlink' files.
+
+        Arguments:
+            * dirpath (str) : Directory of files to store.
+            * pattern (str) : Regex pattern of filenames to store.
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * ddedupe (dict) : Counts of files stored, files newly stored, and
+                bytes freed by linking duplicates.
+    """
+    rxfn = re.compile(pattern); inodes = {}
+    ddedupe = {'files' : 0, 'new_objects' : 0, 'bytes_freed' : 0}
+    fnlist = sorted(filter(rxfn.match, os.listdir(dirpath)))
+    print("Storing "+str(len(fnlist))+" files from "+dirpath+"...")
+    for fn in fnlist:
+        filepath = os.path.join(dirpath, fn)
+        if not os.path.isfile(filepath) or os.path.islink(filepath):
+            continue
+        fstat = os.stat(filepath)
+        # files already linked to each other share one hash
+        inode = (fstat.st_dev, fstat.st_ino)
+        if not inode in inodes:
+            inodes[inode] = file_sha256(filepath)
+        objpath, isnew = store_object(filepath, inodes[inode], objectspath)
+        if objpath:
+            ddedupe['files'] += 1
+            if isnew:
+                ddedupe['new_objects'] += 1
+            elif fstat.st_nlink == 1:
+                ddedupe['bytes_freed'] += fstat.st_size
+    print("Stored "+str(ddedupe['files'])+" files as "
+        +str(ddedupe['new_objects'])+" new objects, freed "
+        +str(ddedupe['bytes_freed'])+" bytes.")
+    return ddedupe
+
+def prune_objects(objectspath=settings.objectspath):
+    """ prune_objects
+
+        Remove stored objects that no filename links to.
+
+        Arguments:
+            * objectspath (str) : Path to the object store.
+
+        Returns:
+            * nprune (int) : Number of objects removed.
+    """
+    nprune = 0
+    if not os.path.exists(objectspath):
+        return nprune
+    for subdir in os.listdir(objectspath):
+        subpath = os.path.join(objectspath, subdir)
+        for objfn in os.listdir(subpath):
+            objpath = os.path.join(subpath, objfn)
+            if os.stat(objpath).st_nlink == 1:
+                os.remove(objpath); nprune += 1
+    print("Removed "+str(nprune)+" unreferenced objects.")
+    return nprune
+
+if __name__ == "__main__":
+    """ Migrate an existing idats directory to the object store
+    """
+    dedupe_dir()
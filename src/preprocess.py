@@ -26,6 +26,7 @@ from process_soft import expand_soft, extract_gsm_soft, gsm_soft2json
 from process_soft import msrap_prepare_json, run_metasrapipeline
 from process_idats import expand_idats
 from utilities import gettime_ntp, getlatest_filepath, get_queryfilt_dict
+from querymap import invert_querydict
 from utilities import querydict
 import settings
 settings.init()
@@ -221,7 +222,7 @@ def process_gsesoft(rmcompressed_gsesoft=False, expand_soft_opt=True,
 
 def compile_rsheet(eqfiltd=get_queryfilt_dict(), sheetfn_ext='rsheet', 
     msrapfn_ext='msrapout', msrapfn='msrapout', idatsfn_ext='idat',
-    timestamp=gettime_ntp()):
+    timestamp=None):
     """ compile_rsheet
 
         Knits poised file data together into a sheet to be read into R using 
@@ -242,12 +243,15 @@ def compile_rsheet(eqfiltd=get_queryfilt_dict(), sheetfn_ext='rsheet',
         * idatsfn_ext (str) : Filename extension of valid idat files.
         * idatsdir (str) : Name of directory containing GSM idat files.
         * filesdir (str) : Root name of directory containing database files.
-        * timestamp (str) : NTP timestamp for file versioning.
+        * timestamp (str) : NTP timestamp for file versioning, or None for the
+            current one.
         * msrapfn (str) : File name stem for MetaSRA-pipeline files
         
         Returns:
         * null, produces sheet files as a side effect.
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     # form the sheet path and make dir as needed
     sheetspath = settings.sheetspath
     os.makedirs(sheetspath, exist_ok = True)
@@ -292,6 +296,7 @@ def compile_rsheet(eqfiltd=get_queryfilt_dict(), sheetfn_ext='rsheet',
             "ARRAY_ID",
             "Basename"]))
         lsheet[0] = lsheet[0]+"\n"
+        eqfiltgsmd = invert_querydict(eqfiltd)
         for gsmid in gsmvalid:
             # compile the file info for this gsm
             rxgsmi = re.compile(".*"+gsmid+".*")
@@ -328,10 +333,7 @@ def compile_rsheet(eqfiltd=get_queryfilt_dict(), sheetfn_ext='rsheet',
                         grows.append(":".join([str(key),str(gsmi_md[key])]))
                 gsmi_mdvar = "'"+";".join(grows)+"'"
                 # grab the gse id for this gsm
-                gseid = str([gsek for gsek in list(eqfiltd.keys()) 
-                            if gsmid in eqfiltd[gsek]
-                            ][0]
-                        )
+                gseid = str(eqfiltgsmd[gsmid][0])
                 # make the gsm arrays path Basename for minfi
                 gsmi_bn = "_".join(gsmi_red_latest.split("_")[0:3])
                 # one entry per gsm
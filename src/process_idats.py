@@ -14,12 +14,15 @@
 import os, sys, re, gzip, shutil; from random import shuffle
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 import settings; settings.init()
+from objstore import store_object
 
 def expand_idats(idatspath = settings.idatspath, compext = ".*idat.gz$", 
     expext = ".*idat$"):
     """ expand_idats
 
-        Detect and expand available idat files.
+        Detect and expand available idat files. Expanded idats are added to 
+        the object store. Not needed for idats downloaded with 
+        settings.dlexpand, which are expanded as they download.
         
         Arguments:
         * idatspath : Path to instance directory containing downloaded 
@@ -50,6 +53,8 @@ def expand_idats(idatspath = settings.idatspath, compext = ".*idat.gz$",
                     shutil.copyfileobj(f_in, f_out); ridatd[compidat].append(1)
                 except:
                     ridatd[compidat].append(shutil.Error)
+        if ridatd[compidat][0] == 1:
+            store_object(os.path.join(idatspath, idat_fn))
         print("Finished with file "+compidat+", number "+str(nfile));nfile+=1
     return ridatd
 
@@ -31,6 +31,8 @@ from datetime import datetime; from random import shuffle
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 from utilities import gettime_ntp, getlatest_filepath, get_queryfilt_dict
 from utilities import monitor_processes; import settings; settings.init()
+from filehash import cached_connect, get_latest_hash, set_latest_hash
+from filehash import file_sha256; import hashlib
 
 def expand_soft(rmcompressed=False):
     """ expand_soft
@@ -116,7 +118,7 @@ def expand_soft(rmcompressed=False):
     return rsoftd
 
 def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*', 
-    softcloseindex='.*!Sample_data_row_count.*', timestamp=gettime_ntp(), 
+    softcloseindex='.*!Sample_data_row_count.*', timestamp=None, 
     gse_softpath = settings.gsesoftpath, gsm_softpath = settings.gsmsoftpath, 
     gsmsoft_destpath = settings.gsmsoftpath, rmtempdir = True, validate=True):
     """ extract_gsm_soft
@@ -130,7 +132,8 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
         * softcloseindex (str) : Index of label/tag to close entry, defaults 
             to close just before possible by-CpG methylation table. To include 
             possible methylation data table, change to '!sample_table_end'.
-        * timestamp (str) : NTP timestamp version for expanded files.
+        * timestamp (str) : NTP timestamp version for expanded files, or 
+            None for the current one.
         * rmtempdir (Bool.) : Whether to remove temp directory.
         * validate (Bool.) : Validate extracted GSM files against files in 
             gsm_soft directory?
@@ -139,6 +142,8 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
         * newfilesd (dictionary), or error (null), generates GSM SOFT files 
             as a side effect.
     """
+    if not timestamp:
+        timestamp = gettime_ntp()
     eqfiltdict=get_queryfilt_dict()
     validgsmlist = list(set([gsmid for gselist in list(eqfiltdict.values()) 
         for gsmid in gselist
@@ -157,6 +162,7 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
         ]
     gse_softlist = list(filter(rvalidsoft.match, gse_soft_dirlist))
     shuffle(gse_softlist); newfilesd = {} # new files, status dict to return
+    gsmhashd = {} # sha256 of new gsm soft files, computed at write
     print("new tempdir for writing soft files : "+str(temp_dir_make))
     print("length gse_softlist: "+str(len(gse_softlist)))
     rxopen = re.compile(softopenindex); rxclose = re.compile(softcloseindex)
@@ -195,8 +201,11 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
                 if gsmid in validgsmlist:
                     newfilesd[gse_softfile].append(gsm_softfn)
                     gsm_newfile_path = os.path.join(temp_dir_make, gsm_softfn)
-                    write = [gsmfile.write(line) for line in open(gsm_newfile_path,"w+")]
-                    open(gsm_newfile_path,"w+").write("\n".join(gsm_softlines))
+                    gsm_softbytes = "\n".join(gsm_softlines).encode()
+                    with open(gsm_newfile_path, "wb") as gsm_newfile:
+                        gsm_newfile.write(gsm_softbytes)
+                    gsmhashd[gsm_softfn] = hashlib.sha256(
+                        gsm_softbytes).hexdigest()
                 else: 
                     print("GSM id :"+gsmid+" is not a valid HM450k sample. "
                         +"Continuing...")
@@ -205,6 +214,7 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
     print("newfilesd : "+str(newfilesd))
     if validate:
         print("Beginning validation for files: ", list(newfilesd.keys()))
+        conn = cached_connect()
         for gse_softfn in list(newfilesd.keys()):
             gsmfilelist = list(filter(rxgsmfile.match, newfilesd[gse_softfn]))
             if gsmfilelist and len(gsmfilelist)>0:
@@ -214,31 +224,36 @@ def extract_gsm_soft(gsesoft_flist=[], softopenindex='.*!Sample_title.*',
                     gsm_softfn = gsmfile; gsmstr = gsm_softfn.split(".")[1]
                     print("gsmfile: "+str(gsmfile)); print("gsmstr : "+gsmstr)
                     gsm_newfile_path = os.path.join(temp_dir_make, gsm_softfn)
-                    gsm_oldfile_path = getlatest_filepath(
+                    gsm_destfile_path = os.path.join(gsmsoft_destpath, 
+                        os.path.basename(gsm_newfile_path))
+                    filekey = os.path.join(settings.gsmsoftdir, 
+                        gsmstr+'.soft')
+                    gsm_oldfile_path, oldhash = get_latest_hash(conn, filekey,
+                        lambda: getlatest_filepath(
                             filepath=gsmsoft_destpath, filestr=gsmstr, 
                             embeddedpattern=True, tslocindex=0
-                        )
+                        ))
                     print("gsm_oldfile_path : "+str(gsm_oldfile_path))
                     print("gsm_newfile_path : "+str(gsm_newfile_path))
                     if os.path.exists(gsm_newfile_path):
+                        newhash = gsmhashd.get(gsm_softfn) or file_sha256(
+                            gsm_newfile_path)
                         if gsm_oldfile_path:
-                            if filecmp.cmp(gsm_oldfile_path, gsm_newfile_path):
+                            if oldhash == newhash:
                                 print("Identical GSM soft file detected, removing...")
                                 os.remove(gsm_newfile_path)
                                 newfilesd[gsmfile] = False
                             else:
                                 print("New GSM soft file detected, moving from temp...")
-                                shutil.move(gsm_newfile_path, os.path.join(
-                                        gsmsoft_destpath, 
-                                        os.path.basename(gsm_newfile_path))
-                                    )
+                                shutil.move(gsm_newfile_path, gsm_destfile_path)
+                                set_latest_hash(conn, filekey, 
+                                    gsm_destfile_path, newhash)
                                 newfilesd[gsmfile] = True
                         else: 
                             print("New GSM soft file detected, moving from temp...")
-                            shutil.move(gsm_newfile_path, os.path.join(
-                                        gsmsoft_destpath, 
-                                        os.path.basename(gsm_newfile_path))
-                                    )
+                            shutil.move(gsm_newfile_path, gsm_destfile_path)
+                            set_latest_hash(conn, filekey, gsm_destfile_path, 
+                                newhash)
                             newfilesd[gsmfile] = True
                     else:
                         print("GSM soft file unavailable. Continuing...")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+""" querymap.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Compiled GSE to GSM ID map of a filtered edirect query, with the reverse
+    GSM to GSE ID map, stored in a compact binary file next to the
+    'gsequery_filt.<timestamp>' text file.
+
+    Notes:
+        * Map files are named 'gsequery_map.<timestamp>', with the timestamp
+            of the filter file they were compiled with, and are written by
+            edirect_query.gsequery_filter(). A filter file without a map file
+            (e.g. from gsm_exclude.py) is read as text.
+        * IDs are stored as their numbers, in unsigned 32-bit little-endian
+            arrays: GSE numbers with offsets into their GSM numbers, and GSM
+            numbers with offsets into their GSE numbers, each sorted by key.
+            Reading a map is a few array copies, and IDs are looked up by
+            binary search, so no dictionary is built on load.
+        * IdMap objects are read-only mappings (e.g. 'map[gse]', 'gse in
+            map', 'map.keys()', 'map.values()'), with keys in ID order and
+            values as lists of ID strings.
+
+    Classes and Functions:
+        * IdMap: Read-only mapping from IDs to lists of IDs, over arrays.
+        * invert_querydict: Get the GSM to GSE ID map of a query dictionary.
+        * write_querymap: Write the map file of a query dictionary.
+        * read_querymap: Read the GSE to GSM and GSM to GSE maps of a map file.
+"""
+
+import os, sys, struct, bisect
+from array import array
+from collections.abc import Mapping
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+MAGIC = b'RMQMAP01'
+HEADER = struct.Struct('<8sIIII')
+
+class IdMap(Mapping):
+    """ IdMap
+
+        Read-only mapping from IDs (e.g. 'GSE100001') to lists of IDs (e.g.
+        ['GSM1000001', ...]), over sorted arrays of ID numbers.
+
+        Arguments:
+            * keys (array) : Sorted key ID numbers.
+            * offsets (array) : Start of the values of each key in values,
+                and the end of the last.
+            * values (array) : Value ID numbers, grouped by key.
+            * keyprefix (str) : Prefix of key IDs, e.g. 'GSE'.
+            * valueprefix (str) : Prefix of value IDs, e.g. 'GSM'.
+    """
+    def __init__(self, keys, offsets, values, keyprefix, valueprefix):
+        self.keynums = keys
+        self.offsets = offsets
+        self.valuenums = values
+        self.keyprefix = keyprefix
+        self.valueprefix = valueprefix
+
+    def index(self, key):
+        if not isinstance(key, str) or not key.startswith(self.keyprefix):
+            return None
+        try:
+            num = int(key[len(self.keyprefix):])
+        except ValueError:
+            return None
+        i = bisect.bisect_left(self.keynums, num)
+        if i < len(self.keynums) and self.keynums[i] == num:
+            return i
+        return None
+
+    def __getitem__(self, key):
+        i = self.index(key)
+        if i is None:
+            raise KeyError(key)
+        return [self.valueprefix+str(num) for num in
+            self.valuenums[self.offsets[i]:self.offsets[i + 1]]]
+
+    def __contains__(self, key):
+        return self.index(key) is not None
+
+    def __iter__(self):
+        return (self.keyprefix+str(num) for num in self.keynums)
+
+    def __len__(self):
+        return len(self.keynums)
+
+def invert_querydict(gsed):
+    """ invert_querydict
+
+        Get the GSM to GSE ID map of a GSE query dictionary.
+
+        Arguments:
+            * gsed (dict) : GSE query, as from querydict() (keys = GSE IDs,
+                values = GSM ID lists).
+
+        Returns:
+            * gsmd (dict) : GSM to GSE ID map (keys = GSM IDs, values = GSE ID
+                lists).
+    """
+    gsmd = {}
+    for gse, gsmlist in gsed.items():
+        for gsm in gsmlist:
+            gsmd.setdefault(gsm, []).append(gse)
+    return gsmd
+
+def _pack(items):
+    # arrays of sorted key numbers, value offsets, and value numbers
+    keys, offsets, values = array('I'), array('I', [0]), array('I')
+    for key, nums in sorted(items):
+        keys.append(key)
+        values.extend(nums)
+        offsets.append(len(values))
+    return keys, offsets, values
+
+def write_querymap(gsed, mappath):
+    """ write_querymap
+
+        Write the map file of a GSE query dictionary, replacing any file at
+        mappath atomically.
+
+        Arguments:
+            * gsed (dict) : GSE query, as from querydict().
+            * mappath (str) : Path of the map file to write.
+
+        Returns:
+            * mappath (str) : Path of the map file, or None if an ID is not a
+                'GSE' or 'GSM' ID number.
+    """
+    try:
+        items = []
+        for gse, gsmlist in gsed.items():
+            if gse[:3] != 'GSE' or set(gsm[:3] for gsm in gsmlist) - {'GSM'}:
+                raise ValueError(gse)
+            items.append((int(gse[3:]), [int(gsm[3:]) for gsm in gsmlist]))
+        reverse = {}
+        for gse, gsmnums in items:
+            for gsm in gsmnums:
+                reverse.setdefault(gsm, []).append(gse)
+        arrays = _pack(items) + _pack(reverse.items())
+    except (ValueError, OverflowError):
+        print("Query has IDs not of the form 'GSE<n>' or 'GSM<n>', skipping"
+            +" map file "+mappath)
+        return None
+    if sys.byteorder != 'little':
+        for arr in arrays:
+            arr.byteswap()
+    partpath = mappath+'.part'
+    with open(partpath, 'wb') as mapfile:
+        mapfile.write(HEADER.pack(MAGIC, len(arrays[0]), len(arrays[2]),
+            len(arrays[3]), len(arrays[5])))
+        for arr in arrays:
+            mapfile.write(arr.tobytes())
+    os.replace(partpath, mappath)
+    return mappath
+
+def read_querymap(mappath):
+    """ read_querymap
+
+        Read the GSE to GSM and GSM to GSE ID maps of a map file.
+
+        Arguments:
+            * mappath (str) : Path of the map file.
+
+        Returns:
+            * gsed (IdMap) : GSE to GSM ID map.
+            * gsmd (IdMap) : GSM to GSE ID map.
+    """
+    with open(mappath, 'rb') as mapfile:
+        data = mapfile.read()
+    magic, ngse, npair, ngsm, nrpair = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a query map file: '+mappath)
+    arrays = []
+    pos = HEADER.size
+    for n in (ngse, ngse + 1, npair, ngsm, ngsm + 1, nrpair):
+        arr = array('I')
+        arr.frombytes(data[pos:pos + n * arr.itemsize])
+        if sys.byteorder != 'little':
+            arr.byteswap()
+        arrays.append(arr)
+        pos += n * arr.itemsize
+    return IdMap(*arrays[:3], 'GSE', 'GSM'), IdMap(*arrays[3:], 'GSM', 'GSE')
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+""" ratelimit.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Host-wide rate limits for requests to NCBI (GEO FTP and E-utilities),
+    shared by all worker processes through a SQLite file.
+
+    Notes:
+        * Rates are token buckets, e.g. FTP commands/sec or bytes/sec, stored
+            in the 'buckets' table at 'settings.ratelimitdbpath'. A caller
+            reserves tokens in a short transaction and sleeps outside it, so
+            waiting workers do not hold the db lock.
+        * Each process reserves tokens from the shared bucket in batches of
+            'settings.ratelimitbatch' seconds of rate, and spends them 
+            locally, so most reservations do not touch the db.
+        * Each thread keeps one open connection to the db, reopened after a
+            fork (e.g. in Celery worker processes).
+        * Concurrent connections are capped with leases in the 'leases' table.
+            Leases held by processes that have exited are cleared.
+        * A rate or limit of 0 disables the corresponding check. Limits are
+            set in settings.py, under '[downloads]'.
+
+    Functions:
+        * ratelimit_connect: Connect to the rate limit db.
+        * cached_connect: Get this thread's open connection to the db.
+        * transaction: Context manager for a write transaction on the db.
+        * reserve_shared: Reserve tokens from a bucket in the db.
+        * reserve: Reserve tokens from a bucket, returning the time to wait.
+        * acquire: Reserve tokens from a bucket and wait for them.
+        * rate_limited: Wrap a block callback to wait on a bytes/sec bucket.
+        * pid_alive: Check whether a process is running on this host.
+        * try_lease: Take a connection lease if fewer than a limit are held.
+        * acquire_lease: Wait for and take a connection lease.
+        * release_lease: Return a connection lease.
+"""
+
+import os, sys, time, sqlite3, threading
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+_local = threading.local()
+_batches = {} # (pid, dbpath, name) : (tokens left, time they are available)
+_batchlock = threading.Lock()
+
+def ratelimit_connect(dbpath=settings.ratelimitdbpath):
+    """ ratelimit_connect
+
+        Connect to the rate limit db, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite rate limit db.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the rate limit db, in
+                autocommit mode.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY,"
+        +" tokens REAL, updated REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY"
+        +" AUTOINCREMENT, name TEXT, pid INTEGER, created REAL)")
+    return conn
+
+def cached_connect(dbpath=settings.ratelimitdbpath):
+    """ cached_connect
+
+        Get this thread's open connection to the rate limit db, connecting
+        on first use, and again in a forked process.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite rate limit db.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the rate limit db, in
+                autocommit mode. Not to be closed by the caller.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        # connections are not to be used across a fork
+        _local.pid = os.getpid()
+        _local.conns = {}
+    # keyed on the absolute path, as dbpath is relative to the working dir
+    key = os.path.abspath(dbpath)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = _local.conns[key] = ratelimit_connect(dbpath)
+    return conn
+
+@contextmanager
+def transaction(dbpath=settings.ratelimitdbpath):
+    """ transaction
+
+        Context manager for a write transaction on this thread's connection
+        to the rate limit db, rolled back on error.
+    """
+    conn = cached_connect(dbpath)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def reserve_shared(name, amount, rate, burst=None, 
+    dbpath=settings.ratelimitdbpath):
+    """ reserve_shared
+
+        Reserve tokens from a bucket in the rate limit db. The bucket may go
+        into debt, so concurrent callers queue in order of reservation. 
+        Arguments are as for reserve().
+
+        Returns:
+            * wait (float) : Seconds to wait before using the tokens.
+    """
+    burst = burst or rate
+    with transaction(dbpath) as conn:
+        now = time.time()
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?",
+            (name,)).fetchone()
+        tokens = burst if row is None else min(burst,
+            row[0] + (now - row[1]) * rate)
+        tokens -= amount
+        conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated)"
+            +" VALUES (?, ?, ?)", (name, tokens, now))
+    return max(0, -tokens / rate)
+
+def reserve(name, amount, rate, burst=None, dbpath=settings.ratelimitdbpath,
+    batch=settings.ratelimitbatch):
+    """ reserve
+
+        Reserve tokens from a shared bucket, spending this process's batch 
+        of tokens first. Once the batch runs out, a new batch of amount or
+        batch seconds of rate tokens, whichever is more, is reserved with
+        reserve_shared().
+
+        Arguments:
+            * name (str) : Bucket name, e.g. 'geocmds'.
+            * amount (float) : Number of tokens to reserve.
+            * rate (float) : Tokens added per second, or 0 for no limit.
+            * burst (float) : Bucket capacity, or None for one second of rate.
+            * dbpath (str) : Path to the SQLite rate limit db.
+            * batch (float) : Seconds of rate to reserve at a time, or 0 to
+                reserve only amount.
+
+        Returns:
+            * wait (float) : Seconds to wait before using the tokens.
+    """
+    if not rate or rate <= 0:
+        return 0
+    # keyed on pid, so a forked process does not spend its parent's batch
+    key = (os.getpid(), os.path.abspath(dbpath), name)
+    with _batchlock:
+        if _batches.get(key, (0, 0))[0] < amount:
+            size = max(amount, rate * batch)
+            wait = reserve_shared(name, size, rate, burst, dbpath)
+            _batches[key] = (size, time.time() + wait)
+        tokens, ready = _batches[key]
+        _batches[key] = (tokens - amount, ready)
+    return max(0, ready - time.time())
+
+def acquire(name, amount, rate, burst=None, dbpath=settings.ratelimitdbpath):
+    """ acquire
+
+        Reserve tokens from a shared bucket, and sleep until they are
+        available. Arguments are as for reserve().
+
+        Returns:
+            * wait (float) : Seconds waited.
+    """
+    wait = reserve(name, amount, rate, burst, dbpath)
+    if wait:
+        time.sleep(wait)
+    return wait
+
+def rate_limited(callback, name='geobytes', rate=settings.geobyterate,
+    chunk=1048576, sleep=time.sleep):
+    """ rate_limited
+
+        Wrap a block callback (e.g. for ftplib.FTP.retrbinary) so received
+        bytes are drawn from a shared bytes/sec bucket. Tokens are reserved
+        per chunk of bytes, rather than per block.
+
+        Arguments:
+            * callback (function) : Function called with each block.
+            * name (str) : Bucket name.
+            * rate (float) : Bytes per second, or 0 for no limit.
+            * chunk (int) : Bytes received between reservations.
+            * sleep (function) : Function called with the time to wait.
+
+        Returns:
+            * limited (function) : The wrapped callback.
+    """
+    if not rate or rate <= 0:
+        return callback
+    received = [0]
+    def limited(block):
+        callback(block)
+        received[0] += len(block)
+        if received[0] >= chunk:
+            wait = reserve(name, received[0], rate, max(rate, chunk))
+            received[0] = 0
+            if wait:
+                sleep(wait)
+    return limited
+
+def pid_alive(pid):
+    """ pid_alive
+
+        Check whether a process is running on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def try_lease(name, limit, dbpath=settings.ratelimitdbpath):
+    """ try_lease
+
+        Take a lease on one of a limited number of shared slots, e.g. open
+        FTP connections to GEO.
+
+        Arguments:
+            * name (str) : Lease name, e.g. 'geoftp'.
+            * limit (int) : Max leases held at once, or 0 for no limit.
+            * dbpath (str) : Path to the SQLite rate limit db.
+
+        Returns:
+            * leaseid (int) : Id of the new lease, 0 if there is no limit, or
+                None if all slots are taken.
+    """
+    if not limit or limit <= 0:
+        return 0
+    with transaction(dbpath) as conn:
+        held = conn.execute("SELECT id, pid FROM leases WHERE name = ?",
+            (name,)).fetchall()
+        stale = [(leaseid,) for leaseid, pid in held if not pid_alive(pid)]
+        if stale:
+            conn.executemany("DELETE FROM leases WHERE id = ?", stale)
+        leaseid = None
+        if len(held) - len(stale) < limit:
+            leaseid = conn.execute("INSERT INTO leases (name, pid, created)"
+                +" VALUES (?, ?, ?)", (name, os.getpid(), time.time())
+                ).lastrowid
+    return leaseid
+
+def acquire_lease(name, limit, interval=.5, dbpath=settings.ratelimitdbpath):
+    """ acquire_lease
+
+        Wait for and take a lease on one of a limited number of shared slots.
+
+        Arguments:
+            * name (str) : Lease name, e.g. 'geoftp'.
+            * limit (int) : Max leases held at once, or 0 for no limit.
+            * interval (float) : Seconds between checks for a free slot.
+            * dbpath (str) : Path to the SQLite rate limit db.
+
+        Returns:
+            * leaseid (int) : Id of the new lease, or 0 if there is no limit.
+    """
+    while True:
+        leaseid = try_lease(name, limit, dbpath)
+        if leaseid is not None:
+            return leaseid
+        time.sleep(interval)
+
+def release_lease(leaseid, dbpath=settings.ratelimitdbpath):
+    """ release_lease
+
+        Return a lease taken with try_lease() or acquire_lease().
+
+        Arguments:
+            * leaseid (int) : Id of the lease, or 0/None for no lease.
+            * dbpath (str) : Path to the SQLite rate limit db.
+
+        Returns:
+            * None, removes the lease as side effect.
+    """
+    if not leaseid:
+        return None
+    cached_connect(dbpath).execute("DELETE FROM leases WHERE id = ?", 
+        (leaseid,))
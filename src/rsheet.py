@@ -16,7 +16,7 @@
 import pymongo, sys, os, datetime, inspect, re, json
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 import settings; settings.init()
-from utilities import gettime_ntp, getlatest_filepath, get_queryfilt_dict
+from utilities import gettime_ntp, getlatest_filepath, get_queryfilt_gsmd
 
 
 def new_idat_hlinks(gsmid, ts, igrn_fn, ired_fn):
@@ -135,10 +135,8 @@ def compile_rsheet(gsmfpathdict):
     """
     timestamp = gettime_ntp()
     print("Getting equery filter...")
-    eqd = get_queryfilt_dict()
-    gsmvalidlist = list(set([gsmid for gselist in list(eqd.values()) 
-        for gsmid in gselist
-    ]))
+    gsmd = get_queryfilt_gsmd()
+    gsmvalidlist = set(gsmd)
     sheetspath = settings.sheetspath; sheetfn_ext = settings.sheetfnstem
     os.makedirs(sheetspath, exist_ok = True)
     sheets_fpath = os.path.join(sheetspath, ".".join([timestamp, sheetfn_ext]))
@@ -165,12 +163,7 @@ def compile_rsheet(gsmfpathdict):
                 and not fp==False]
             if gsmvalid_fp:
                 print("Getting GSE ID...")
-                gseid = ';'.join(list(set([gsek for gsek in list(eqd.keys()) 
-                            if gsmid in eqd[gsek]
-                            ]
-                        )      
-                    )
-                )
+                gseid = ';'.join(list(set(gsmd[gsmid])))
                 print("GSE id found: "+str(gseid))
                 gsm_fpaths = gsmvalid_fp
                 gsmi_redidatpath = [fp for fp in gsm_fpaths if "_Red.idat" in fp]
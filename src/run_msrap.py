@@ -27,7 +27,7 @@ sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 from utilities import gettime_ntp, getlatest_filepath, get_queryfilt_dict
 from utilities import monitor_processes; import settings; settings.init()
 
-def write_cjson(jffnv, ts = gettime_ntp(), newfilefn = "cjson",
+def write_cjson(jffnv, ts = None, newfilefn = "cjson",
     tempdname = "cjsontemp", jsonfiltpath = settings.gsmjsonfiltpath, 
     msrap_destpath = settings.gsmmsrapoutpath):
     """ write_cjson
@@ -41,12 +41,15 @@ def write_cjson(jffnv, ts = gettime_ntp(), newfilefn = "cjson",
         * jsonfiltpath : Path to filtered GSM JSON files (str).
         * tempdname : Name of dir, at jsonfiltpath, to contain composite 
             JSON files (str).
-        * ts : Timestamp of output and input files (int).
+        * ts : Timestamp of output and input files, or None for the current
+            one (str).
 
         Returns:
         * Path to new composite JSON file.
 
     """
+    if not ts:
+        ts = gettime_ntp()
     temppath_read = os.path.join(jsonfiltpath)
     if not os.path.exists(temppath_read):
         os.makedirs(temppath_read)
@@ -52,29 +52,33 @@ import subprocess, glob, sys, os, re
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 import edirect_query, settings; settings.init()
 from edirect_query import gsm_query, gse_query, gsequery_filter  
+from edirect_query import equery_diff, get_queued_filt, set_queued_filt
 from utilities import gettime_ntp, getlatest_filepath, querydict
 from utilities import get_queryfilt_dict
+from syncplan import plan_sync, format_plan, write_plan
 
 
 def firsttime_run(filedir='recount-methylation-files', 
-    run_timestamp=gettime_ntp()):
+    run_timestamp=None):
     """ firsttime_run
 
         On first setup, run new equeries and query filter.
     
         Arguments:
         * filedir (str): Dir name for db files. 
-        * run_timestamp (str) : NTP timestamp or function to retrieve it.
+        * run_timestamp (str) : NTP timestamp, or None for the current one.
     
         Returns:
         * gseidlist (list): List of valid GSE IDs.
     """
     print("Beginning first time server run...")
+    if not run_timestamp:
+        run_timestamp = gettime_ntp()
     equery_dest = settings.equerypath; temppath = settings.temppath
-    gse_query(); gsm_query()
+    gse_query(timestamp=run_timestamp); gsm_query(timestamp=run_timestamp)
     gseqfile = getlatest_filepath(equery_dest,'gse_edirectquery') 
     gsmqfile = getlatest_filepath(equery_dest,'gsm_edirectquery')
-    gsequery_filter()
+    gsequery_filter(timestamp=run_timestamp)
     gsefiltpath = getlatest_filepath(equery_dest,'gsequery_filt')
     if gsefiltpath:
         gsefiltd = querydict(querypath=gsefiltpath,splitdelim=' ')
@@ -86,44 +90,67 @@ def firsttime_run(filedir='recount-methylation-files',
         return None
     return None
 
-def scheduled_run(eqfilt_path=False, run_timestamp=gettime_ntp()):
+def scheduled_run(eqfilt_path=False, run_timestamp=None):
     """ scheduled_run
 
         Tasks performed on regular schedule, after first setup. For the job 
         queue, a list of GSE IDs is returned. The id list is filtered on 
         existing GSE soft files to prioritize unrepresented experiments for 
-        download. 
+        download. If an earlier run queued GSE IDs, GSE IDs added or with 
+        added or removed GSM IDs since its filter file are also returned.
 
         Arguments:
         * eqfilt_path (str) : Filepath to edirect query filter file.
         * filedir (str) : Root name of files directory.
-        * run_timestamp (str) : NTP timestamp or function to retrieve it.
+        * run_timestamp (str) : NTP timestamp, or None for the current one.
         
         Returns:
         * gse_list (list) : list of valid GSE IDs, or None if error occurs 
     """
+    eqpath = settings.equerypath
     try:
         gsefiltd = get_queryfilt_dict()
     except:
         print("No gse query filt file found, checking for GSE and GSM "
             +"queries...")
+        if not run_timestamp:
+            run_timestamp = gettime_ntp()
         gsequery_latest = getlatest_filepath(filepath=eqpath,
             filestr='gse_edirectquery')
         if not gsequery_latest:
-            gse_query()
+            gse_query(timestamp=run_timestamp)
         gsmquery_latest = getlatest_filepath(eqpath,'gsm_edirectquery')
         if not gsmquery_latest:
-            gsm_query()
+            gsm_query(timestamp=run_timestamp)
         print("Running filter on GSE query...")
-        gsequery_filter(); gsefiltd = get_queryfilt_dict()
+        gsequery_filter(timestamp=run_timestamp)
+        gsefiltd = get_queryfilt_dict()
     # get list of GSE IDs from existing SOFT files
     gsesoftfiles = os.listdir(settings.gsesoftpath)
     print("GSE SOFT files: " + str(gsesoftfiles));rxgse=re.compile('GSE[0-9]*')
-    gseid_softexists = [str(rxgse.findall(softfn)[0]) for softfn in gsesoftfiles
-        if rxgse.findall(softfn)]
+    gseid_softexists = set(str(rxgse.findall(softfn)[0]) 
+        for softfn in gsesoftfiles if rxgse.findall(softfn))
     if gsefiltd:
         gseid_listall = list(gsefiltd.keys())
         print("GSE ID list of len "+str(len(gseid_listall)) + " found. Filtering..")
+        filtpath_queued = get_queued_filt(settings.equerydbpath)
+        if filtpath_queued and os.path.exists(filtpath_queued):
+            diff = equery_diff(querydict(querypath=filtpath_queued, 
+                splitdelim=' '), gsefiltd)
+            print("Since last queued filter file "+filtpath_queued+": "
+                +str(len(diff['added']))+" GSE IDs added, "
+                +str(len(diff['removed']))+" removed, "
+                +str(len(diff['changed']))+" with changed GSM IDs ("
+                +str(sum(len(d['added']) for d in diff['changed'].values()))
+                +" GSM IDs added, "
+                +str(sum(len(d['removed']) for d in diff['changed'].values()))
+                +" removed).")
+            gseid_changed = set(diff['added']) | set(diff['changed'])
+            gseid_filt = [gseid for gseid in gseid_listall
+                if gseid in gseid_changed or not gseid in gseid_softexists]
+            print("N = "+str(len(gseid_filt))+" GSE IDs are changed or lack"
+                +" SOFT files. Returning ID list...")
+            return gseid_filt
         if gseid_softexists and len(gseid_softexists)>0:
             gseid_filt = [gseid for gseid in gseid_listall
                 if not gseid in gseid_softexists]
@@ -139,6 +166,31 @@ def scheduled_run(eqfilt_path=False, run_timestamp=gettime_ntp()):
         print("Error forming equery filt dictionary. Returning...")
         return None
 
+def plan_run(gse_list, gsefiltd=None, run_timestamp=None):
+    """ plan_run
+
+        Dry run of a sync of the GSE IDs from scheduled_run. Writes the files 
+        to fetch to a table, and prints their total bytes and estimated 
+        duration. Nothing is downloaded or queued.
+
+        Arguments:
+        * gse_list (list) : GSE IDs to plan, as from scheduled_run.
+        * gsefiltd (dict) : GSE filtered query, or None to read the latest.
+        * run_timestamp (str) : NTP timestamp for the plan filename.
+
+        Returns:
+        * plan (dict) : Sync plan, as from syncplan.plan_sync.
+    """
+    if not run_timestamp:
+        run_timestamp = gettime_ntp()
+    plan = plan_sync(gse_list=gse_list, gsefiltd=gsefiltd)
+    planpath = os.path.join(settings.filesdir, 
+        '.'.join(['syncplan', str(run_timestamp), 'tsv']))
+    write_plan(plan, planpath)
+    print(format_plan(plan))
+    print("Wrote sync plan to "+planpath)
+    return plan
+
 if __name__ == "__main__":
     """ Recount-methylation sever server.py main
         
@@ -161,12 +213,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Arguments for server.py')
     parser.add_argument("--gseid", type=str, required=False, default=None, 
         help='Option to enter valid GSE ID for immediate download.')
+    parser.add_argument("--plan", action="store_true", 
+        help='Dry run: write the files to fetch, bytes, and duration.')
     args = parser.parse_args()
     # For the job queue, either from provided argument or automation
     if args.gseid:
         print("Provided GSE ID detected. Processing...")
         gqd = get_queryfilt_dict()
-        qstatlist.append(gse_task(gse_id = args.gseid, gsefiltdict=gqd, 
+        qstatlist.append(gse_task(gse_id = args.gseid, 
+                gsefiltdict={args.gseid : list(gqd.get(args.gseid, []))}, 
                 timestamp = run_timestamp))
     else:
         print("No GSE ID(s) provided. Forming ID list for job queue...")
@@ -183,14 +238,24 @@ if __name__ == "__main__":
                 +"running firsttime_run...")
             os.makedirs(files_dir, exist_ok=True)
             gselist = firsttime_run(run_timestamp=run_timestamp)
-        if gselist:
+        if gselist and args.plan:
+            print("Planning sync for GSE ID list of "+str(len(gselist))
+                +" studies...")
+            plan_run(gselist, run_timestamp=run_timestamp)
+        elif gselist:
             print("Shuffling GSE ID list...")
             shuffle(gselist) # randomize GSE ID order
             print("Beginning job queue for GSE ID list of "+str(len(gselist))
                 +" samples...")
             gqd = get_queryfilt_dict() # one eqfilt call for all jobs this run
             for gse in gselist:
-                qstatlist.append(gse_task(gse_id=gse, gsefiltdict=gqd, 
-                    timestamp=run_timestamp))    
+                # a plain dict of the task's GSE, as gqd may be an IdMap
+                qstatlist.append(gse_task(gse_id=gse, gsefiltdict={gse : 
+                    list(gqd.get(gse, []))}, timestamp=run_timestamp))
+            set_queued_filt(getlatest_filepath(settings.equerypath, 
+                'gsequery_filt', embeddedpattern=True, tslocindex=1, 
+                returntype='returnlist')[0], settings.equerydbpath)
+        elif gselist == []:
+            print("No new or changed GSE IDs. Nothing to queue.")
         else:
             print("Error: valid gselist absent. Returning...")
\ No newline at end of file
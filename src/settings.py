@@ -127,6 +127,121 @@ def init():
     rmdbhost = 'localhost'
     rmdbport = 27017
 
+    # [downloads]
+    global ftphost
+    global ftpport
+    global ftpnconn
+    global ftpmlsd
+    global dlengine
+    global dlexpand
+    global dlvalidation
+    global dlaimd
+    global dlmaxconn
+    global aimdinterval
+    global aimdgain
+    global dlhedge
+    global hedgepercentile
+    global hedgedelay
+    global hedgeminpeers
+    global dlprefetch
+    global prefetchconn
+    global dlblocksize
+    global dlpreallocate
+    global geomirror
+    ftphost = 'ftp.ncbi.nlm.nih.gov'
+    ftpport = 21
+    ftpnconn = 4
+    ftpmlsd = True # list dirs with MLSD, falling back to NLST and MDTM
+    dlengine = 'ftplib' # download engine, either 'ftplib' or 'asyncio'
+    dlexpand = False # expand idats while downloading
+    dlvalidation = 'hash' # 'hash' or 'stat' (skip unchanged size/date/stat)
+    dlaimd = False # adapt concurrent downloads from ftpnconn up to dlmaxconn
+    dlmaxconn = 16 # max concurrent downloads per worker, with dlaimd
+    aimdinterval = 2.0 # seconds per aimd throughput window
+    aimdgain = .05 # min throughput gain per window to add a download
+    dlhedge = False # duplicate idat transfers much slower than their peers
+    hedgepercentile = 10 # peer rate percentile below which to hedge
+    hedgedelay = 2.0 # seconds a transfer runs before it can be hedged
+    hedgeminpeers = 5 # completed transfers needed before hedging
+    dlprefetch = 16 # GSMs listed ahead of idat transfers (0 for none)
+    prefetchconn = 1 # sessions listing ahead, added to ftpnconn
+    dlblocksize = 1048576 # bytes per transfer read and write (ftplib: 8192)
+    dlpreallocate = True # reserve disk blocks for downloads from their SIZE
+    geomirror = '' # endpoint URL for GEO files ('' for ftp at ftphost)
+    global hashdbfn
+    global hashdbpath
+    global objectsdir
+    global objectspath
+    hashdbfn = 'filehash.db'
+    hashdbpath = os.path.join(filesdir, hashdbfn)
+    objectsdir = 'objects' # content-addressed idat store
+    objectspath = os.path.join(filesdir, objectsdir)
+    global ratelimitdbfn
+    global ratelimitdbpath
+    global geomaxconn
+    global geocmdrate
+    global geobyterate
+    global ratelimitbatch
+    global eutilsrate
+    global eutilsurl
+    global eutilsapikey
+    global eutilsretmax
+    global eutilsnconn
+    global equeryincremental
+    global equerydatetype
+    global equeryfullage
+    global equerydbfn
+    global equerydbpath
+    ratelimitdbfn = 'ratelimit.db' # shared by all workers on the host
+    ratelimitdbpath = os.path.join(filesdir, ratelimitdbfn)
+    geomaxconn = 8 # max open ftp connections to GEO, host-wide (0 for none)
+    geocmdrate = 0 # max ftp commands/sec to GEO, host-wide (0 for none;
+    # NCBI documents no ftp command rate, only geomaxconn applies)
+    geobyterate = 0 # max bytes/sec from GEO, host-wide (0 for none)
+    ratelimitbatch = 0.2 # seconds of rate each process reserves at a time
+    eutilsrate = 3 # max edirect queries/sec, host-wide (0 for none)
+    eutilsurl = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils' # base URL
+    eutilsapikey = '' # NCBI API key, allowing eutilsrate up to 10
+    eutilsretmax = 500 # docsums per esummary page
+    eutilsnconn = 3 # concurrent esummary page requests
+    equeryincremental = True # query only records dated since the last query
+    equerydatetype = 'mdat' # record date for incremental queries
+    equeryfullage = 604800 # max seconds between full queries
+    equerydbfn = 'equery.db' # times of the last edirect queries
+    equerydbpath = os.path.join(filesdir, equerydbfn)
+    global journaldbfn
+    global journaldbpath
+    journaldbfn = 'dljournal.db' # per-file download states of gse tasks
+    journaldbpath = os.path.join(filesdir, journaldbfn)
+    global listcache
+    global listcachedbfn
+    global listcachedbpath
+    global listcachettl
+    global listcachemaxttl
+    global listcacheagefrac
+    listcache = True # reuse cached GEO dir listings within their TTL
+    listcachedbfn = 'listcache.db'
+    listcachedbpath = os.path.join(filesdir, listcachedbfn)
+    listcachettl = 86400 # base listing TTL, in seconds
+    listcachemaxttl = 2592000 # max listing TTL, in seconds
+    listcacheagefrac = .1 # fraction of newest file age added to listing TTL
+    global throughputdbfn
+    global throughputdbpath
+    global throughputruns
+    throughputdbfn = 'throughput.db' # measured download throughput
+    throughputdbpath = os.path.join(filesdir, throughputdbfn)
+    throughputruns = 20 # recent download runs pooled for sync estimates
+    global dlclaim
+    global claimdbfn
+    global claimdbpath
+    global claimpoll
+    global claimttl
+    dlclaim = True # download GSMs shared by GSE tasks once per run
+    claimdbfn = 'gsmclaim.db' # host-wide GSM claims of gse tasks
+    claimdbpath = os.path.join(filesdir, claimdbfn)
+    claimpoll = 2.0 # seconds between checks on GSMs claimed by other tasks
+    claimttl = 604800 # seconds to keep GSM claims and results
+
     # [resource paths]
     global mongoconnpath
     global mongodbpath
@@ -156,6 +271,7 @@ def init():
     global msrapoutfnpattern
     global gsequerystr
     global gsmquerystr
+    global gsemapstr
     global grnidat_expcatch
     global redidat_expcatch
     gsepatt = '^GSE.*'
@@ -166,5 +282,20 @@ def init():
     msrapoutfnpattern = '.*\.msrapout$'
     gsequerystr = 'gse_edirectquery' 
     gsmquerystr = 'gsm_edirectquery'
+    gsemapstr = 'gsequery_map' # binary GSE/GSM maps of gsequery_filt files
     grnidat_expcatch = '.*_Grn\.idat$'
     redidat_expcatch = '.*_Red\.idat$'
+
+    # [timestamps]
+    global ntphost
+    global ntptimeout
+    global ntpsyncttl
+    global ntpretry
+    global ntpcachefn
+    global ntpcachepath
+    ntphost = 'time.nist.gov'
+    ntptimeout = 2 # seconds to wait on an NTP reply
+    ntpsyncttl = 86400 # seconds a clock offset is used before a new NTP sync
+    ntpretry = 300 # seconds before a failed NTP sync is retried
+    ntpcachefn = 'ntpoffset.json' # clock offset shared by processes on host
+    ntpcachepath = os.path.join(filesdir, ntpcachefn)
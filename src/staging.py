@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+""" staging.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Staging of new downloads on the filesystem of their destination, with
+    preallocated disk blocks and an atomic rename on commit.
+
+    Notes:
+        * Downloads are staged in 'settings.temppath' when it shares a
+            filesystem with the destination dir, or else in a hidden
+            '.staging' dir inside the destination, so committing a validated
+            file is a rename rather than a copy.
+        * commit_file() moves a staged file into place with os.replace, so a
+            partial file is never visible at the destination path. A file on
+            another filesystem (e.g. a temp dir passed in) is first copied to
+            a hidden file next to the destination, then renamed.
+        * With 'settings.dlpreallocate', disk blocks for a new download are
+            reserved from its remote size before the transfer, with
+            fallocate(FALLOC_FL_KEEP_SIZE) where available (Linux). The
+            apparent file size is unchanged, as partial downloads resume with
+            REST from the local file size.
+
+    Functions:
+        * staging_dir: Get a staging dir on the filesystem of a destination.
+        * preallocate: Reserve disk blocks for a file being downloaded.
+        * commit_file: Atomically move a staged file to its destination.
+"""
+
+import os, sys, errno, shutil, ctypes
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+FALLOC_FL_KEEP_SIZE = 1
+_fallocate = None
+
+def staging_dir(destpath, temppath=settings.temppath):
+    """ staging_dir
+
+        Get a dir for staging downloads on the filesystem of destpath.
+
+        Arguments:
+            * destpath (str) : Destination dir of the downloads.
+            * temppath (str) : Preferred staging dir.
+
+        Returns:
+            * stagepath (str) : temppath if it is on the filesystem of
+                destpath, or else a '.staging' dir inside destpath.
+    """
+    os.makedirs(destpath, exist_ok=True)
+    os.makedirs(temppath, exist_ok=True)
+    if os.stat(temppath).st_dev == os.stat(destpath).st_dev:
+        return temppath
+    stagepath = os.path.join(destpath, '.staging')
+    os.makedirs(stagepath, exist_ok=True)
+    return stagepath
+
+def preallocate(output_stream, size):
+    """ preallocate
+
+        Reserve disk blocks from the current end of an open file up to size
+        bytes, without changing the file size, so a download is written to
+        contiguous blocks and fails early on a full disk.
+
+        Arguments:
+            * output_stream (file) : File open for writing, at its end.
+            * size (int) : Expected final size of the file, or None.
+
+        Returns:
+            * reserved (Bool.) : Whether blocks were reserved. Raises OSError
+                if the disk is full.
+    """
+    global _fallocate
+    if not settings.dlpreallocate or not size:
+        return False
+    if _fallocate is None:
+        try:
+            _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+            _fallocate.argtypes = [ctypes.c_int, ctypes.c_int,
+                ctypes.c_int64, ctypes.c_int64]
+        except (OSError, AttributeError):
+            _fallocate = False
+    offset = output_stream.tell()
+    if not _fallocate or size <= offset:
+        return False
+    if _fallocate(output_stream.fileno(), FALLOC_FL_KEEP_SIZE, offset,
+        size - offset) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err == errno.ENOSPC:
+        raise OSError(err, os.strerror(err), output_stream.name)
+    # e.g. EOPNOTSUPP on filesystems without fallocate
+    return False
+
+def commit_file(stagedpath, destpath):
+    """ commit_file
+
+        Move a staged file to its destination path with an atomic rename,
+        copying it to the destination filesystem first if needed.
+
+        Arguments:
+            * stagedpath (str) : Path of the staged file.
+            * destpath (str) : Destination file path.
+
+        Returns:
+            * destpath (str) : Destination file path.
+    """
+    try:
+        os.replace(stagedpath, destpath)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        partpath = os.path.join(os.path.dirname(destpath),
+            '.'+os.path.basename(destpath)+'.part')
+        shutil.copy2(stagedpath, partpath)
+        os.replace(partpath, destpath)
+        os.remove(stagedpath)
+    return destpath
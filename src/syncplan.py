@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+""" syncplan.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Dry-run planner for scheduled syncs. Lists the files a run would fetch,
+    their total bytes, and an estimated duration, without downloading.
+
+    Notes:
+        * The plan combines the equery filter (GSE IDs and their GSM IDs),
+            RMDB state (stored file dates, from dl.rmdb_dates), and remote
+            directory listings. Files to fetch are the remote (file, date)
+            pairs not in the stored (file, date) pairs, a set difference, as
+            checked one file at a time by dl_idat and dl_soft.
+        * Listings come from the listing cache (listcache.py) in one pass.
+            Only directories with missing or expired entries are listed over
+            FTP, one MLSD per directory, and the new listings are cached. With
+            listremote=False, such directories are reported as unlisted.
+        * Files listed without a date (NLST, where the server has no MLSD)
+            are reported as 'date unknown', apart from the files to fetch,
+            as dl_idat and dl_soft may find them unchanged.
+        * Durations are estimated from the throughput measured over recent
+            download runs (throughput.py), separately for idats and soft
+            files, as the larger of bytes over bytes/sec and files over
+            files/sec.
+        * Run from server.py with '--plan', e.g. 'python3 server.py --plan'.
+
+    Functions:
+        * list_dirs: List directories over a pool of FTP sessions, caching
+            the listings.
+        * plan_sync: Plan the files to fetch for a list of GSE IDs.
+        * format_plan: Summarize a sync plan.
+        * write_plan: Write the files of a sync plan to a table.
+"""
+
+import os, sys, ftplib
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from dl import rmdb_dates, ftp_listdir
+from ftppool import FTPPool, pool_map
+from listcache import get_cached_listings, set_cached_listing
+from throughput import measured_throughput
+from transport import gsm_suppl_dir, gse_soft_dir
+from utilities import get_queryfilt_dict
+
+def list_dirs(dirpaths, nconn=settings.ftpnconn):
+    """ list_dirs
+
+        List directories concurrently over a pool of FTP sessions, and store
+        the listings in the listing cache.
+
+        Arguments:
+            * dirpaths (list) : FTP addresses of the directories.
+            * nconn (int) : Size of the FTP session pool.
+
+        Returns:
+            * listings (dict) : Listings, as from dl.ftp_listdir(), keyed on
+                dirpath. Directories that could not be listed are left out,
+                and missing directories are listed as empty.
+    """
+    def list_dir(dirpath, pool):
+        try:
+            with pool.connection() as ftp:
+                listing = ftp_listdir(ftp, dirpath)
+        except ftplib.error_perm:
+            return {}
+        except ftplib.all_errors as e:
+            print('error listing '+dirpath+': '+str(e))
+            return None
+        set_cached_listing(dirpath, listing)
+        return listing
+    dirpaths = list(dirpaths)
+    pool = FTPPool(nconn=nconn, host=settings.ftphost, port=settings.ftpport,
+        mirror=settings.geomirror)
+    try:
+        results = pool_map(list_dir, dirpaths, pool)
+    finally:
+        pool.close()
+    return {dirpath : listing for dirpath, listing in zip(dirpaths, results)
+        if listing is not None}
+
+def plan_sync(gse_list=None, gsefiltd=None, datemap=None, listremote=True,
+    nconn=settings.ftpnconn):
+    """ plan_sync
+
+        Plan the files a sync of a list of GSE IDs would fetch, with their
+        total bytes and an estimated duration. Nothing is downloaded.
+
+        Arguments:
+            * gse_list (list) : GSE IDs to sync, or None for all GSE IDs in
+                gsefiltd.
+            * gsefiltd (dict) : GSM IDs by GSE ID, as from
+                utilities.get_queryfilt_dict(), or None to read the latest
+                equery filter file.
+            * datemap (dict) : Stored RMDB dates by file ftp address, as from
+                dl.rmdb_dates(), or None to query RMDB.
+            * listremote (Bool.) : Whether to list directories missing from,
+                or expired in, the listing cache.
+            * nconn (int) : Number of FTP sessions for listing.
+
+        Returns:
+            * plan (dict) : Plan with 'files' (tuples of ID, file ftp address,
+                size or None, date, and 'idat' or 'soft'), 'undated' (files
+                of unknown date, as tuples of ID, file ftp address, size or
+                None, None, and type), 'gse_list' (GSE IDs with files to 
+                fetch), 'unlisted' (directories not listed), 'nbytes', 
+                'nunknown' (files to fetch of unknown size), 'rates'
+                (measured bytes/sec and files/sec by file type), and 
+                'seconds' (estimated duration, or None if not measured).
+                Undated files are not counted in 'nbytes' or 'seconds'.
+    """
+    if gsefiltd is None:
+        gsefiltd = get_queryfilt_dict()
+    gse_list = list(gsefiltd.keys()) if gse_list is None else list(gse_list)
+    gse_of = {}
+    for gse in gse_list:
+        for gsm_id in gsefiltd.get(gse, []):
+            gse_of.setdefault(gsm_id, gse)
+    dirs = {gsm_suppl_dir(gsm_id) : gsm_id for gsm_id in gse_of}
+    dirs.update({gse_soft_dir(gse) : gse for gse in gse_list})
+    listings = {dirpath : listing for dirpath, (listing, state) in
+        get_cached_listings(dirs.keys()).items() if state != 'expired'}
+    tolist = dirs.keys() - listings.keys()
+    print('found cached listings for '+str(len(listings))+' of '
+        +str(len(dirs))+' dirs')
+    if tolist and listremote:
+        print('listing '+str(len(tolist))+' dirs...')
+        listings.update(list_dirs(tolist, nconn))
+    # remote (file, date) pairs, as dl_idat_gsm and dl_soft_gse see them
+    remote = {}
+    for dirpath, listing in listings.items():
+        id = dirs[dirpath]
+        if id.startswith('GSM'):
+            kind, files = 'idat', list(listing.keys())
+        else:
+            kind, files = 'soft', [file for file in listing
+                if 'family.soft' in file][:1]
+        for file in files:
+            remote[(file, listing[file]['modify'])] = (id,
+                listing[file]['size'], kind)
+    if datemap is None:
+        datemap = rmdb_dates(gsm_list=list(gse_of), gse_list=gse_list)
+    stored = {(file, date) for file, dates in datemap.items()
+        for date in dates}
+    fetch = sorted(remote.keys() - stored, key=lambda key: key[0])
+    files = [(remote[key][0], key[0], remote[key][1], key[1], remote[key][2])
+        for key in fetch if key[1] is not None]
+    undated = [(remote[key][0], key[0], remote[key][1], None, remote[key][2])
+        for key in fetch if key[1] is None]
+    plan = {'files' : files, 'undated' : undated, 
+        'unlisted' : sorted(tolist - listings.keys()),
+        'nbytes' : sum(file[2] for file in files if file[2]),
+        'nunknown' : sum(1 for file in files if file[2] is None),
+        'rates' : {}, 'seconds' : 0}
+    plan['gse_list'] = sorted({gse_of.get(file[0], file[0])
+        for file in files})
+    for kind in ('idat', 'soft'):
+        kindfiles = [file for file in files if file[4] == kind]
+        if not kindfiles:
+            continue
+        byterate, filerate = measured_throughput(kind)
+        plan['rates'][kind] = (byterate, filerate)
+        if byterate is None or plan['seconds'] is None:
+            plan['seconds'] = None
+            continue
+        plan['seconds'] += max(sum(file[2] or 0 for file in kindfiles)
+            / byterate, len(kindfiles) / filerate)
+    return plan
+
+def format_plan(plan):
+    """ format_plan
+
+        Summarize a sync plan, as from plan_sync().
+
+        Arguments:
+            * plan (dict) : Sync plan.
+
+        Returns:
+            * summary (str) : Files, bytes, and estimated duration.
+    """
+    lines = ['files to fetch: '+str(len(plan['files']))+' ('
+        +str(sum(1 for file in plan['files'] if file[4] == 'idat'))
+        +' idat, '+str(sum(1 for file in plan['files'] if file[4] == 'soft'))
+        +' soft) in '+str(len(plan['gse_list']))+' GSE IDs',
+        'total bytes: '+str(plan['nbytes'])+' ('+'%.2f' % (plan['nbytes']
+            / 1e9)+' GB)'+(', plus '+str(plan['nunknown'])
+            +' files of unknown size' if plan['nunknown'] else '')]
+    for kind, (byterate, filerate) in sorted(plan['rates'].items()):
+        if byterate is None:
+            lines.append(kind+' throughput: not measured')
+        else:
+            lines.append(kind+' throughput: '+'%.2f' % (byterate / 1e6)
+                +' MB/s, '+'%.1f' % filerate+' files/s')
+    if plan['seconds'] is None:
+        lines.append('estimated duration: unknown, no throughput measured')
+    else:
+        lines.append('estimated duration: '+'%.1f' % (plan['seconds'] / 3600)
+            +' hours ('+'%.0f' % plan['seconds']+' s)')
+    if plan['undated']:
+        lines.append('files of unknown date (no MLSD), not counted above: '
+            +str(len(plan['undated'])))
+    if plan['unlisted']:
+        lines.append('dirs not listed: '+str(len(plan['unlisted'])))
+    return '\n'.join(lines)
+
+def write_plan(plan, planpath):
+    """ write_plan
+
+        Write the files of a sync plan as a tab-delimited table, with columns
+        for ID, file type, ftp address, size, and date. Files of unknown
+        date follow the files to fetch, with an empty date.
+
+        Arguments:
+            * plan (dict) : Sync plan, as from plan_sync().
+            * planpath (str) : Path of the table to write.
+
+        Returns:
+            * None, writes the table as side effect.
+    """
+    with open(planpath, 'w') as planfile:
+        planfile.write('\t'.join(['id', 'type', 'ftpaddress', 'size', 'date'])
+            +'\n')
+        for id, file, size, date, kind in plan['files'] + plan['undated']:
+            planfile.write('\t'.join([id, kind, file, '' if size is None
+                else str(size), date.strftime('%Y%m%d%H%M%S') if date else ''])
+                +'\n')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+""" throughput.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Log of measured download throughput, for estimating the duration of
+    planned syncs (see syncplan.py).
+
+    Notes:
+        * The log is a SQLite db at 'settings.throughputdbpath', with one row
+            per download call (dl_idat, dl_soft, or their async versions)
+            giving the files and bytes written and the seconds taken.
+        * Measured throughput is pooled over the last 'settings.throughputruns'
+            runs of a kind, as total bytes (or files) over total seconds.
+
+    Functions:
+        * throughput_connect: Connect to the throughput log.
+        * record_throughput: Log the files, bytes, and seconds of a download
+            run.
+        * measured_throughput: Get bytes/sec and files/sec over recent runs.
+"""
+
+import os, sys, time, sqlite3
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+
+def throughput_connect(dbpath=settings.throughputdbpath):
+    """ throughput_connect
+
+        Connect to the throughput log, creating it if needed.
+
+        Arguments:
+            * dbpath (str) : Path to the SQLite throughput log.
+
+        Returns:
+            * conn (sqlite3.Connection) : Connection to the throughput log.
+    """
+    os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+    conn = sqlite3.connect(dbpath, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS runs (time REAL, kind TEXT,"
+        +" nfiles INTEGER, nbytes INTEGER, seconds REAL)")
+    return conn
+
+def record_throughput(kind, nfiles, nbytes, seconds,
+    dbpath=settings.throughputdbpath):
+    """ record_throughput
+
+        Log the files and bytes written by a download run, and its duration.
+        Runs that wrote no files are not logged.
+
+        Arguments:
+            * kind (str) : Type of files downloaded, 'idat' or 'soft'.
+            * nfiles (int) : Number of files written.
+            * nbytes (int) : Number of bytes written.
+            * seconds (float) : Duration of the run.
+            * dbpath (str) : Path to the SQLite throughput log.
+
+        Returns:
+            * None, updates the throughput log as side effect.
+    """
+    if not nfiles:
+        return
+    conn = throughput_connect(dbpath)
+    try:
+        with conn:
+            conn.execute("INSERT INTO runs (time, kind, nfiles, nbytes,"
+                +" seconds) VALUES (?, ?, ?, ?, ?)", (time.time(), kind,
+                nfiles, nbytes, seconds))
+    finally:
+        conn.close()
+
+def measured_throughput(kind, nruns=settings.throughputruns,
+    dbpath=settings.throughputdbpath):
+    """ measured_throughput
+
+        Get throughput pooled over the most recent runs of a kind.
+
+        Arguments:
+            * kind (str) : Type of files downloaded, 'idat' or 'soft'.
+            * nruns (int) : Number of recent runs to pool.
+            * dbpath (str) : Path to the SQLite throughput log.
+
+        Returns:
+            * byterate (float) : Bytes/sec, or None if no runs are logged.
+            * filerate (float) : Files/sec, or None if no runs are logged.
+    """
+    conn = throughput_connect(dbpath)
+    try:
+        row = conn.execute("SELECT SUM(nfiles), SUM(nbytes), SUM(seconds)"
+            +" FROM (SELECT * FROM runs WHERE kind = ? ORDER BY time DESC"
+            +" LIMIT ?)", (kind, nruns)).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[2]:
+        return None, None
+    return row[1] / row[2], row[0] / row[2]
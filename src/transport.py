@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+""" transport.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Endpoints serving the GEO file tree: the GEO FTP server, GEO (or another
+    mirror) over HTTPS, or a local mirror dir. The endpoint is set by
+    'settings.geomirror', as a URL, or left empty for FTP at
+    'settings.ftphost'.
+
+    Notes:
+        * All endpoints serve the GEO tree layout, e.g.
+            'geo/samples/GSM1000nnn/GSM1000001/suppl/', with dir paths from
+            gsm_suppl_dir() and gse_soft_dir().
+        * HTTP(S) and local sessions implement the subset of ftplib.FTP used
+            by dl.py (MLSD and NLST listings, MDTM and SIZE, RETR with REST),
+            and raise ftplib exceptions, so retries, resume, listing cache,
+            hedging, and validation work unchanged on any endpoint.
+        * HTTP(S) sessions keep one persistent connection (keep-alive), list
+            dirs from the server's HTML index with sizes and dates from HEAD
+            requests, and resume with Range requests. They draw on the same
+            host-wide GEO limits as FTP sessions (ratelimit.py).
+        * Local sessions read files from a dir with the GEO layout, e.g. an
+            on-site mirror or an export of the stand-in tree (geostandin.py),
+            at disk speed and without GEO limits. Dates are file mtimes, in
+            UTC. A large re-sync can read from the mirror, so later runs
+            against GEO fetch only files changed since.
+
+    Classes and Functions:
+        * gsm_suppl_dir: Get the dir path of a GSM ID's supplementary files.
+        * gse_soft_dir: Get the dir path of a GSE ID's soft files.
+        * is_remote: Check whether an endpoint draws on GEO limits.
+        * MirrorSession: ftplib.FTP-like session over a non-FTP endpoint.
+        * LocalSession: Session reading a local mirror dir.
+        * HTTPSession: Session over a keep-alive HTTP(S) connection.
+        * open_session: Open a session for an endpoint URL.
+"""
+
+import os, sys, re, ftplib, datetime, socket, email.utils, http.client
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit, quote, unquote
+sys.path.insert(0, os.path.join("recountmethylation_server","src"))
+import settings
+settings.init()
+from ratelimit import acquire, rate_limited, release_lease
+
+def gsm_suppl_dir(gsm_id):
+    """ gsm_suppl_dir
+
+        Get the path of the supplementary files dir of a GSM ID, e.g.
+        'geo/samples/GSM1000nnn/GSM1000001/suppl/'.
+    """
+    return '/'.join(['geo', 'samples', gsm_id[:-3] + 'nnn', gsm_id,
+        'suppl'])+'/'
+
+def gse_soft_dir(gse):
+    """ gse_soft_dir
+
+        Get the path of the soft files dir of a GSE ID, e.g.
+        'geo/series/GSE100nnn/GSE100001/soft/'.
+    """
+    return '/'.join(['geo', 'series', gse[:-3] + 'nnn', gse, 'soft'])+'/'
+
+def is_remote(mirror):
+    """ is_remote
+
+        Check whether an endpoint is a remote server, whose connections,
+        commands, and bytes draw on the host-wide GEO limits.
+
+        Arguments:
+            * mirror (str) : Endpoint URL, or '' for the GEO FTP server.
+
+        Returns:
+            * remote (Bool.) : False for a local mirror, True otherwise.
+    """
+    return not mirror or not urlsplit(mirror).scheme in ('', 'file')
+
+class MirrorSession(ABC):
+    """ MirrorSession
+
+        Session over a non-FTP endpoint, with the ftplib.FTP methods used by
+        dl.py. Subclasses implement the abstract methods stat(), 
+        listnames(), and open_read().
+        'sock' is None once the session is closed, as for ftplib.FTP.
+    """
+    controller = None
+    nomlsd = False
+    remote = True
+
+    def __init__(self, leaseid=None):
+        self.leaseid = leaseid
+        self.sock = True
+        self.aborted = False
+
+    @abstractmethod
+    def stat(self, path):
+        """ stat
+
+            Get the size (int) and modification time (datetime, UTC) of a
+            file, raising ftplib.error_perm if it does not exist.
+        """
+
+    @abstractmethod
+    def listnames(self, dirpath):
+        """ listnames
+
+            List file names in a dir, raising ftplib.error_perm if it does
+            not exist.
+        """
+
+    @abstractmethod
+    def open_read(self, path, rest=0):
+        """ open_read
+
+            Open a file for reading from byte rest, returning an object with
+            readinto() and close().
+        """
+
+    def sendcmd(self, cmd):
+        """ sendcmd
+
+            Answer an FTP command (MDTM, SIZE, TYPE, NOOP) with an FTP reply.
+        """
+        verb, _, arg = cmd.partition(' ')
+        verb = verb.upper()
+        if verb in ('TYPE', 'NOOP'):
+            return '200 OK'
+        if verb == 'MDTM':
+            return '213 '+self.stat(arg)[1].strftime('%Y%m%d%H%M%S')
+        if verb == 'SIZE':
+            return '213 '+str(self.stat(arg)[0])
+        raise ftplib.error_perm('502 Command not implemented: '+verb)
+
+    def voidcmd(self, cmd):
+        return self.sendcmd(cmd)
+
+    def size(self, path):
+        return int(self.sendcmd('SIZE '+path)[4:])
+
+    def nlst(self, dirpath):
+        prefix = dirpath.strip('/')
+        return [prefix+'/'+name for name in self.listnames(dirpath)]
+
+    def retrlines(self, cmd, callback):
+        """ retrlines
+
+            Answer an MLSD or NLST command, passing each line to callback.
+        """
+        verb, _, dirpath = cmd.partition(' ')
+        if verb.upper() == 'NLST':
+            lines = self.nlst(dirpath)
+        elif verb.upper() == 'MLSD':
+            lines = []
+            for name in self.listnames(dirpath):
+                size, modify = self.stat(dirpath.rstrip('/')+'/'+name)
+                lines.append('type=file;size='+str(size)+';modify='
+                    +modify.strftime('%Y%m%d%H%M%S')+'; '+name)
+        else:
+            raise ftplib.error_perm('502 Command not implemented: '+verb)
+        for line in lines:
+            callback(line)
+        return '226 Transfer complete'
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        """ retrbinary
+
+            Answer a RETR command, reading the file from byte rest into a
+            reused buffer and passing blocks of up to blocksize bytes to
+            callback.
+        """
+        verb, _, path = cmd.partition(' ')
+        if not verb.upper() == 'RETR':
+            raise ftplib.error_perm('502 Command not implemented: '+verb)
+        if self.remote:
+            callback = rate_limited(callback, 'geobytes',
+                settings.geobyterate)
+        controller = self.controller
+        buf = memoryview(bytearray(max(8192, blocksize)))
+        self.aborted = False
+        stream = self.open_read(path, rest or 0)
+        complete = False
+        try:
+            while True:
+                if self.aborted:
+                    raise EOFError('transfer aborted')
+                try:
+                    nread = stream.readinto(buf)
+                except http.client.HTTPException as e:
+                    raise ftplib.error_temp('426 transfer failed: '+str(e))
+                if not nread:
+                    complete = True
+                    break
+                if controller:
+                    controller.record_bytes(nread)
+                callback(buf[:nread])
+        finally:
+            stream.close()
+            if not complete:
+                self.reset()
+        return '226 Transfer complete'
+
+    def reset(self):
+        """ reset
+
+            Drop state left by an incomplete transfer.
+        """
+        pass
+
+    def abort(self):
+        """ abort
+
+            Abort a transfer stopped early, as ftplib.FTP.abort().
+            retrbinary() already dropped its state, so this only replies.
+        """
+        return '226 Abort successful'
+
+    def abort_transfer(self):
+        """ abort_transfer
+
+            Stop a transfer running in another thread at its next block.
+        """
+        self.aborted = True
+
+    def close(self):
+        self.sock = None
+        release_lease(self.leaseid)
+        self.leaseid = None
+
+    def quit(self):
+        self.close()
+        return '221 Goodbye'
+
+class LocalSession(MirrorSession):
+    """ LocalSession
+
+        Session reading a local dir with the GEO tree layout.
+
+        Arguments:
+            * root (str) : Path of the mirror dir.
+            * leaseid (int) : Connection lease held, or None.
+    """
+    remote = False
+
+    def __init__(self, root, leaseid=None):
+        super().__init__(leaseid)
+        self.root = root
+        if not os.path.isdir(root):
+            raise ftplib.error_perm('550 No such mirror dir: '+root)
+
+    def localpath(self, path):
+        return os.path.join(self.root, *[token for token in path.split('/')
+            if token and token != '..'])
+
+    def stat(self, path):
+        try:
+            st = os.stat(self.localpath(path))
+        except FileNotFoundError:
+            raise ftplib.error_perm('550 No such file: '+path)
+        return st.st_size, datetime.datetime.fromtimestamp(st.st_mtime,
+            datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+    def listnames(self, dirpath):
+        try:
+            return sorted(entry.name for entry in os.scandir(
+                self.localpath(dirpath)) if entry.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            raise ftplib.error_perm('550 No such directory: '+dirpath)
+
+    def open_read(self, path, rest=0):
+        try:
+            stream = open(self.localpath(path), 'rb', buffering=0)
+        except FileNotFoundError:
+            raise ftplib.error_perm('550 No such file: '+path)
+        stream.seek(rest)
+        return stream
+
+class HTTPSession(MirrorSession):
+    """ HTTPSession
+
+        Session over one keep-alive HTTP(S) connection to a server with the
+        GEO tree layout, e.g. 'https://ftp.ncbi.nlm.nih.gov'. Dropped
+        connections are reopened on the next request.
+
+        Arguments:
+            * url (str) : Base URL of the endpoint.
+            * leaseid (int) : Connection lease held, or None.
+            * timeout (float) : Seconds to wait on any single read.
+    """
+    def __init__(self, url, leaseid=None, timeout=60):
+        super().__init__(leaseid)
+        self.url = url
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.conn = None
+        self.connect()
+
+    def connect(self):
+        """ connect
+
+            Open the HTTP(S) connection.
+        """
+        conncls = (http.client.HTTPSConnection if self.https else
+            http.client.HTTPConnection)
+        self.conn = conncls(self.host, self.port, timeout=self.timeout)
+        try:
+            self.conn.connect()
+        except OSError:
+            self.conn.close()
+            raise
+
+    def request(self, method, path, headers=None):
+        """ request
+
+            Send a request on the kept-alive connection, reconnecting once if
+            the server closed it, and map error statuses to ftplib errors.
+
+            Returns:
+                * resp (http.client.HTTPResponse) : Response with status 200
+                    or 206, to be read before the next request.
+        """
+        acquire('geocmds', 1, settings.geocmdrate)
+        target = quote(self.base+'/'+path.lstrip('/'))
+        for attempt in (0, 1):
+            try:
+                self.conn.request(method, target, headers=headers or {})
+                resp = self.conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                self.conn.close()
+                if attempt:
+                    raise ftplib.error_temp('421 '+method+' '+path
+                        +' failed: '+str(e))
+                self.connect()
+        if resp.status in (200, 206):
+            return resp
+        resp.read()
+        if resp.status in (404, 410, 403):
+            raise ftplib.error_perm('550 '+str(resp.status)+' '+resp.reason
+                +': '+path)
+        err = ftplib.error_temp('421 '+str(resp.status)+' '+resp.reason+': '
+            +path)
+        if self.controller:
+            self.controller.record_error(str(err))
+        raise err
+
+    def stat(self, path):
+        resp = self.request('HEAD', path)
+        resp.read()
+        size = resp.getheader('Content-Length')
+        modify = resp.getheader('Last-Modified')
+        if size is None or modify is None:
+            raise ftplib.error_perm('550 No size or date for '+path)
+        return int(size), email.utils.parsedate_to_datetime(modify).astimezone(
+            datetime.timezone.utc).replace(tzinfo=None)
+
+    def listnames(self, dirpath):
+        resp = self.request('GET', dirpath.rstrip('/')+'/')
+        page = resp.read().decode('utf-8', 'replace')
+        names = []
+        for href in re.findall(r'<a\s+href="([^"?#]+)"', page, re.I):
+            name = unquote(href)
+            if '/' in name or name in names:
+                # parent and sub dirs, and absolute links
+                continue
+            names.append(name)
+        return names
+
+    def open_read(self, path, rest=0):
+        headers = {'Range' : 'bytes='+str(rest)+'-'} if rest else {}
+        resp = self.request('GET', path, headers)
+        if rest and resp.status != 206:
+            self.conn.close()
+            self.connect()
+            raise ftplib.error_perm('554 Range not supported for '+path)
+        return resp
+
+    def reset(self):
+        # unread bytes of the response would corrupt the next one, so the 
+        # connection is reopened on the next request
+        self.conn.close()
+
+    def abort_transfer(self):
+        super().abort_transfer()
+        sock = self.conn.sock if self.conn else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+        super().close()
+
+def open_session(mirror, leaseid=None):
+    """ open_session
+
+        Open a session for an endpoint URL.
+
+        Arguments:
+            * mirror (str) : Endpoint URL, 'https://host[/path]',
+                'http://host[:port][/path]', 'file:///path', or a dir path.
+            * leaseid (int) : Connection lease held, released on close.
+
+        Returns:
+            * session (MirrorSession) : A LocalSession or HTTPSession.
+    """
+    parts = urlsplit(mirror)
+    if parts.scheme in ('http', 'https'):
+        return HTTPSession(mirror, leaseid)
+    if parts.scheme in ('', 'file'):
+        return LocalSession(unquote(parts.path), leaseid)
+    raise ValueError('Unsupported mirror URL: '+mirror)
@@ -7,38 +7,125 @@
     Commonly referenced functions for recount methylation server.
     
     Functions:
-    * gettime_ntp: Return an NTP timestamp as a string, for file versioning.
+    * query_ntp: Get the time from an NTP server.
+    * sync_ntp: Get the offset of the local clock from NTP time.
+    * gettime_ntp: Return an NTP timestamp as a string, for file versioning,
+        from the monotonic clock and an NTP offset synced once.
     * getlatest_filepath: Access the path to the latest version of a file in
         a provided files directory. References NTP timestamp in filename to 
         determine latest available file.
     * querydict: Form a dictionary object by reading in an edirect file.
-    * get_queryfilt_dict: Retrieve latest edirect query filtered file.
+    * get_queryfilt_dict: Retrieve latest edirect query filtered file, from
+        its binary map file (querymap.py) where one was compiled.
+    * queryfilt_mappath: Get the map file path of a query filtered file.
+    * get_queryfilt_gsmd: Retrieve the GSM to GSE ID map of the latest edirect
+        query filtered file.
 """
 
-import os, glob, socket, struct, sys, time, pickle, subprocess
+import os, glob, socket, struct, sys, time, pickle, subprocess, json
+import threading
 from datetime import datetime
 sys.path.insert(0, os.path.join("recountmethylation_server","src"))
 import settings; settings.init()
+from querymap import read_querymap, invert_querydict
 
-def gettime_ntp(addr='time.nist.gov'):
-    """ gettime_ntp
+_ntpsync = None # (NTP time, monotonic time, seconds until next sync)
+_ntplast = 0
+_ntplock = threading.Lock()
+
+def query_ntp(addr=settings.ntphost, timeout=settings.ntptimeout):
+    """ query_ntp
         
-        Get NTP Timestamp for file versioning.
+        Get the time from an NTP server, with one UDP round trip.
         
         Arguments
         * addr (str) : valid NTP address (e.g. '0.uk.pool.ntp.org', 
             'time.nist.gov' etc)
+        * timeout (float) : Seconds to wait for the reply.
         
         Returns
-        * timestamp (str) : NTP seconds timestamp, converted to string.
+        * ntptime (float) : NTP time, in seconds since the epoch. Raises 
+            OSError if the server cannot be reached.
     """
     TIME1970 = 2208988800
     client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    data = '\x1b' + 47 * '\0'
-    client.sendto(data.encode('utf-8'), (addr, 123))
-    data, address = client.recvfrom(1024)
-    t = struct.unpack('!12I', data)[10] - TIME1970
-    return str(t)
+    client.settimeout(timeout)
+    try:
+        data = '\x1b' + 47 * '\0'
+        client.sendto(data.encode('utf-8'), (addr, 123))
+        data, address = client.recvfrom(1024)
+    finally:
+        client.close()
+    seconds, fraction = struct.unpack('!12I', data)[10:12]
+    return seconds - TIME1970 + fraction / 2**32
+
+def sync_ntp(addr=settings.ntphost, cachepath=settings.ntpcachepath):
+    """ sync_ntp
+        
+        Get the offset of the local clock from NTP time, from the host-wide 
+        offset file if it is recent, or else from an NTP server, storing it to
+        the offset file. Without network, the last stored offset (or none) is
+        used, and the sync is retried after settings.ntpretry seconds.
+        
+        Arguments
+        * addr (str) : valid NTP address.
+        * cachepath (str) : Path of the host-wide offset file.
+        
+        Returns
+        * sync (tuple) : NTP time and monotonic time at the sync, and seconds
+            until the next sync.
+    """
+    cached = None
+    try:
+        with open(cachepath) as cachefile:
+            cached = json.load(cachefile)
+    except (OSError, ValueError):
+        pass
+    if cached and 0 <= time.time() - cached['synced'] < settings.ntpsyncttl:
+        return (time.time() + cached['offset'], time.monotonic(),
+            settings.ntpsyncttl - (time.time() - cached['synced']))
+    try:
+        ntptime = query_ntp(addr, settings.ntptimeout)
+    except OSError as e:
+        print("NTP sync with "+addr+" failed, using "+("last stored" if cached
+            else "local")+" clock offset: "+str(e))
+        offset = cached['offset'] if cached else 0
+        return (time.time() + offset, time.monotonic(), settings.ntpretry)
+    synced = time.time()
+    try:
+        os.makedirs(os.path.dirname(cachepath) or '.', exist_ok=True)
+        partpath = cachepath+'.'+str(os.getpid())
+        with open(partpath, 'w') as cachefile:
+            json.dump({'offset' : ntptime - synced, 'synced' : synced, 
+                'host' : addr}, cachefile)
+        os.replace(partpath, cachepath)
+    except OSError as e:
+        print("Could not store NTP clock offset: "+str(e))
+    return (ntptime, time.monotonic(), settings.ntpsyncttl)
+
+def gettime_ntp(addr=settings.ntphost):
+    """ gettime_ntp
+        
+        Get NTP Timestamp for file versioning. The clock offset from NTP time 
+        is synced on the first call (see sync_ntp()), and timestamps are then
+        served from the monotonic clock, without network, until the next 
+        sync. Timestamps never decrease within a process.
+        
+        Arguments
+        * addr (str) : valid NTP address (e.g. '0.uk.pool.ntp.org', 
+            'time.nist.gov' etc)
+        
+        Returns
+        * timestamp (str) : NTP seconds timestamp, converted to string.
+    """
+    global _ntpsync, _ntplast
+    with _ntplock:
+        now = time.monotonic()
+        if _ntpsync is None or now - _ntpsync[1] >= _ntpsync[2]:
+            _ntpsync = sync_ntp(addr, settings.ntpcachepath)
+            now = time.monotonic()
+        _ntplast = max(_ntplast, int(_ntpsync[0] + now - _ntpsync[1]))
+        return str(_ntplast)
 
 def getlatest_filepath(filepath, filestr, embeddedpattern=False, tslocindex=1,
     returntype='returnstr'):
@@ -135,7 +222,11 @@ def get_queryfilt_dict(filesdir='recount-methylation-files',
         * eqtarget: Name of equery files destination directory.
         
         Returns:
-        * gsefiltd (dict): GSE filtered query, as a dictionary object.
+        * gsefiltd (dict or querymap.IdMap): GSE filtered query (keys = GSE
+            IDs, values = GSM ID lists). Where a map file exists, this is a
+            read-only IdMap rather than a dict, so callers that modify it or
+            pass it across processes (e.g. to Celery tasks) should copy the
+            entries they need into a dict.
     """
     # eqpath = os.path.join('recount-methylation-files','equery')
     eqpath = settings.equerypath
@@ -143,6 +234,9 @@ def get_queryfilt_dict(filesdir='recount-methylation-files',
             embeddedpattern=True, tslocindex=1, returntype='returnlist'
         )
     if gsefilt_latest and len(gsefilt_latest)==1:
+        mappath = queryfilt_mappath(gsefilt_latest[0])
+        if os.path.exists(mappath):
+            return read_querymap(mappath)[0]
         gsefiltd = querydict(querypath=gsefilt_latest[0], splitdelim=' ')
         return gsefiltd
     else:
@@ -150,6 +244,48 @@ def get_queryfilt_dict(filesdir='recount-methylation-files',
             +"Are there more than one latest file at the search directory?")
         return
 
+def queryfilt_mappath(filtpath):
+    """ queryfilt_mappath
+
+        Get the path of the binary GSE and GSM ID map file (querymap.py) 
+        compiled with a filtered GSE query file.
+
+        Arguments:
+        * filtpath (str) : Path of a 'gsequery_filt.<timestamp>' file.
+
+        Returns:
+        * mappath (str) : Path of its 'gsequery_map.<timestamp>' file, which
+            may not exist.
+    """
+    timestamp = os.path.basename(filtpath).split('.')[1]
+    return os.path.join(os.path.dirname(filtpath), 
+        '.'.join([settings.gsemapstr, timestamp]))
+
+def get_queryfilt_gsmd():
+    """ get_queryfilt_gsmd
+        
+        Return the GSM to GSE ID map of the latest filtered GSE query file.
+        
+        Returns:
+        * gsmfiltd (dict or querymap.IdMap): GSM to GSE IDs map (keys = GSM 
+            IDs, values = GSE ID lists), read-only where a map file exists, 
+            as for get_queryfilt_dict().
+    """
+    eqpath = settings.equerypath
+    gsefilt_latest = getlatest_filepath(eqpath,'gsequery_filt', 
+            embeddedpattern=True, tslocindex=1, returntype='returnlist'
+        )
+    if gsefilt_latest and len(gsefilt_latest)==1:
+        mappath = queryfilt_mappath(gsefilt_latest[0])
+        if os.path.exists(mappath):
+            return read_querymap(mappath)[1]
+        return invert_querydict(querydict(querypath=gsefilt_latest[0], 
+            splitdelim=' '))
+    else:
+        print("Error: could not retrieve latest equery filt filepath! "
+            +"Are there more than one latest file at the search directory?")
+        return
+
 def monitor_processes(process_list, logpath, timelim=2800, statint=5):
     """ monitor_processes
         
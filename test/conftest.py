@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+""" conftest.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Shared pytest fixtures for tests run against the local GEO stand-in
+    servers in geostandin.py.
+
+    Notes:
+        * Modules under src/ call settings.init() on import, so fixtures set
+            their overrides (server address, limits) after all imports.
+        * Each test runs in its own temp working directory, as settings paths
+            (files dir, SQLite dbs) are relative to it.
+        * Host-wide GEO limits (ratelimit.py) are off, as for bench_dl.py.
+
+    Fixtures:
+        * workdir: Run the test in a fresh temp working directory.
+        * standin: Start a stand-in GEO FTP server and point settings at it.
+        * eutils_standin: Start a stand-in E-utilities server and point
+            settings at it.
+"""
+
+import os, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from geostandin import GEOTree, start_standin, start_eutils_standin
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ workdir
+
+        Run the test in a fresh temp working directory, with host-wide GEO
+        and E-utilities limits off.
+    """
+    monkeypatch.chdir(tmp_path)
+    for name in ['geomaxconn', 'geocmdrate', 'geobyterate', 'eutilsrate']:
+        monkeypatch.setattr(settings, name, 0)
+    return tmp_path
+
+@pytest.fixture
+def standin(workdir, monkeypatch):
+    """ standin
+
+        Start stand-in GEO FTP servers on free ports, with settings pointed at
+        the last one started. Call with a GEOTree and start_standin() keyword
+        arguments, e.g. 'standin(GEOTree(nsamples=8), failrate=0.3)'.
+    """
+    servers = []
+    def start(tree=None, **kwargs):
+        server = start_standin(tree=tree or GEOTree(nsamples=8,
+            idatsize=4096, softsize=4096), port=0, **kwargs)
+        servers.append(server)
+        monkeypatch.setattr(settings, 'ftphost', server.server_address[0])
+        monkeypatch.setattr(settings, 'ftpport', server.server_address[1])
+        monkeypatch.setattr(settings, 'geomirror', '')
+        return server
+    yield start
+    for server in servers:
+        server.shutdown(); server.server_close()
+
+@pytest.fixture
+def eutils_standin(workdir, monkeypatch):
+    """ eutils_standin
+
+        Start a stand-in E-utilities server on a free port, with settings 
+        pointed at it. Call with a GEOTree and start_eutils_standin() keyword
+        arguments.
+    """
+    servers = []
+    def start(tree=None, **kwargs):
+        server = start_eutils_standin(tree=tree or GEOTree(nsamples=8),
+            port=0, **kwargs)
+        servers.append(server)
+        monkeypatch.setattr(settings, 'eutilsurl', 'http://'
+            +server.server_address[0]+':'+str(server.server_address[1]))
+        return server
+    yield start
+    for server in servers:
+        server.shutdown(); server.server_close()
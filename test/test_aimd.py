@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+""" test_aimd.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of the AIMD limit on in-flight transfers (aimd.py), with
+    measurement windows closed by hand.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, time, threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from aimd import AIMDController
+
+def window(controller, nbytes, error=None):
+    """ window
+
+        Run a measurement window receiving nbytes, with an optional error
+        reply, and return the decision made.
+    """
+    controller.window_start = time.time() - controller.interval
+    if error:
+        controller.record_error(error)
+    else:
+        controller.record_bytes(nbytes)
+    return controller.decisions[-1]['action']
+
+def test_limit_decisions():
+    """ The limit grows while throughput improves, holds when it is flat,
+        halves on transient errors, and stays between 1 and maxconn.
+    """
+    controller = AIMDController(start=2, maxconn=5, interval=1000, gain=.1)
+    assert window(controller, 100) == 'increase' and controller.limit == 3
+    assert window(controller, 200) == 'increase' and controller.limit == 4
+    assert window(controller, 205) == 'hold' and controller.limit == 4
+    assert window(controller, 400) == 'increase' and controller.limit == 5
+    assert window(controller, 800) == 'increase' and controller.limit == 5
+    assert window(controller, 0, '421 Too many connections') == 'decrease'
+    assert controller.limit == 2
+    assert controller.decisions[-1]['errors'] == {'421' : 1}
+    # the baseline is reset, so the next window can grow again
+    assert window(controller, 10) == 'increase' and controller.limit == 3
+    for i in range(3):
+        window(controller, 0, '425 Can\'t open data connection')
+    assert controller.limit == 1
+    assert AIMDController(start=10, maxconn=3).limit == 3
+    assert AIMDController(start=0, maxconn=3).limit == 1
+
+def test_acquire_within_limit():
+    """ At most limit slots are taken, and a waiting acquire takes a slot
+        when one is released.
+    """
+    controller = AIMDController(start=2, maxconn=4, interval=1000)
+    assert controller.try_acquire() and controller.try_acquire()
+    assert not controller.try_acquire()
+    acquired = threading.Event()
+    def wait():
+        controller.acquire()
+        acquired.set()
+    thread = threading.Thread(target=wait, daemon=True)
+    thread.start()
+    assert not acquired.wait(.2)
+    controller.release()
+    assert acquired.wait(5)
+    assert controller.inflight == 2
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+""" test_dl.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of idat and soft file downloads (dl.py and dl_async.py) against the
+    stand-in GEO FTP server, on both download engines.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+        * RMDB is not queried (an empty date map is passed), as in bench_dl.py.
+"""
+
+import os, sys, asyncio
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from geostandin import GEOTree
+from dl import dl_idat, dl_soft
+from dl_async import dl_idat_async, dl_soft_async
+from dljournal import journal_begin
+from bench_dl import count_files
+
+ENGINES = ['ftplib', 'asyncio']
+
+def download(engine, target, idlist, **kwargs):
+    """ download
+
+        Download idats (for GSM IDs) or soft files (for GSE IDs) with an
+        engine, returning the download dictionary.
+    """
+    kwargs.setdefault('timestamp', '1')
+    kwargs.setdefault('nconn', 2)
+    kwargs.setdefault('datemap', {})
+    if engine == 'asyncio':
+        dlfun = dl_idat_async if target == 'idat' else dl_soft_async
+        return asyncio.run(dlfun(idlist, **kwargs))
+    dlfun = dl_idat if target == 'idat' else dl_soft
+    return dlfun(idlist, **kwargs)
+
+def stored_files(dldict, target='idat'):
+    """ stored_files
+
+        Get the ftp address and stored path of each new file in a download
+        dictionary. Idat records end with their validation status, and soft
+        records are followed by it.
+    """
+    if target == 'idat':
+        return {record[1] : record[2] for records in dldict.values() for
+            record in records if isinstance(record, list) and 
+            record[-1] is True}
+    return {records[-2][1] : records[-2][2] for records in dldict.values()
+        if records[-1] is True}
+
+def ids(tree, target):
+    return tree.gsmids() if target == 'idat' else tree.gseids()
+
+def nfiles(tree, target):
+    return len(tree.gsmids()) * 2 if target == 'idat' else len(tree.gseids())
+
+@pytest.mark.parametrize('target', ['idat', 'soft'])
+@pytest.mark.parametrize('engine', ENGINES)
+def test_resume_after_failures(standin, engine, target):
+    """ Transfers aborted mid-file resume with REST and complete.
+    """
+    tree = GEOTree(nsamples=40, samples_per_gse=2, idatsize=65536,
+        softsize=65536)
+    server = standin(tree, failrate=0.3)
+    dldict = download(engine, target, ids(tree, target), retries_files=10)
+    stored = stored_files(dldict, target)
+    assert len(stored) == nfiles(tree, target)
+    for ftpaddress, filepath in stored.items():
+        with open(filepath, 'rb') as f:
+            assert f.read() == tree.content(ftpaddress)
+    assert server.stats['RETR'] > len(stored)
+    assert server.stats.get('REST', 0) > 0
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_shared_gsm_downloaded_once(standin, engine):
+    """ A GSM claimed by one GSE task is reused, not downloaded, by another
+        task in the same run.
+    """
+    tree = GEOTree(nsamples=12, idatsize=4096)
+    server = standin(tree)
+    gsms = tree.gsmids()
+    first, second = gsms[:8], gsms[4:]
+    dldicts = []
+    for task, gsmlist in [('GSE1', first), ('GSE2', second)]:
+        temp_dir, timestamp = journal_begin(task, '1')
+        dldicts.append(download(engine, 'idat', gsmlist, claim='run1',
+            journal=task, temp_dir=temp_dir, timestamp=timestamp))
+    assert server.stats['RETR'] == len(gsms) * 2
+    assert len(stored_files(dldicts[0])) == len(first) * 2
+    assert len(stored_files(dldicts[1])) == len(gsms[8:]) * 2
+    for gsm_id in gsms[4:8]:
+        assert [record[-1] for record in dldicts[1][gsm_id][1:]] == [
+            'same_as_claim'] * 2
+
+@pytest.mark.parametrize('target', ['idat', 'soft'])
+@pytest.mark.parametrize('engine', ENGINES)
+def test_stat_policy_skips_unchanged(standin, engine, target):
+    """ Under the 'stat' policy, a second pass does not transfer files whose
+        remote size and date, and stored file, are unchanged.
+    """
+    tree = GEOTree(nsamples=8, idatsize=4096, softsize=4096)
+    server = standin(tree)
+    first = download(engine, target, ids(tree, target), validation='stat')
+    assert len(stored_files(first, target)) == nfiles(tree, target)
+    server.stats.clear()
+    server.stats.update({'commands' : 0, 'bytes' : 0})
+    second = download(engine, target, ids(tree, target), validation='stat',
+        timestamp='2')
+    assert server.stats.get('RETR', 0) == 0
+    assert stored_files(second, target) == {}
+    assert count_files(second, target) == count_files(first, target)
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_corrupt_gzip(standin, engine):
+    """ An idat failing gzip checks while expanded is not stored, and the
+        session it used is not reused mid-transfer, so the other files of the
+        same session are stored.
+    """
+    tree = GEOTree(nsamples=4, idatsize=4096)
+    gsm_id = tree.gsmids()[1]
+    dirpath = '/'.join(['geo', 'samples', gsm_id[:-3]+'nnn', gsm_id, 'suppl'])
+    corrupt = dirpath+'/'+tree.listdir(dirpath)[0]
+    tree.overrides[corrupt] = tree.content(corrupt)[:-40] + b'garbage' * 20
+    standin(tree)
+    dldict = download(engine, 'idat', tree.gsmids(), nconn=1, expand=True)
+    stored = stored_files(dldict)
+    assert len(stored) == len(tree.gsmids()) * 2 - 1
+    assert not corrupt in stored
+    assert [record[1] for record in dldict[gsm_id][1:]] == [corrupt,
+        corrupt.replace('_Grn.', '_Red.')]
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+""" test_eutils.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of GSE and GSM edirect queries (edirect_query.py, eutils.py)
+    against the stand-in E-utilities server.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+        * Expected query files are in the format of EDirect's 'xtract -element
+            Id Accession' (uid, then accessions, tab-separated), in the order
+            GEO returns records (descending uid).
+"""
+
+import os, sys, datetime
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from geostandin import GEOTree
+from edirect_query import gse_query, gsm_query, gsequery_filter
+from edirect_query import merge_docsums, get_query_state, equery_diff
+from edirect_query import gse_query_diffs
+from querymap import read_querymap
+
+RETMAX = 5
+
+def expected_lines(tree, kind):
+    """ expected_lines
+
+        Get the expected lines of a GSE or GSM query file for a tree.
+    """
+    ids = tree.gseids() if kind == 'gse' else tree.gsmids()
+    ids = sorted(ids, key=lambda x: -int(x[3:]))
+    return ['\t'.join([str(tree.uid(acc)), acc] + (tree.gse_gsmids(acc) if
+        kind == 'gse' else [])) for acc in ids]
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f]
+
+@pytest.fixture
+def tree(eutils_standin, monkeypatch):
+    """ tree
+
+        Serve a tree of 45 GSM IDs in 12 GSE IDs, paged RETMAX docsums at a
+        time, so the last page is partial.
+    """
+    monkeypatch.setattr(settings, 'eutilsretmax', RETMAX)
+    tree = GEOTree(nsamples=45, samples_per_gse=4)
+    tree.server = eutils_standin(tree)
+    return tree
+
+@pytest.mark.parametrize('kind', ['gse', 'gsm'])
+def test_query_pages(tree, kind):
+    """ A full query writes every docsum, fetched in pages from the search's
+        WebEnv and query key.
+    """
+    query = gse_query if kind == 'gse' else gsm_query
+    dldict = query(timestamp='1')
+    key = kind+'query'
+    lines = expected_lines(tree, kind)
+    assert dldict[key] == [kind+'_edirectquery.1', len(lines), True]
+    assert read_lines(os.path.join(settings.equerypath,
+        kind+'_edirectquery.1')) == lines
+    # one esearch, then one esummary per page
+    assert tree.server.stats['commands'] == 1 + -(-len(lines) // RETMAX)
+
+@pytest.mark.parametrize('kind', ['gse', 'gsm'])
+def test_query_unchanged(tree, kind):
+    """ A second query of an unchanged tree is merged from the stored query,
+        and not stored again.
+    """
+    query = gse_query if kind == 'gse' else gsm_query
+    query(timestamp='1')
+    dldict = query(timestamp='2')
+    assert dldict[kind+'query'][-1] is False
+    assert not os.path.exists(os.path.join(settings.equerypath,
+        kind+'_edirectquery.2'))
+
+def test_query_filter(tree):
+    """ The filter file and map of a GSE and GSM query list each GSE ID with
+        its GSM IDs.
+    """
+    gse_query(timestamp='1')
+    gsm_query(timestamp='1')
+    gsefiltl = gsequery_filter(timestamp='1')
+    gseids = sorted(tree.gseids(), key=lambda x: -int(x[3:]))
+    expected = [' '.join([gse] + tree.gse_gsmids(gse)) for gse in gseids]
+    assert gsefiltl == expected
+    assert read_lines(os.path.join(settings.equerypath,
+        'gsequery_filt.1')) == expected
+    gsed, gsmd = read_querymap(os.path.join(settings.equerypath,
+        settings.gsemapstr+'.1'))
+    assert {gse : gsed[gse] for gse in gsed} == {gse : tree.gse_gsmids(gse)
+        for gse in gseids}
+    assert len(gsmd) == len(tree.gsmids())
+
+def test_merge_docsums():
+    """ Updated records replace their stored lines in place, and new records
+        are added first.
+    """
+    oldlines = ['3\tGSE3\tGSM5', '2\tGSE2\tGSM3', '1\tGSE1\tGSM1']
+    newlines = ['5\tGSE5\tGSM9', '4\tGSE4', '2\tGSE2\tGSM3\tGSM4']
+    assert merge_docsums(oldlines, newlines) == ['5\tGSE5\tGSM9', '4\tGSE4',
+        '3\tGSE3\tGSM5', '2\tGSE2\tGSM3\tGSM4', '1\tGSE1\tGSM1']
+    assert merge_docsums(oldlines, []) == oldlines
+
+def test_query_incremental(tree):
+    """ A query after a stored one fetches only records dated since, and
+        merges them into the same lines as a full query.
+    """
+    gsm_query(timestamp='1')
+    tree.nsamples += 5
+    for gsm in tree.gsmids()[-5:]:
+        tree.updated[gsm] = datetime.datetime.now()
+    tree.server.stats['commands'] = 0
+    dldict = gsm_query(timestamp='2')
+    lines = expected_lines(tree, 'gsm')
+    assert dldict['gsmquery'] == ['gsm_edirectquery.2', len(lines), True]
+    assert read_lines(os.path.join(settings.equerypath,
+        'gsm_edirectquery.2')) == lines
+    # a dated esearch, one esummary page, and an esearch for the total count
+    assert tree.server.stats['commands'] == 3
+
+def test_query_unvalidated(tree):
+    """ A query file not validated is not stored, and records no query time.
+    """
+    dldict = gsm_query(validate=False, timestamp='1')
+    assert dldict['gsmquery'] == ['gsm_edirectquery.1', 45]
+    assert not os.path.exists(os.path.join(settings.equerypath,
+        'gsm_edirectquery.1'))
+    assert get_query_state(settings.gsmquerystr, 
+        settings.equerydbpath) is None
+
+def test_equery_diff(workdir):
+    """ GSE IDs added and removed, and GSM IDs added and removed in shared
+        GSE IDs, are found regardless of order.
+    """
+    qd1 = {'GSE1' : ['GSM1', 'GSM2'], 'GSE2' : ['GSM3'], 'GSE3' : ['GSM4']}
+    qd2 = {'GSE4' : ['GSM5'], 'GSE2' : ['GSM3'], 'GSE1' : ['GSM6', 'GSM1']}
+    assert equery_diff(qd1, qd2) == {'added' : ['GSE4'], 'removed' : 
+        ['GSE3'], 'changed' : {'GSE1' : {'added' : ['GSM6'], 'removed' : 
+        ['GSM2']}}}
+    assert equery_diff(qd1, qd1) == {'added' : [], 'removed' : [], 
+        'changed' : {}}
+    for name, qd in [('q1', qd1), ('q2', qd2), ('q3', dict(reversed(
+        list(qd1.items()))))]:
+        with open(name, 'w') as f:
+            for gse, gsmlist in qd.items():
+                f.write('\t'.join(['0', gse] + gsmlist)+'\n')
+    assert gse_query_diffs('q1', 'q2') == ['GSE4', 'GSE3', 'GSE1']
+    assert gse_query_diffs('q1', 'q3', rstat=True)
+    assert not gse_query_diffs('q1', 'q2', rstat=True)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+""" test_ftppool.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of the look-ahead map over a pool of FTP sessions
+    (ftppool.pipeline_map), with stub resolve and work functions.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+        * pipeline_map only reads the pool size, so the pool is a stub.
+"""
+
+import os, sys, time, threading
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from ftppool import pipeline_map
+
+class Pool:
+    def __init__(self, nconn):
+        self.nconn = nconn
+
+class Counter:
+    """ Counter
+
+        Count resolved items not yet taken by a worker, and the max seen.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = self.maxwaiting = 0
+        self.resolved = []
+    def resolve(self, item, pool):
+        with self.lock:
+            self.resolved.append(item)
+            self.waiting += 1
+            self.maxwaiting = max(self.maxwaiting, self.waiting)
+        if item % 7 == 3:
+            raise ValueError(item)
+        return item * 10
+    def work(self, item, value, pool):
+        with self.lock:
+            self.waiting -= 1
+        time.sleep(.002)
+        return value if isinstance(value, Exception) else value + 1
+
+def test_pipeline_order_and_depth():
+    """ Each item is resolved once and its result returned in order, with
+        resolve errors passed to the worker, and resolved items waiting
+        bounded by depth and the number of threads.
+    """
+    counter = Counter()
+    items = list(range(60))
+    results = pipeline_map(counter.work, counter.resolve, items, Pool(4),
+        depth=2, nresolve=1)
+    assert sorted(counter.resolved) == items
+    for item, result in zip(items, results):
+        if item % 7 == 3:
+            assert isinstance(result, ValueError)
+        else:
+            assert result == item * 10 + 1
+    # depth queued, plus one in hand per resolver and worker
+    assert counter.maxwaiting <= 2 + 4
+
+def test_pipeline_work_error():
+    """ An error in the work function is raised once all threads finish.
+    """
+    def work(item, value, pool):
+        if item == 5:
+            raise RuntimeError('failed transfer')
+        return value
+    with pytest.raises(RuntimeError):
+        pipeline_map(work, lambda item, pool: item, range(40), Pool(3),
+            depth=1, nresolve=1)
+    assert pipeline_map(work, lambda item, pool: item, [], Pool(3)) == []
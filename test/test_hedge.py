@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+""" test_hedge.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of hedged idat transfers (hedge.py, dl.retr_hedged, and
+    dl_async.retr_hedged_async) against the stand-in GEO FTP server.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, re, gzip
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from geostandin import GEOTree
+from hedge import HedgeMonitor
+from test_dl import ENGINES, download, stored_files
+
+def hedge_files(rootdir):
+    return [name for dirpath, dirnames, names in os.walk(rootdir) for name
+        in names if name.endswith('.hedge')]
+
+def test_straggler():
+    """ A transfer is a straggler once it has run past the delay below the
+        peer rate percentile, with enough peers completed.
+    """
+    monitor = HedgeMonitor(percentile=10, delay=0, minpeers=3)
+    for nbytes in [1000, 2000, 3000]:
+        peer = monitor.register()
+        peer.start -= 1
+        peer.add(nbytes)
+        assert not monitor.is_straggler(peer)
+        monitor.complete(peer)
+    fast, slow = monitor.register(), monitor.register()
+    fast.start -= 1; slow.start -= 1
+    fast.add(5000); slow.add(10)
+    assert not monitor.is_straggler(fast)
+    assert monitor.is_straggler(slow)
+    monitor.close()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_hedge_winner_kept(standin, engine, workdir, capsys):
+    """ Slow transfers are hedged, the first transfer to finish is kept, and
+        the files of the other are removed.
+    """
+    tree = GEOTree(nsamples=16, idatsize=65536)
+    standin(tree, slowrate=0.2, slowbandwidth=16384, seed=1)
+    temp_dir = str(workdir / 'temp')
+    os.makedirs(temp_dir)
+    dldict = download(engine, 'idat', tree.gsmids(), nconn=4, hedge=True,
+        expand=True, temp_dir=temp_dir)
+    stored = stored_files(dldict)
+    assert len(stored) == len(tree.gsmids()) * 2
+    for ftpaddress, filepath in stored.items():
+        with open(filepath, 'rb') as f:
+            assert f.read() == tree.content(ftpaddress)
+        with open(filepath[:-3], 'rb') as f:
+            assert f.read() == gzip.decompress(tree.content(ftpaddress))
+    nhedged, nwon = [int(n) for n in re.search(r'hedged (\d+) slow transfers,'
+        +r' (\d+) finished first', capsys.readouterr().out).groups()]
+    assert nwon > 0
+    assert hedge_files('.') == []
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_unhedged_leaves_no_files(standin, engine, workdir):
+    """ Transfers that are never hedged leave no hedge files behind, in a
+        temp dir kept after validation.
+    """
+    tree = GEOTree(nsamples=8, idatsize=4096)
+    standin(tree)
+    temp_dir = str(workdir / 'temp')
+    os.makedirs(temp_dir)
+    dldict = download(engine, 'idat', tree.gsmids(), hedge=True, expand=True,
+        temp_dir=temp_dir)
+    assert len(stored_files(dldict)) == len(tree.gsmids()) * 2
+    assert hedge_files('.') == []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+""" test_listcache.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of the listing cache (listcache.py): listing TTLs, fresh, stale,
+    and expired entries, and stale entries served while re-listed in the
+    background (dl.cached_listdir).
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, time, datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+import dl
+from geostandin import GEOTree
+from listcache import listing_ttl, get_cached_listing, get_cached_listings
+from listcache import set_cached_listing, cached_connect
+from transport import gsm_suppl_dir
+
+DAY = 86400.
+
+def listing(*ages):
+    """ listing
+
+        Get a listing of files modified ages days ago, or undated if None.
+    """
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    return {'f'+str(i) : {'size' : 10, 'modify' : None if age is None else
+        now - datetime.timedelta(days=age)} for i, age in enumerate(ages)}
+
+def age_entry(dirpath, ttls):
+    """ age_entry
+
+        Move the fetch time of a cached listing ttls TTLs into the past.
+    """
+    conn = cached_connect(settings.listcachedbpath)
+    with conn:
+        conn.execute("UPDATE listings SET fetched = fetched - ? * ttl WHERE"
+            +" dirpath = ?", (ttls, dirpath))
+
+def test_listing_ttl():
+    """ TTLs grow with the age of the newest file, between the base and max
+        TTL, and undated listings get the base TTL.
+    """
+    now = time.time()
+    args = dict(ttl=DAY, maxttl=30 * DAY, agefrac=.1)
+    assert listing_ttl(listing(1), now, **args) == DAY
+    assert abs(listing_ttl(listing(400, 100), now, **args) - 10 * DAY) < 60
+    assert listing_ttl(listing(1000), now, **args) == 30 * DAY
+    assert listing_ttl(listing(1000, None), now, **args) == DAY
+    assert listing_ttl({}, now, **args) == DAY
+
+def test_cached_states(workdir):
+    """ Entries are fresh within their TTL, stale within twice their TTL,
+        and expired after, and listings round-trip with their dates.
+    """
+    files = listing(2, None)
+    set_cached_listing('dir/', files)
+    assert get_cached_listing('dir/') == (files, 'fresh')
+    assert get_cached_listing('missing/') == (None, None)
+    age_entry('dir/', 1.5)
+    assert get_cached_listing('dir/') == (files, 'stale')
+    age_entry('dir/', 1)
+    assert get_cached_listing('dir/') == (files, 'expired')
+    set_cached_listing('dir2/', {})
+    assert get_cached_listings(['dir/', 'dir2/', 'missing/'],
+        chunksize=1) == {'dir/' : (files, 'expired'), 'dir2/' : ({}, 'fresh')}
+
+def test_stale_served_and_refreshed(standin):
+    """ A stale entry is returned without listing, and re-listed into the
+        cache by the background refresher.
+    """
+    tree = GEOTree(nsamples=2, idatsize=64, softsize=64)
+    standin(tree)
+    dirpath = gsm_suppl_dir(tree.gsmids()[0])
+    set_cached_listing(dirpath, {'old' : {'size' : 1, 'modify' : None}})
+    age_entry(dirpath, 1.5)
+    # no FTP session, so a listing in the foreground would fail
+    assert list(dl.cached_listdir(None, dirpath, usecache=True)) == ['old']
+    for i in range(100):
+        cached, state = get_cached_listing(dirpath)
+        if state == 'fresh':
+            break
+        time.sleep(.05)
+    assert state == 'fresh'
+    assert sorted(cached) == sorted(dirpath+name for name in
+        tree.listdir(dirpath))
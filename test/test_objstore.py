@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+""" test_objstore.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of the content-addressed idat object store (objstore.py).
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from filehash import file_sha256
+from objstore import object_path, has_object, store_object, link_object
+from objstore import dedupe_dir, prune_objects
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_store_and_link(workdir):
+    """ Identical content is stored once, with each filename a hard link to
+        the stored object.
+    """
+    objs = str(workdir / 'objects')
+    f1 = write('GSM1.1.a_Grn.idat.gz', b'same')
+    f2 = write('GSM2.1.a_Grn.idat.gz', b'same')
+    sha256 = file_sha256(f1)
+    objpath, isnew = store_object(f1, sha256, objs)
+    assert isnew and objpath == object_path(sha256, objs)
+    assert has_object(sha256, objs) and os.path.samefile(f1, objpath)
+    assert store_object(f2, objectspath=objs) == (objpath, False)
+    assert os.path.samefile(f2, objpath) and os.stat(objpath).st_nlink == 3
+    # storing again is a no-op
+    assert store_object(f1, sha256, objs) == (objpath, False)
+    assert link_object(sha256, 'GSM3.1.a_Grn.idat.gz', objs)
+    assert os.stat(objpath).st_nlink == 4
+    assert link_object('0' * 64, 'missing', objs) is None
+    assert not os.path.exists('missing')
+
+def test_dedupe_and_prune(workdir):
+    """ Migrating a dir links duplicate files to one object, and objects no
+        filename links to are pruned.
+    """
+    objs = str(workdir / 'objects')
+    os.mkdir('idats')
+    for name, data in [('a.idat', b'x' * 100), ('b.idat', b'x' * 100),
+        ('c.idat', b'y'), ('notes.txt', b'x' * 100)]:
+        write(os.path.join('idats', name), data)
+    os.link(os.path.join('idats', 'c.idat'), os.path.join('idats',
+        'c.hlink.idat'))
+    ddedupe = dedupe_dir('idats', objectspath=objs)
+    assert ddedupe == {'files' : 4, 'new_objects' : 2, 'bytes_freed' : 100}
+    assert os.path.samefile(os.path.join('idats', 'a.idat'),
+        os.path.join('idats', 'b.idat'))
+    assert os.stat(os.path.join('idats', 'notes.txt')).st_nlink == 1
+    assert prune_objects(objs) == 0
+    os.remove(os.path.join('idats', 'c.idat'))
+    os.remove(os.path.join('idats', 'c.hlink.idat'))
+    assert prune_objects(objs) == 1
+    assert has_object(file_sha256(os.path.join('idats', 'a.idat')), objs)
+    assert sum(len(files) for root, dirs, files in os.walk(objs)) == 1
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+""" test_querymap.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of the binary GSE and GSM ID maps of filtered queries (querymap.py)
+    and their use by utilities.get_queryfilt_dict().
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from querymap import write_querymap, read_querymap, invert_querydict
+from utilities import get_queryfilt_dict, get_queryfilt_gsmd
+
+GSED = {'GSE20' : ['GSM3', 'GSM1'], 'GSE5' : ['GSM1', 'GSM200'],
+    'GSE7' : []}
+
+def write_filt(gsed, timestamp='1'):
+    os.makedirs(settings.equerypath, exist_ok=True)
+    with open(os.path.join(settings.equerypath, 'gsequery_filt.'+timestamp),
+        'w') as filtfile:
+        for gse, gsmlist in gsed.items():
+            filtfile.write(' '.join([gse] + gsmlist)+'\n')
+
+def test_roundtrip(workdir):
+    mappath = write_querymap(GSED, str(workdir / 'map'))
+    gsed, gsmd = read_querymap(mappath)
+    assert list(gsed) == ['GSE5', 'GSE7', 'GSE20']
+    assert {gse : gsed[gse] for gse in gsed} == GSED
+    assert list(gsmd) == ['GSM1', 'GSM3', 'GSM200']
+    assert {gsm : sorted(gsmd[gsm]) for gsm in gsmd} == {gsm : sorted(gses)
+        for gsm, gses in invert_querydict(GSED).items()}
+    assert 'GSE5' in gsed and not 'GSE6' in gsed and not 'GSM1' in gsed
+
+def test_non_numeric_ids_skipped(workdir):
+    assert write_querymap({'GSE1' : ['SRX1']}, str(workdir / 'map')) is None
+
+def test_queryfilt_dict_with_and_without_map(workdir):
+    """ The latest filtered query reads the same from its map file as from
+        the text file, as a mapping of GSE IDs to GSM ID lists.
+    """
+    write_filt(GSED)
+    textd = get_queryfilt_dict()
+    assert isinstance(textd, dict)
+    write_querymap(GSED, os.path.join(settings.equerypath,
+        settings.gsemapstr+'.1'))
+    mapd = get_queryfilt_dict()
+    assert dict(mapd).keys() == textd.keys()
+    assert all(sorted(mapd[gse]) == sorted(textd[gse]) for gse in textd)
+    assert sorted(get_queryfilt_gsmd()['GSM1']) == ['GSE20', 'GSE5']
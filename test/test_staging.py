@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+""" test_staging.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of download staging (staging.py): staging dirs, preallocated disk
+    blocks, and atomic commits.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+        * Other filesystems, full disks, and cross-device renames are
+            simulated with stubs.
+"""
+
+import os, sys, errno, ctypes
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+import staging
+from staging import staging_dir, preallocate, commit_file
+
+def test_staging_dir(workdir, monkeypatch):
+    """ Downloads are staged in the temp dir on the same filesystem, and in
+        a '.staging' dir inside the destination otherwise.
+    """
+    assert staging_dir('dest', 'temp') == 'temp'
+    stat = os.stat
+    def other_fs(path, *args, **kwargs):
+        result = stat(path, *args, **kwargs)
+        if path != 'temp':
+            return result
+        fields = list(result)
+        fields[2] = result.st_dev + 1
+        return os.stat_result(fields)
+    monkeypatch.setattr(staging.os, 'stat', other_fs)
+    assert staging_dir('dest', 'temp') == os.path.join('dest', '.staging')
+    assert os.path.isdir(os.path.join('dest', '.staging'))
+
+def test_preallocate(workdir, monkeypatch):
+    """ Blocks are reserved up to the remote size without changing the file
+        size, and a full disk raises OSError.
+    """
+    monkeypatch.setattr(settings, 'dlpreallocate', True)
+    size = 1 << 20
+    with open('f', 'wb') as f:
+        f.write(b'x' * 10)
+        reserved = preallocate(f, size)
+        assert not preallocate(f, 10) and not preallocate(f, None)
+    assert os.path.getsize('f') == 10
+    if reserved:
+        assert os.stat('f').st_blocks * 512 >= size
+    monkeypatch.setattr(settings, 'dlpreallocate', False)
+    with open('g', 'wb') as f:
+        assert not preallocate(f, size)
+    assert os.stat('g').st_blocks == 0
+    def full(fd, mode, offset, length):
+        ctypes.set_errno(errno.ENOSPC)
+        return -1
+    monkeypatch.setattr(settings, 'dlpreallocate', True)
+    monkeypatch.setattr(staging, '_fallocate', full)
+    with open('h', 'wb') as f:
+        with pytest.raises(OSError) as e:
+            preallocate(f, size)
+    assert e.value.errno == errno.ENOSPC
+
+def test_commit_file(workdir, monkeypatch):
+    """ Staged files are renamed into place, or copied next to the
+        destination first when on another filesystem.
+    """
+    os.mkdir('dest')
+    with open('staged', 'w') as f:
+        f.write('new')
+    with open(os.path.join('dest', 'file'), 'w') as f:
+        f.write('old')
+    assert commit_file('staged', os.path.join('dest', 'file')) == \
+        os.path.join('dest', 'file')
+    assert open(os.path.join('dest', 'file')).read() == 'new'
+    assert not os.path.exists('staged')
+    with open('staged', 'w') as f:
+        f.write('newer')
+    replace = os.replace
+    def cross_device(src, dst):
+        if src == 'staged':
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        replace(src, dst)
+    monkeypatch.setattr(staging.os, 'replace', cross_device)
+    commit_file('staged', os.path.join('dest', 'file'))
+    assert open(os.path.join('dest', 'file')).read() == 'newer'
+    assert not os.path.exists('staged')
+    assert os.listdir('dest') == ['file']
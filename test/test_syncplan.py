@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+""" test_syncplan.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of sync plans (syncplan.py) from a stub equery filter, RMDB date
+    map, and cached listings.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from listcache import set_cached_listing
+from syncplan import plan_sync, format_plan, write_plan
+from transport import gsm_suppl_dir, gse_soft_dir
+
+OLD = datetime.datetime(2019, 1, 1, 12, 0, 0)
+NEW = datetime.datetime(2020, 1, 1, 12, 0, 0)
+GSEFILTD = {'GSE1' : ['GSM1', 'GSM2'], 'GSE2' : ['GSM2', 'GSM3'],
+    'GSE3' : ['GSM4']}
+
+def cache(dirpath, files):
+    set_cached_listing(dirpath, {dirpath+name : {'size' : size, 'modify' :
+        modify} for name, size, modify in files})
+
+def test_plan_sync(workdir):
+    """ Files to fetch are the listed (file, date) pairs not stored, files
+        listed without a date are reported apart, and directories missing
+        from the cache are reported unlisted.
+    """
+    gsm1, gsm2, gsm3 = [gsm_suppl_dir(gsm) for gsm in ['GSM1', 'GSM2',
+        'GSM3']]
+    # GSM1 unchanged, GSM2 updated, GSM3 listed by NLST, GSM4 not cached
+    cache(gsm1, [('GSM1_Grn.idat.gz', 100, OLD)])
+    cache(gsm2, [('GSM2_Grn.idat.gz', 200, NEW), ('GSM2_Red.idat.gz', None,
+        NEW)])
+    cache(gsm3, [('GSM3_Grn.idat.gz', None, None)])
+    for gse in ['GSE1', 'GSE2', 'GSE3']:
+        cache(gse_soft_dir(gse), [(gse+'_family.soft.gz', 50, OLD),
+            (gse+'_family.xml.tgz', 500, NEW)])
+    datemap = {gsm1+'GSM1_Grn.idat.gz' : [OLD], gsm2+'GSM2_Grn.idat.gz' :
+        [OLD], gse_soft_dir('GSE1')+'GSE1_family.soft.gz' : [OLD]}
+    plan = plan_sync(gse_list=['GSE1', 'GSE2'], gsefiltd=GSEFILTD,
+        datemap=datemap, listremote=False)
+    assert [file[1] for file in plan['files']] == [
+        gsm2+'GSM2_Grn.idat.gz', gsm2+'GSM2_Red.idat.gz',
+        gse_soft_dir('GSE2')+'GSE2_family.soft.gz']
+    assert plan['undated'] == [('GSM3', gsm3+'GSM3_Grn.idat.gz', None, None,
+        'idat')]
+    assert plan['nbytes'] == 250
+    assert plan['nunknown'] == 1
+    assert plan['gse_list'] == ['GSE1', 'GSE2']
+    assert plan['unlisted'] == []
+    assert plan['seconds'] is None
+    summary = format_plan(plan)
+    assert 'files to fetch: 3 (2 idat, 1 soft)' in summary
+    assert 'files of unknown date (no MLSD), not counted above: 1' in summary
+    write_plan(plan, 'plan.tsv')
+    with open('plan.tsv') as planfile:
+        rows = [line.rstrip('\n').split('\t') for line in planfile]
+    assert len(rows) == 5 and rows[-1][-1] == ''
+    plan = plan_sync(gse_list=['GSE3'], gsefiltd=GSEFILTD, datemap={},
+        listremote=False)
+    assert plan['unlisted'] == [gsm_suppl_dir('GSM4')]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+""" test_transport.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of sessions over non-FTP endpoints (transport.py): a local mirror
+    dir exported from the stand-in tree, and the stand-in HTTP server.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, ftplib, threading
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+from geostandin import GEOTree, start_http_standin
+from geostandin import HTTPStandinHandler, HTTPStandinServer
+from transport import MirrorSession, LocalSession, HTTPSession
+from transport import gsm_suppl_dir, open_session
+
+class IgnoreRangeHandler(HTTPStandinHandler):
+    """ IgnoreRangeHandler
+
+        Serves the stand-in tree, answering Range requests with the whole
+        file, as servers without Range support do.
+    """
+    def serve(self, body):
+        del self.headers['Range']
+        super().serve(body)
+
+@pytest.fixture
+def tree():
+    return GEOTree(nsamples=4, idatsize=4096)
+
+@pytest.fixture
+def http_server(workdir, tree):
+    servers = []
+    def start(handler=None):
+        if handler is None:
+            server = start_http_standin(tree=tree)
+        else:
+            server = HTTPStandinServer(('127.0.0.1', 0), handler)
+            server.tree, server.latency = tree, 0
+            server.lock = threading.Lock()
+            server.stats = {'commands': 0, 'bytes': 0}
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:'+str(server.server_address[1])
+    yield start
+    for server in servers:
+        server.shutdown(); server.server_close()
+
+def retr(session, path, rest=None):
+    blocks = []
+    reply = session.retrbinary('RETR '+path, lambda block: blocks.append(
+        bytes(block)), rest=rest)
+    return reply, b''.join(blocks)
+
+def sessions(tree, workdir, http_server):
+    mirror = str(workdir / 'mirror')
+    tree.export(mirror)
+    return [open_session('file://'+mirror), open_session(http_server())]
+
+def test_mirror_session_is_abstract():
+    with pytest.raises(TypeError):
+        MirrorSession()
+
+def test_list_and_read(tree, workdir, http_server):
+    """ Local and HTTP sessions list, date, and read files as the FTP
+        server does, and resume reads from an offset.
+    """
+    gsm_id = tree.gsmids()[0]
+    dirpath = gsm_suppl_dir(gsm_id)
+    names = tree.listdir(dirpath)
+    path = dirpath+names[0]
+    content = tree.content(path)
+    for session in sessions(tree, workdir, http_server):
+        assert sorted(session.listnames(dirpath)) == sorted(names)
+        assert session.size(path) == len(content)
+        assert session.sendcmd('MDTM '+path) == '213 '+tree.modtime(
+            path).strftime('%Y%m%d%H%M%S')
+        lines = []
+        session.retrlines('MLSD '+dirpath, lines.append)
+        assert sorted(line.split('; ')[1] for line in lines) == sorted(names)
+        assert retr(session, path) == ('226 Transfer complete', content)
+        assert retr(session, path, 100)[1] == content[100:]
+        with pytest.raises(ftplib.error_perm):
+            session.stat(dirpath+'missing.idat.gz')
+        session.close()
+        assert session.sock is None
+
+def test_http_range_ignored(tree, workdir, http_server):
+    """ A resumed read from a server ignoring Range fails with a 554 reply,
+        rather than appending the whole file, and the session stays usable.
+    """
+    session = HTTPSession(http_server(IgnoreRangeHandler))
+    gsm_id = tree.gsmids()[0]
+    path = gsm_suppl_dir(gsm_id)+tree.listdir(gsm_suppl_dir(gsm_id))[0]
+    with pytest.raises(ftplib.error_perm, match='^554'):
+        session.open_read(path, 100)
+    assert retr(session, path)[1] == tree.content(path)
+    session.close()
+
+def test_local_session_missing_root(workdir):
+    with pytest.raises(ftplib.error_perm):
+        LocalSession(str(workdir / 'missing'))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+""" test_utilities.py
+
+    Authors: Sean Maden, Abhi Nellore
+
+    Tests of NTP timestamps for file versioning (utilities.sync_ntp and
+    utilities.gettime_ntp), without network access.
+
+    Notes:
+        * Run with 'python3 -m pytest test' from the repo root.
+"""
+
+import os, sys, time, json
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src'))
+import settings
+settings.init()
+import utilities
+from utilities import sync_ntp, gettime_ntp
+
+@pytest.fixture
+def ntp(workdir, monkeypatch):
+    """ ntp
+
+        Start with no NTP sync in this process, and NTP queries answered by
+        a stub returning the local time plus 'ntp.offset', or raising OSError
+        if it is None. Queries made are counted in 'ntp.nqueries'.
+    """
+    class Stub:
+        offset = 100.
+        nqueries = 0
+        def query(self, addr, timeout=None):
+            self.nqueries += 1
+            if self.offset is None:
+                raise OSError('host unreachable')
+            return time.time() + self.offset
+    stub = Stub()
+    monkeypatch.setattr(utilities, 'query_ntp', stub.query)
+    monkeypatch.setattr(utilities, '_ntpsync', None)
+    monkeypatch.setattr(utilities, '_ntplast', 0)
+    return stub
+
+def test_sync_stores_offset(ntp):
+    """ A sync stores the clock offset, and later syncs within the ttl use
+        it without querying NTP.
+    """
+    cachepath = settings.ntpcachepath
+    ntptime, mono, ttl = sync_ntp('ntp.test', cachepath)
+    assert abs(ntptime - time.time() - 100) < 1 and ttl == settings.ntpsyncttl
+    with open(cachepath) as cachefile:
+        assert abs(json.load(cachefile)['offset'] - 100) < 1
+    ntp.offset = None
+    ntptime, mono, ttl = sync_ntp('ntp.test', cachepath)
+    assert ntp.nqueries == 1
+    assert abs(ntptime - time.time() - 100) < 1 and ttl <= settings.ntpsyncttl
+
+def test_sync_unreachable(ntp):
+    """ Without network, the last stored offset, or else the local clock, is
+        used, and the sync is retried after settings.ntpretry seconds.
+    """
+    cachepath = settings.ntpcachepath
+    ntp.offset = None
+    ntptime, mono, ttl = sync_ntp('ntp.test', cachepath)
+    assert abs(ntptime - time.time()) < 1 and ttl == settings.ntpretry
+    os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+    with open(cachepath, 'w') as cachefile:
+        json.dump({'offset' : 50., 'synced' : time.time()
+            - settings.ntpsyncttl - 1, 'host' : 'ntp.test'}, cachefile)
+    ntptime, mono, ttl = sync_ntp('ntp.test', cachepath)
+    assert abs(ntptime - time.time() - 50) < 1 and ttl == settings.ntpretry
+    assert ntp.nqueries == 2
+
+def test_gettime_ntp_never_decreases(ntp, monkeypatch):
+    """ Timestamps are served from one sync, and do not decrease when a new
+        sync steps the clock back.
+    """
+    stamps = [int(gettime_ntp('ntp.test')) for i in range(3)]
+    assert ntp.nqueries == 1
+    assert abs(stamps[0] - time.time() - 100) < 2
+    # sync again on every call, with the clock stepped back
+    monkeypatch.setattr(settings, 'ntpsyncttl', 0)
+    os.remove(settings.ntpcachepath)
+    monkeypatch.setattr(utilities, '_ntpsync', None)
+    ntp.offset = -1000.
+    stamps += [int(gettime_ntp('ntp.test')) for i in range(3)]
+    assert ntp.nqueries == 4
+    assert stamps == sorted(stamps)
+    assert stamps[-1] == stamps[2]
+
+def test_query_ntp_unreachable():
+    """ An NTP query to a host not serving NTP raises OSError, as sync_ntp
+        expects, within the timeout.
+    """
+    start = time.time()
+    with pytest.raises(OSError):
+        utilities.query_ntp('127.0.0.1', timeout=0.5)
+    assert time.time() - start < 2